@@ -3,15 +3,93 @@ AI функции для телеграм-бота
 """
 
 import re
+import threading
+import time
 from datetime import datetime
 from collections import Counter
+from events import event_bus, ORDER_CREATED, ORDER_STATUS_CHANGED
+from logger import logger
+from metrics import track_job
+from recommendation_store import RecommendationStore
+from faq_index import FAQIndex
+from spell_index import SpellChecker
+from churn_scores import ChurnScoring, REASONS
 
 class AIRecommendationEngine:
     def __init__(self, db):
         self.db = db
+        self.store = RecommendationStore(db)
     
     def get_personalized_recommendations(self, user_id, limit=5):
-        """Персональные рекомендации на основе AI"""
+        """Персональные рекомендации из хранилища; при промахе - расчет и запись"""
+        products = self.store.get_products(user_id, limit)
+        if products is None:
+            self.refresh_user_recommendations([user_id])
+            products = self.store.get_products(user_id, limit) or []
+        return products
+    
+    def compute_recommendations(self, user_id, limit=10):
+        """Ранжированный список id товаров: похожие на купленные,
+        затем любимые категории, затем трендовые; без уже купленных
+        """
+        purchased = {row[0] for row in self.db.execute_query(
+            'SELECT product_id FROM user_products WHERE user_id = ?', (user_id,)
+        ) or []}
+        
+        ranked = []
+        for source in (
+            self.db.item_similarity.recommend_for_user(user_id, limit),
+            self.get_category_recommendations(user_id, limit),
+            self.get_trending_products(limit + len(purchased))
+        ):
+            for product in source or []:
+                if product[0] not in purchased and product[0] not in ranked:
+                    ranked.append(product[0])
+            if len(ranked) >= limit:
+                break
+        return ranked[:limit]
+    
+    def refresh_user_recommendations(self, user_ids):
+        """Пересчет и запись списков пользователей одной транзакцией"""
+        size = self.store.config['store_size']
+        entries = [(user_id, self.compute_recommendations(user_id, size)) for user_id in user_ids]
+        with self.db.transaction():
+            self.store.put_many(entries)
+        return len(entries)
+    
+    def refresh_recommendation_store(self):
+        """Пакетное заполнение хранилища: покупатели без действующего списка"""
+        refreshed = 0
+        last_id = 0
+        with track_job('recommendation_store'):
+            while True:
+                user_ids = self.store.stale_users(last_id)
+                if not user_ids:
+                    break
+                refreshed += self.refresh_user_recommendations(user_ids)
+                last_id = user_ids[-1]
+        if refreshed:
+            logger.info(f"Хранилище рекомендаций: обновлено {refreshed} пользователей")
+        return refreshed
+    
+    def start_recommendation_store(self):
+        """Сброс списков при заказе и фоновое дозаполнение хранилища"""
+        event_bus.subscribe(ORDER_CREATED, self.store.handle_order_event)
+        interval = self.store.config['store_refresh_interval']
+        
+        def store_worker():
+            while True:
+                try:
+                    self.refresh_recommendation_store()
+                    time.sleep(interval)
+                except Exception as e:
+                    logger.error(f"Ошибка заполнения хранилища рекомендаций: {e}")
+                    time.sleep(600)
+        
+        threading.Thread(target=store_worker, name='recommendation-store', daemon=True).start()
+    
+    def get_category_recommendations(self, user_id, limit=5):
+        """Рекомендации по любимым категориям и ценовому диапазону"""
         # Анализируем историю покупок пользователя
         user_purchases = self.db.execute_query('''
             SELECT p.category_id, p.price, oi.quantity
@@ -80,52 +158,31 @@ class AIRecommendationEngine:
         ''', (limit,))
     
     def get_collaborative_recommendations(self, user_id, limit=5):
-        """Коллаборативная фильтрация - "Покупатели также покупали" """
-        # Находим похожих пользователей
-        similar_users = self.db.execute_query('''
-            SELECT DISTINCT o2.user_id, COUNT(*) as common_products
-            FROM order_items oi1
-            JOIN orders o1 ON oi1.order_id = o1.id
-            JOIN order_items oi2 ON oi1.product_id = oi2.product_id
-            JOIN orders o2 ON oi2.order_id = o2.id
-            WHERE o1.user_id = ? AND o2.user_id != ? 
-            AND o1.status != 'cancelled' AND o2.status != 'cancelled'
-            GROUP BY o2.user_id
-            HAVING common_products >= 2
-            ORDER BY common_products DESC
-            LIMIT 10
-        ''', (user_id, user_id))
-        
-        if not similar_users:
-            return self.get_trending_products(limit)
+        """Коллаборативная фильтрация - "Покупатели также покупали".
         
-        # Получаем товары, которые покупали похожие пользователи
-        similar_user_ids = [user[0] for user in similar_users]
-        placeholders = ','.join('?' * len(similar_user_ids))
+        Соседи купленных товаров читаются из модели похожих товаров
+        (ItemSimilarity), которая обновляется по мере поступления заказов.
+        """
+        recommendations = self.db.item_similarity.recommend_for_user(user_id, limit)
         
-        recommendations = self.db.execute_query(f'''
-            SELECT p.*, c.name as category_name,
-                   COUNT(*) as recommendation_score
-            FROM products p
-            JOIN categories c ON p.category_id = c.id
-            JOIN order_items oi ON p.id = oi.product_id
-            JOIN orders o ON oi.order_id = o.id
-            WHERE p.is_active = 1
-            AND o.user_id IN ({placeholders})
-            AND o.status != 'cancelled'
-            AND p.id NOT IN (
-                SELECT DISTINCT oi2.product_id
-                FROM order_items oi2
-                JOIN orders o2 ON oi2.order_id = o2.id
-                WHERE o2.user_id = ?
-            )
-            GROUP BY p.id
-            ORDER BY recommendation_score DESC, p.views DESC
-            LIMIT ?
-        ''', (*similar_user_ids, user_id, limit))
+        if not recommendations:
+            return self.get_trending_products(limit)
         
         return recommendations
     
+    def get_similar_products(self, product_id, limit=5):
+        """Товары, которые покупают вместе с данным"""
+        return self.db.item_similarity.similar_products(product_id, limit)
+    
+    def start_similarity_updates(self):
+        """Обновление модели похожих товаров по событиям заказов"""
+        similarity = self.db.item_similarity
+        event_bus.subscribe(ORDER_CREATED, similarity.handle_order_event)
+        event_bus.subscribe(ORDER_STATUS_CHANGED, similarity.handle_order_event)
+        
+        # Первое построение может быть долгим - не задерживаем запуск
+        threading.Thread(target=similarity.ensure_built, name='item-similarity', daemon=True).start()
+    
     def analyze_search_intent(self, search_query):
         """Анализ намерений поиска"""
         query_lower = search_query.lower()
@@ -212,11 +269,12 @@ class ChatbotSupport:
     def __init__(self, db):
         self.db = db
         self.faq_data = self.load_faq()
+        self.spelling = SpellChecker(db)
         self.context_memory = {}
     
     def load_faq(self):
-        """Загрузка базы знаний FAQ"""
-        return {
+        """Загрузка базы знаний FAQ и построение ее индекса"""
+        faq_data = {
             'доставка': {
                 'keywords': ['доставка', 'доставить', 'курьер', 'получить', 'адрес'],
                 'answer': '''
@@ -317,29 +375,15 @@ class ChatbotSupport:
                 '''
             }
         }
+        
+        self.faq_index = FAQIndex(faq_data)
+        return faq_data
     
     def find_best_answer(self, user_question):
-        """Поиск лучшего ответа на вопрос"""
-        question_lower = user_question.lower()
-        
-        best_match = None
-        best_score = 0
-        
-        for topic, data in self.faq_data.items():
-            score = 0
-            for keyword in data['keywords']:
-                if keyword in question_lower:
-                    score += 1
-            
-            # Бонус за точное совпадение
-            if topic in question_lower:
-                score += 2
-            
-            if score > best_score:
-                best_score = score
-                best_match = data['answer']
+        """Поиск лучшего ответа на вопрос по индексу FAQ"""
+        best_match = self.faq_index.best_answer(user_question)
         
-        if best_score >= 1:
+        if best_match:
             return best_match
         
         return self.generate_fallback_response(user_question)
@@ -368,34 +412,22 @@ class ChatbotSupport:
         """Умные предложения для поиска"""
         suggestions = []
         
-        # Исправление опечаток (простая реализация)
-        common_typos = {
-            'телефн': 'телефон',
-            'айфон': 'iphone',
-            'ноутбк': 'ноутбук',
-            'кросовки': 'кроссовки',
-            'футбока': 'футболка'
-        }
-        
+        # Исправление опечаток по словарю каталога и поисковых запросов
         corrected_query = query.lower()
-        for typo, correction in common_typos.items():
-            corrected_query = corrected_query.replace(typo, correction)
-        
-        if corrected_query != query.lower():
+        did_you_mean = self.spelling.suggest(query)
+        if did_you_mean:
+            corrected_query = did_you_mean[0]
             suggestions.append(f"Возможно, вы имели в виду: <b>{corrected_query}</b>")
+            if len(did_you_mean) > 1:
+                suggestions.append(f"Другие варианты: {', '.join(did_you_mean[1:])}")
         
         # Похожие запросы
-        similar_products = self.db.execute_query('''
-            SELECT name FROM products 
-            WHERE name LIKE ? AND is_active = 1
-            ORDER BY views DESC
-            LIMIT 3
-        ''', (f'%{query[:5]}%',))
+        similar_products = self.db.search_products(corrected_query, limit=3, match_any=True)
         
         if similar_products:
             suggestions.append("Похожие товары:")
             for product in similar_products:
-                suggestions.append(f"• {product[0]}")
+                suggestions.append(f"• {product[1]}")
         
         return suggestions
     
@@ -489,32 +521,17 @@ class ChatbotSupport:
             season = 'autumn'
             seasonal_keywords = ['осенний', 'джинсы', 'свитер', 'ботинки']
         
-        # Ищем сезонные товары
-        seasonal_products = []
-        for keyword in seasonal_keywords:
-            products = self.db.execute_query('''
-                SELECT * FROM products 
-                WHERE (name LIKE ? OR description LIKE ?) 
-                AND is_active = 1
-                ORDER BY views DESC
-                LIMIT 2
-            ''', (f'%{keyword}%', f'%{keyword}%'))
-            
-            seasonal_products.extend(products)
-        
-        # Убираем дубликаты
-        seen_ids = set()
-        unique_products = []
-        for product in seasonal_products:
-            if product[0] not in seen_ids:
-                unique_products.append(product)
-                seen_ids.add(product[0])
+        # Ищем сезонные товары одним запросом по любому из ключевых слов
+        seasonal_products = self.db.search_products(
+            ' '.join(seasonal_keywords), limit=5, match_any=True
+        )
         
-        return unique_products[:5]
+        return seasonal_products or []
 
 class SmartNotificationAI:
     def __init__(self, db):
         self.db = db
+        self.churn = ChurnScoring(db)
     
     def determine_best_notification_time(self, user_id):
         """Определение лучшего времени для уведомлений"""
@@ -583,69 +600,36 @@ class SmartNotificationAI:
         return category[0][0] if category else "товары"
     
     def predict_user_churn_risk(self, user_id):
-        """Прогноз риска ухода клиента"""
-        # Анализируем активность пользователя
-        user_stats = self.db.execute_query('''
-            SELECT 
-                COUNT(o.id) as total_orders,
-                MAX(o.created_at) as last_order,
-                AVG(o.total_amount) as avg_order_value,
-                julianday('now') - julianday(MAX(o.created_at)) as days_since_last_order
-            FROM orders o
-            WHERE o.user_id = ? AND o.status != 'cancelled'
-        ''', (user_id,))[0]
-        
-        if not user_stats[0]:  # Нет заказов
-            return {'risk': 'low', 'score': 0, 'reason': 'Новый пользователь'}
-        
-        total_orders = user_stats[0]
-        days_since_last = user_stats[3] or 0
-        
-        # Рассчитываем риск
-        risk_score = 0
-        
-        # Фактор времени с последнего заказа
-        if days_since_last > 90:
-            risk_score += 40
-        elif days_since_last > 60:
-            risk_score += 25
-        elif days_since_last > 30:
-            risk_score += 10
-        
-        # Фактор количества заказов
-        if total_orders == 1:
-            risk_score += 20
-        elif total_orders < 3:
-            risk_score += 10
-        
-        # Фактор средней суммы заказа
-        avg_order = user_stats[2] or 0
-        if avg_order < 25:
-            risk_score += 15
-        
-        # Определяем уровень риска
-        if risk_score >= 60:
-            risk_level = 'high'
-            reason = 'Долго нет заказов, низкая активность'
-        elif risk_score >= 30:
-            risk_level = 'medium'
-            reason = 'Снижение активности'
-        else:
-            risk_level = 'low'
-            reason = 'Активный клиент'
+        """Прогноз риска ухода клиента из пересчитанных оценок"""
+        churn = self.churn.get(user_id)
+        if not churn or not churn[3]:  # Нет заказов
+            return {'risk': 'low', 'score': 0, 'reason': REASONS['new']}
         
         return {
-            'risk': risk_level,
-            'score': risk_score,
-            'reason': reason,
-            'days_since_last_order': days_since_last
+            'risk': churn[1],
+            'score': churn[2],
+            'reason': REASONS[churn[1]],
+            'days_since_last_order': churn[4] or 0,
+            'favorite_category': churn[6]
         }
     
     def generate_win_back_offer(self, user_id):
         """Генерация предложения для возврата клиента"""
-        churn_risk = self.predict_user_churn_risk(user_id)
-        preferences = AIRecommendationEngine(self.db).analyze_user_preferences(user_id)
-        
+        return self.build_win_back_offer(self.predict_user_churn_risk(user_id))
+    
+    def generate_win_back_offers(self, risks=('high', 'medium'), limit=None):
+        """Предложения клиентам в зоне риска одним запросом:
+        [(user_id, telegram_id, name, language, предложение)]
+        """
+        return [
+            (user_id, telegram_id, name, language,
+             self.build_win_back_offer({'risk': risk, 'favorite_category': category_name}))
+            for user_id, telegram_id, name, language, risk, score, category_id, category_name
+            in self.churn.at_risk_users(risks, limit)
+        ]
+    
+    def build_win_back_offer(self, churn_risk):
+        """Предложение по уровню риска и любимой категории"""
         # Определяем размер скидки
         if churn_risk['risk'] == 'high':
             discount = 25
@@ -655,10 +639,8 @@ class SmartNotificationAI:
             discount = 10
         
         # Персонализируем предложение
-        if preferences['favorite_categories']:
-            cat_id = preferences['favorite_categories'][0]
-            category_name = self.get_category_name(cat_id)
-            offer_text = f"Скидка {discount}% на товары категории {category_name}"
+        if churn_risk.get('favorite_category'):
+            offer_text = f"Скидка {discount}% на товары категории {churn_risk['favorite_category']}"
         else:
             offer_text = f"Скидка {discount}% на весь каталог"
         
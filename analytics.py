@@ -4,6 +4,7 @@
 
 from datetime import datetime, timedelta
 from utils import format_price
+from metrics import track_job
 
 class AnalyticsManager:
     def __init__(self, db):
@@ -16,30 +17,37 @@ class AnalyticsManager:
         if not end_date:
             end_date = datetime.now().strftime('%Y-%m-%d')
         
-        # Основная статистика продаж
+        # Основная статистика продаж по дневным итогам
         try:
+            self.db.sales_rollup.refresh()
+            
+            # Уникальные клиенты за период не складываются из дневных,
+            # поэтому считаются по заказам через индекс дня
             sales_data = self.db.execute_query('''
                 SELECT 
-                    COUNT(*) as orders_count,
-                    SUM(total_amount) as revenue,
-                    AVG(total_amount) as avg_order_value,
-                    COUNT(DISTINCT user_id) as unique_customers
-                FROM orders 
-                WHERE DATE(created_at) BETWEEN ? AND ?
+                    COALESCE(SUM(orders), 0) as orders_count,
+                    SUM(revenue) as revenue,
+                    SUM(revenue) / SUM(orders) as avg_order_value,
+                    (
+                        SELECT COUNT(DISTINCT user_id) FROM orders
+                        WHERE created_day BETWEEN ? AND ?
+                        AND status != 'cancelled'
+                    ) as unique_customers
+                FROM sales_daily
+                WHERE day BETWEEN ? AND ?
                 AND status != 'cancelled'
-            ''', (start_date, end_date))
+            ''', (start_date, end_date, start_date, end_date))
             
             # Топ товары за период
             top_products = self.db.execute_query('''
                 SELECT 
                     p.name,
-                    SUM(oi.quantity) as units_sold,
-                    SUM(oi.quantity * oi.price) as revenue
-                FROM order_items oi
-                JOIN products p ON oi.product_id = p.id
-                JOIN orders o ON oi.order_id = o.id
-                WHERE DATE(o.created_at) BETWEEN ? AND ?
-                AND o.status != 'cancelled'
+                    SUM(r.units) as units_sold,
+                    SUM(r.revenue) as revenue
+                FROM sales_daily_products r
+                JOIN products p ON r.product_id = p.id
+                WHERE r.day BETWEEN ? AND ?
+                AND r.status != 'cancelled'
                 GROUP BY p.id, p.name
                 ORDER BY revenue DESC
                 LIMIT 10
@@ -68,7 +76,8 @@ class AnalyticsManager:
                 try:
                     now = datetime.now()
                     if now.hour == 9 and now.minute == 0:
-                        self.send_daily_analytics_to_admins()
+                        with track_job('daily_analytics_report'):
+                            self.send_daily_analytics_to_admins()
                         time.sleep(60)  # Ждем минуту чтобы не отправить дважды
                     time.sleep(30)  # Проверяем каждые 30 секунд
                 except Exception as e:
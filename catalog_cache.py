@@ -0,0 +1,129 @@
+"""
+Кэш каталога товаров с версионированием
+"""
+
+import threading
+import time
+from types import MappingProxyType
+from logger import logger
+
+class CatalogSnapshot:
+    """Неизменяемый снимок каталога одной версии.
+    
+    Строки имеют тот же вид, что и результаты запросов DatabaseManager,
+    поэтому обработчики работают со снимком так же, как с базой.
+    """
+    
+    def __init__(self, version, categories, subcategories, products):
+        self.version = version
+        self.categories = tuple(categories)
+        self.products = MappingProxyType({row[0]: row for row in products})
+        
+        self.category_ids = MappingProxyType(self._index_by_name(self.categories))
+        
+        # Активные товары подкатегорий в порядке имени
+        products_by_subcategory = {}
+        for row in products:
+            if row[11] == 1:  # is_active, товар попадает в подкатегорию row[5]
+                products_by_subcategory.setdefault(row[5], []).append(row)
+        self.products_by_subcategory = MappingProxyType({
+            subcategory_id: tuple(rows) for subcategory_id, rows in products_by_subcategory.items()
+        })
+        self.product_ids = MappingProxyType(self._index_by_name(
+            row for rows in self.products_by_subcategory.values() for row in rows
+        ))
+        
+        # Подкатегории с товарами и их количеством, как в get_products_by_category
+        subcategories_by_category = {}
+        for row in subcategories:
+            count = len(self.products_by_subcategory.get(row[0], ()))
+            if count > 0:
+                # (id, name, emoji, products_count) в категории row[2]
+                subcategories_by_category.setdefault(row[2], []).append((row[0], row[1], row[3], count))
+        self.subcategories_by_category = MappingProxyType({
+            category_id: tuple(rows) for category_id, rows in subcategories_by_category.items()
+        })
+        self.subcategory_ids = MappingProxyType(self._index_by_name(subcategories))
+    
+    @staticmethod
+    def _index_by_name(rows):
+        """Имя -> id первой строки с таким именем"""
+        index = {}
+        for row in sorted(rows, key=lambda row: row[0]):
+            index.setdefault(row[1], row[0])
+        return index
+    
+    def get_categories(self):
+        return self.categories
+    
+    def get_subcategories(self, category_id):
+        return self.subcategories_by_category.get(category_id, ())
+    
+    def get_products_by_subcategory(self, subcategory_id, limit=10, offset=0):
+        return self.products_by_subcategory.get(subcategory_id, ())[offset:offset + limit]
+    
+    def get_product(self, product_id):
+        return self.products.get(product_id)
+    
+    def find_category_id(self, name):
+        return self.category_ids.get(name)
+    
+    def find_subcategory_id(self, name):
+        return self.subcategory_ids.get(name)
+    
+    def find_product(self, name):
+        product_id = self.product_ids.get(name)
+        return self.products[product_id] if product_id is not None else None
+
+class CatalogCache:
+    """Кэш каталога, который перестраивается при смене версии в базе.
+    
+    Версию увеличивают триггеры на категориях, подкатегориях и товарах,
+    поэтому изменения из любого процесса видны после следующей проверки.
+    Проверка - один запрос по первичному ключу не чаще check_interval.
+    """
+    
+    def __init__(self, db, check_interval=1.0):
+        self.db = db
+        self.check_interval = check_interval
+        self._snapshot = None
+        self._checked_at = 0
+        self._lock = threading.Lock()
+    
+    def snapshot(self):
+        """Актуальный снимок каталога"""
+        snapshot = self._snapshot
+        if snapshot is not None and time.monotonic() - self._checked_at < self.check_interval:
+            return snapshot
+        
+        with self._lock:
+            snapshot = self._snapshot
+            if snapshot is not None and time.monotonic() - self._checked_at < self.check_interval:
+                return snapshot
+            
+            version = self.db.get_catalog_version()
+            if snapshot is None or snapshot.version != version:
+                snapshot = self._load(version)
+                self._snapshot = snapshot
+            self._checked_at = time.monotonic()
+            return snapshot
+    
+    def _load(self, version):
+        """Загрузка каталога тремя запросами"""
+        categories = self.db.execute_query(
+            'SELECT * FROM categories WHERE is_active = 1 ORDER BY name'
+        ) or []
+        subcategories = self.db.execute_query(
+            'SELECT * FROM subcategories WHERE is_active = 1 ORDER BY name'
+        ) or []
+        products = self.db.execute_query(
+            'SELECT * FROM products ORDER BY name'
+        ) or []
+        
+        logger.info(f"Каталог загружен в кэш: версия {version}, товаров {len(products)}")
+        return CatalogSnapshot(version, categories, subcategories, products)
+    
+    def invalidate(self):
+        """Перечитать каталог при следующем обращении"""
+        with self._lock:
+            self._snapshot = None
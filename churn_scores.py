@@ -0,0 +1,238 @@
+"""
+Риск ухода клиентов: признаки одним сгруппированным запросом, оценка по столбцам
+"""
+
+import threading
+import time
+from datetime import datetime
+from config import CRM_CONFIG
+from logger import logger
+from metrics import track_job
+from periodic_refresh import PeriodicRefresh
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+RISKS = ('low', 'medium', 'high')
+REASONS = {
+    'new': 'Новый пользователь',
+    'low': 'Активный клиент',
+    'medium': 'Снижение активности',
+    'high': 'Долго нет заказов, низкая активность'
+}
+
+# Баллы за дни с последнего заказа: (больше дней, балл), от строгого порога
+RECENCY_POINTS = ((90, 40), (60, 25), (30, 10))
+# Баллы за один заказ и за два
+SINGLE_ORDER_POINTS = 20
+FEW_ORDERS_POINTS = 10
+# Баллы за средний чек ниже порога
+LOW_AVERAGE = 25
+LOW_AVERAGE_POINTS = 15
+# Границы уровней риска по сумме баллов
+HIGH_RISK = 60
+MEDIUM_RISK = 30
+
+# Признаки клиентов и любимая категория (чаще всего в позициях заказов,
+# при равенстве - купленная позже); {orders} и {users} - фильтры одного клиента
+CHURN_FEATURES = '''
+    WITH stats AS (
+        SELECT
+            o.user_id,
+            COUNT(o.id) as total_orders,
+            AVG(o.total_amount) as avg_order_value,
+            MAX(o.created_at) as last_order_date,
+            julianday('now') - julianday(MAX(o.created_at)) as days_since_last_order
+        FROM orders o
+        WHERE o.status != 'cancelled' {orders}
+        GROUP BY o.user_id
+    ),
+    categories_bought AS (
+        SELECT
+            o.user_id, p.category_id,
+            ROW_NUMBER() OVER (
+                PARTITION BY o.user_id ORDER BY COUNT(*) DESC, MAX(o.created_at) DESC
+            ) as position
+        FROM orders o
+        JOIN order_items oi ON oi.order_id = o.id
+        JOIN products p ON p.id = oi.product_id
+        WHERE o.status != 'cancelled' {orders}
+        GROUP BY o.user_id, p.category_id
+    )
+    SELECT
+        u.id,
+        COALESCE(s.total_orders, 0),
+        s.avg_order_value,
+        s.last_order_date,
+        s.days_since_last_order,
+        cb.category_id
+    FROM users u
+    LEFT JOIN stats s ON s.user_id = u.id
+    LEFT JOIN categories_bought cb ON cb.user_id = u.id AND cb.position = 1
+    WHERE u.is_admin = 0 {users}
+'''
+
+# Оценка клиента с названием любимой категории
+CHURN_SCORE = '''
+    SELECT cs.user_id, cs.risk, cs.score, cs.total_orders, cs.days_since_last_order,
+           cs.favorite_category_id, c.name
+    FROM user_churn_scores cs
+    LEFT JOIN categories c ON c.id = cs.favorite_category_id
+'''
+
+class ChurnScoring(PeriodicRefresh):
+    """Риск ухода всех клиентов в таблице user_churn_scores.
+    
+    Признаки (число заказов, средний чек, дни с последнего заказа,
+    любимая категория) загружаются одним запросом в столбцы, баллы
+    считаются по тем же правилам, что и прежний predict_user_churn_risk,
+    сразу для всех клиентов (без NumPy - построчно). Кампании выбирают
+    клиентов по индексу (risk, score) из сохраненных оценок; пересчет
+    идет только в фоне раз в churn_refresh_interval.
+    """
+    
+    JOB = 'churn_scores'
+    INTERVAL_KEY = 'churn_refresh_interval'
+    
+    _lock = threading.Lock()
+    
+    def __init__(self, db, config=None):
+        self.db = db
+        self.config = config or CRM_CONFIG
+    
+    def load_features(self, user_id=None):
+        """Столбцы признаков: ids, orders, avg_order, last_order, days, category"""
+        if user_id is None:
+            query, params = CHURN_FEATURES.format(orders='', users=''), ()
+        else:
+            query = CHURN_FEATURES.format(orders='AND o.user_id = ?', users='AND u.id = ?')
+            params = (user_id, user_id, user_id)
+        
+        columns = ([], [], [], [], [], [])
+        for row in self.db.stream_query(query, params, chunk_size=5000):
+            for column, value in zip(columns, row):
+                column.append(value)
+        return columns
+    
+    def score(self, orders, avg_order, days):
+        """Баллы и коды уровня риска (индексы RISKS) для столбцов признаков"""
+        if np is not None:
+            return self._score_numpy(orders, avg_order, days)
+        return self._score_python(orders, avg_order, days)
+    
+    def _score_numpy(self, orders, avg_order, days):
+        orders = np.asarray(orders, dtype=float)
+        avg_order = np.asarray([value or 0 for value in avg_order], dtype=float)
+        days = np.asarray([value or 0 for value in days], dtype=float)
+        
+        scores = np.select(
+            [days > bound for bound, _ in RECENCY_POINTS],
+            [points for _, points in RECENCY_POINTS],
+            default=0
+        )
+        scores = scores + np.select(
+            [orders == 1, orders < 3],
+            [SINGLE_ORDER_POINTS, FEW_ORDERS_POINTS],
+            default=0
+        )
+        scores = scores + np.where(avg_order < LOW_AVERAGE, LOW_AVERAGE_POINTS, 0)
+        
+        # Без заказов риск не оценивается
+        scores = np.where(orders == 0, 0, scores)
+        codes = (scores >= MEDIUM_RISK).astype(int) + (scores >= HIGH_RISK).astype(int)
+        return scores.astype(int).tolist(), codes.tolist()
+    
+    def _score_python(self, orders, avg_order, days):
+        scores, codes = [], []
+        for count, average, since in zip(orders, avg_order, days):
+            points = 0
+            if count:
+                since = since or 0
+                points += next((value for bound, value in RECENCY_POINTS if since > bound), 0)
+                if count == 1:
+                    points += SINGLE_ORDER_POINTS
+                elif count < 3:
+                    points += FEW_ORDERS_POINTS
+                if (average or 0) < LOW_AVERAGE:
+                    points += LOW_AVERAGE_POINTS
+            
+            scores.append(points)
+            codes.append(2 if points >= HIGH_RISK else 1 if points >= MEDIUM_RISK else 0)
+        return scores, codes
+    
+    def _rows(self, columns, computed_at):
+        """Строки user_churn_scores из столбцов признаков"""
+        ids, orders, avg_order, last_order, days, category = columns
+        scores, codes = self.score(orders, avg_order, days)
+        return [
+            (ids[index], RISKS[codes[index]], int(scores[index]), orders[index], avg_order[index],
+             last_order[index], days[index], category[index], computed_at)
+            for index in range(len(ids))
+        ]
+    
+    def _insert(self, rows):
+        return self.db.execute_many('''
+            INSERT OR REPLACE INTO user_churn_scores (
+                user_id, risk, score, total_orders, avg_order_value, last_order_date,
+                days_since_last_order, favorite_category_id, computed_at
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', rows)
+    
+    def refresh(self):
+        """Пересчет риска всех клиентов; возвращает {уровень: число клиентов}"""
+        with self._lock, track_job('churn_scores'):
+            started = time.perf_counter()
+            rows = self._rows(self.load_features(), datetime.now().strftime(TIME_FORMAT))
+            
+            with self.db.transaction():
+                self.db.execute_query('DELETE FROM user_churn_scores')
+                self._insert(rows)
+                self.mark_refreshed()
+            
+            counts = {risk: 0 for risk in RISKS}
+            for row in rows:
+                counts[row[1]] += 1
+            
+            logger.performance('churn_scores', time.perf_counter() - started, f"{len(rows)} клиентов")
+            return counts
+    
+    def refresh_user(self, user_id):
+        """Оценка одного клиента (например, зарегистрированного после пересчета)"""
+        rows = self._rows(self.load_features(user_id), datetime.now().strftime(TIME_FORMAT))
+        if rows:
+            self._insert(rows)
+        return len(rows)
+    
+    def get(self, user_id):
+        """Сохраненная оценка клиента: (user_id, risk, score, total_orders, days,
+        category_id, category_name); клиента без строки оценивает сразу
+        """
+        query = CHURN_SCORE + ' WHERE cs.user_id = ?'
+        row = self.db.execute_query(query, (user_id,))
+        if not row and self.refresh_user(user_id):
+            row = self.db.execute_query(query, (user_id,))
+        return row[0] if row else None
+    
+    def at_risk_users(self, risks=('high',), limit=None):
+        """Клиенты с заказами на уровнях risks, сначала с большим баллом:
+        (user_id, telegram_id, name, language, risk, score, category_id, category_name)
+        """
+        placeholders = ','.join('?' * len(risks))
+        query = f'''
+            SELECT cs.user_id, u.telegram_id, u.name, u.language, cs.risk, cs.score,
+                   cs.favorite_category_id, c.name
+            FROM user_churn_scores cs
+            JOIN users u ON u.id = cs.user_id
+            LEFT JOIN categories c ON c.id = cs.favorite_category_id
+            WHERE cs.risk IN ({placeholders}) AND cs.total_orders > 0
+            ORDER BY cs.score DESC
+        '''
+        params = list(risks)
+        if limit:
+            query += ' LIMIT ?'
+            params.append(limit)
+        return self.db.execute_query(query, params) or []
@@ -11,7 +11,22 @@ DEBUG = ENVIRONMENT == 'development'
 DATABASE_CONFIG = {
     'path': os.getenv('DATABASE_PATH', 'shop_bot.db'),
     'backup_interval': 3600,  # Резервное копирование каждый час
-    'max_connections': 10
+    'max_connections': 10,
+    'pool_timeout': 30,  # Ожидание свободного соединения, сек
+    'pool_health_check_interval': 60,  # Проверка простаивающих соединений, сек
+    'journal_mode': 'WAL',
+    'user_cache_size': 10000,  # Пользователей в памяти
+    'user_cache_ttl': 300,  # сек
+    'catalog_check_interval': 1.0,  # Проверка версии каталога не чаще, сек
+    'slow_query_threshold_ms': float(os.getenv('SLOW_QUERY_MS', '100')),
+    'query_stats_samples': 256,  # Последних замеров на отпечаток для перцентилей
+    'connection_pragmas': {
+        'synchronous': 'NORMAL',
+        'busy_timeout': 5000,  # мс
+        'cache_size': -20000,  # ~20MB
+        'mmap_size': 268435456,  # 256MB
+        'temp_store': 'MEMORY'
+    }
 }
 
 # Настройки безопасности
@@ -23,6 +38,37 @@ SECURITY_CONFIG = {
     'encryption_key': os.getenv('ENCRYPTION_KEY', 'your-encryption-key')
 }
 
+# Настройки CRM
+CRM_CONFIG = {
+    'rfm_mode': os.getenv('RFM_MODE', 'fixed'),  # fixed - пороги ниже, quantile - квинтили по клиентам
+    'rfm_thresholds': {
+        'recency': (30, 60, 90, 180),  # Дней с последнего заказа
+        'frequency': (2, 3, 5, 10),  # Заказов
+        'monetary': (50, 200, 500, 1000)  # Сумма покупок
+    },
+    'segments_refresh_interval': 6 * 3600,  # Пересчет сегментов, сек
+    'churn_refresh_interval': 6 * 3600  # Пересчет риска ухода, сек
+}
+
+# Настройки рекомендаций
+RECOMMENDATION_CONFIG = {
+    'similarity': os.getenv('ITEM_SIMILARITY', 'cosine'),  # cosine или jaccard
+    'neighbours': 20,  # Похожих товаров на товар
+    'min_co_purchases': 1,  # Минимум общих покупателей для пары
+    'store_size': 10,  # Товаров в сохраненном списке пользователя
+    'store_ttl': 24 * 3600,  # Срок жизни списка, сек
+    'store_batch': 200,  # Пользователей за одну транзакцию пересчета
+    'store_refresh_interval': 3600  # Дозаполнение хранилища, сек
+}
+
+# Настройки исправления опечаток в поиске
+SPELLING_CONFIG = {
+    'max_edit_distance': 2,  # Правок на слово (для слов до 5 букв - одна)
+    'prefix_length': 7,  # Букв слова, по которым строятся удаления
+    'min_query_count': 3,  # Повторов поискового запроса, чтобы его слова попали в словарь
+    'query_log_days': 90  # Глубина журнала поисковых запросов, дней
+}
+
 # Настройки логирования
 LOGGING_CONFIG = {
     'level': os.getenv('LOG_LEVEL', 'INFO'),
@@ -57,8 +103,24 @@ BOT_CONFIG = {
     'currency_symbol': os.getenv('CURRENCY_SYMBOL', '$'),
     'webhook_url': os.getenv('WEBHOOK_URL'),
     'webhook_secret': os.getenv('WEBHOOK_SECRET'),
+    'update_mode': os.getenv('UPDATE_MODE', 'polling'),  # polling или webhook
+    'webhook_host': os.getenv('WEBHOOK_HOST', '0.0.0.0'),
+    'webhook_port': int(os.getenv('WEBHOOK_PORT', '8443')),
+    'webhook_cert': os.getenv('WEBHOOK_CERT'),  # Без сертификата TLS завершает прокси
+    'webhook_key': os.getenv('WEBHOOK_KEY'),
     'max_message_length': 4096,
     'request_timeout': 30,
+    'api_pool_size': int(os.getenv('API_POOL_SIZE', '8')),  # Keep-alive соединений к Bot API
+    'update_workers': int(os.getenv('UPDATE_WORKERS', str(min(32, (os.cpu_count() or 1) * 4)))),
+    'update_queue_size': 1000,
+    'notification_workers': int(os.getenv('NOTIFICATION_WORKERS', '4')),
+    'rate_limits': {
+        'global_per_second': 30,  # Общий лимит Bot API на рассылки
+        'chat_per_second': 1,  # Личный чат
+        'group_per_minute': 20,  # Группа или канал
+        'burst': 3,
+        'max_retries': 3  # Повторов после ответа 429
+    },
     'admin_telegram_id': os.getenv('ADMIN_TELEGRAM_ID', '5720497431'),
     'admin_name': os.getenv('ADMIN_NAME', 'Admin')
 }
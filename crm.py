@@ -4,112 +4,23 @@ CRM модуль для управления клиентами
 
 from datetime import datetime
 from utils import format_price, format_date
+from customer_segments import CustomerSegmentation
 
 class CRMManager:
     def __init__(self, db):
         self.db = db
     
     def segment_customers(self):
-        """Сегментация клиентов по RFM анализу"""
-        customers = self.db.execute_query('''
-            SELECT 
-                u.id,
-                u.name,
-                u.telegram_id,
-                u.created_at,
-                COUNT(o.id) as total_orders,
-                SUM(o.total_amount) as total_spent,
-                AVG(o.total_amount) as avg_order_value,
-                MAX(o.created_at) as last_order_date,
-                julianday('now') - julianday(MAX(o.created_at)) as days_since_last_order
-            FROM users u
-            LEFT JOIN orders o ON u.id = o.user_id AND o.status != 'cancelled'
-            WHERE u.is_admin = 0
-            GROUP BY u.id, u.name, u.telegram_id, u.created_at
-        ''')
-        
-        segments = {
-            'champions': [],      # Лучшие клиенты
-            'loyal': [],          # Лояльные клиенты
-            'potential': [],      # Потенциально лояльные
-            'new': [],           # Новые клиенты
-            'promising': [],     # Перспективные
-            'need_attention': [], # Требуют внимания
-            'at_risk': [],       # В зоне риска
-            'hibernating': [],   # Спящие
-            'lost': []           # Потерянные
-        }
-        
-        for customer in customers:
-            user_id, name, telegram_id, reg_date, orders, spent, avg_order, last_order, days_since = customer
-            
-            # RFM скоринг
-            if orders == 0:
-                segments['new'].append(customer)
-                continue
-            
-            # Recency (дни с последнего заказа)
-            if days_since is None:
-                recency_score = 5
-            elif days_since <= 30:
-                recency_score = 5
-            elif days_since <= 60:
-                recency_score = 4
-            elif days_since <= 90:
-                recency_score = 3
-            elif days_since <= 180:
-                recency_score = 2
-            else:
-                recency_score = 1
-            
-            # Frequency (количество заказов)
-            if orders >= 10:
-                frequency_score = 5
-            elif orders >= 5:
-                frequency_score = 4
-            elif orders >= 3:
-                frequency_score = 3
-            elif orders >= 2:
-                frequency_score = 2
-            else:
-                frequency_score = 1
-            
-            # Monetary (общая сумма покупок)
-            if spent >= 1000:
-                monetary_score = 5
-            elif spent >= 500:
-                monetary_score = 4
-            elif spent >= 200:
-                monetary_score = 3
-            elif spent >= 50:
-                monetary_score = 2
-            else:
-                monetary_score = 1
-            
-            # Определяем сегмент
-            avg_score = (recency_score + frequency_score + monetary_score) / 3
-            
-            if avg_score >= 4.5:
-                segments['champions'].append(customer)
-            elif avg_score >= 4:
-                segments['loyal'].append(customer)
-            elif avg_score >= 3.5:
-                segments['potential'].append(customer)
-            elif avg_score >= 3:
-                if orders == 1:
-                    segments['new'].append(customer)
-                else:
-                    segments['promising'].append(customer)
-            elif avg_score >= 2.5:
-                segments['need_attention'].append(customer)
-            elif avg_score >= 2:
-                segments['at_risk'].append(customer)
-            elif days_since and days_since > 180:
-                segments['hibernating'].append(customer)
-            else:
-                segments['lost'].append(customer)
+        """Сегментация клиентов по RFM анализу.
         
-        return segments
+        Сегменты читаются из customer_segments; пересчитывает их
+        фоновое задание schedule_customer_segmentation.
+        """
+        return CustomerSegmentation(self.db).get_segments()
+    
+    def get_segment_customers(self, segment, limit=None):
+        """Клиенты одного RFM-сегмента"""
+        return CustomerSegmentation(self.db).get_segment(segment, limit)
     
     def get_customer_profile(self, user_id):
         """Получение полного профиля клиента"""
@@ -531,8 +442,7 @@ class CRMManager:
     
     def create_targeted_campaign(self, segment, campaign_type):
         """Создание таргетированной кампании"""
-        segments = self.segment_customers()
-        target_customers = segments.get(segment, [])
+        target_customers = self.get_segment_customers(segment)
         
         if not target_customers:
             return {'success': False, 'message': 'Нет клиентов в выбранном сегменте'}
@@ -0,0 +1,93 @@
+"""
+Потоковая выгрузка CSV: по частям в файл или в Telegram (sendDocument)
+"""
+
+import csv
+import io
+import os
+import tempfile
+import time
+import zlib
+from logger import logger
+
+# Строк CSV в одной части
+CHUNK_ROWS = 500
+
+def stream_csv(header, rows, format_row=None, progress=None, chunk_rows=CHUNK_ROWS):
+    """Текст CSV частями по chunk_rows строк.
+    
+    rows - любой итератор строк (например, DatabaseManager.stream_query),
+    format_row преобразует строку перед записью. progress(rows_written)
+    вызывается после каждой части и в конце выгрузки.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(header)
+    written = 0
+    
+    for row in rows:
+        writer.writerow(format_row(row) if format_row else row)
+        written += 1
+        if written % chunk_rows == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            if progress:
+                progress(written)
+    
+    tail = buffer.getvalue()
+    if tail:
+        yield tail
+    if progress:
+        progress(written)
+
+def encode_chunks(chunks, compress=False, encoding='utf-8'):
+    """Части текста в байтах; при compress - поток gzip"""
+    # wbits=31: zlib пишет заголовок и контрольную сумму формата gzip
+    compressor = zlib.compressobj(wbits=31) if compress else None
+    for chunk in chunks:
+        data = chunk.encode(encoding)
+        if compressor:
+            data = compressor.compress(data)
+        if data:
+            yield data
+    if compressor:
+        yield compressor.flush()
+
+def write_chunks(chunks, path, compress=False):
+    """Запись частей в файл; возвращает размер файла в байтах"""
+    size = 0
+    with open(path, 'wb') as file:
+        for data in encode_chunks(chunks, compress):
+            file.write(data)
+            size += len(data)
+    return size
+
+def log_progress(name, interval=5.0):
+    """Прогресс выгрузки в журнал не чаще interval секунд"""
+    state = {'logged_at': time.monotonic()}
+    
+    def progress(rows_written):
+        now = time.monotonic()
+        if now - state['logged_at'] >= interval:
+            state['logged_at'] = now
+            logger.info(f"Выгрузка {name}: {rows_written} строк")
+    
+    return progress
+
+def send_csv_document(api, chat_id, chunks, filename, compress=False, caption=None):
+    """Выгрузка CSV во временный файл и отправка документом.
+    
+    Возвращает ответ Bot API. Временный файл удаляется после отправки.
+    """
+    if compress and not filename.endswith('.gz'):
+        filename += '.gz'
+    
+    fd, path = tempfile.mkstemp(prefix='export_', suffix=os.path.splitext(filename)[1])
+    os.close(fd)
+    try:
+        size = write_chunks(chunks, path, compress)
+        logger.info(f"Выгрузка {filename} готова: {size} байт, отправка в чат {chat_id}")
+        return api.send_document(chat_id, path, filename=filename, caption=caption)
+    finally:
+        os.remove(path)
@@ -0,0 +1,233 @@
+"""
+RFM-сегментация клиентов по столбцам агрегатов заказов
+"""
+
+import bisect
+import statistics
+import threading
+import time
+from datetime import datetime
+from config import CRM_CONFIG
+from logger import logger
+from metrics import track_job
+from periodic_refresh import PeriodicRefresh
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+SEGMENTS = (
+    'champions',       # Лучшие клиенты
+    'loyal',           # Лояльные клиенты
+    'potential',       # Потенциально лояльные
+    'new',             # Новые клиенты
+    'promising',       # Перспективные
+    'need_attention',  # Требуют внимания
+    'at_risk',         # В зоне риска
+    'hibernating',     # Спящие
+    'lost'             # Потерянные
+)
+SEGMENT_CODES = {name: code for code, name in enumerate(SEGMENTS)}
+
+# Границы квинтилей для режима quantile
+QUANTILES = (0.2, 0.4, 0.6, 0.8)
+
+# Агрегаты заказов по каждому клиенту одним проходом
+CUSTOMER_AGGREGATES = '''
+    SELECT
+        u.id,
+        COUNT(o.id),
+        COALESCE(SUM(o.total_amount), 0),
+        AVG(o.total_amount),
+        MAX(o.created_at),
+        julianday('now') - julianday(MAX(o.created_at))
+    FROM users u
+    LEFT JOIN orders o ON u.id = o.user_id AND o.status != 'cancelled'
+    WHERE u.is_admin = 0
+    GROUP BY u.id
+'''
+
+# Строка клиента в формате прежнего segment_customers
+SEGMENT_CUSTOMERS = '''
+    SELECT
+        cs.user_id, u.name, u.telegram_id, u.created_at,
+        cs.total_orders, cs.total_spent, cs.avg_order_value, cs.last_order_date,
+        julianday('now') - julianday(cs.last_order_date),
+        cs.segment
+    FROM customer_segments cs
+    JOIN users u ON u.id = cs.user_id
+'''
+
+class CustomerSegmentation(PeriodicRefresh):
+    """RFM-сегменты всех клиентов в таблице customer_segments.
+    
+    Агрегаты загружаются одним запросом в столбцы, баллы R/F/M считаются
+    через searchsorted по порогам из CRM_CONFIG (фиксированным или
+    квинтилям), сегмент - по среднему баллу. Без NumPy те же пороги
+    применяются через bisect построчно. Потребители читают готовые
+    сегменты по индексу и сами их не пересчитывают; пересчет идет
+    в фоне раз в segments_refresh_interval.
+    """
+    
+    JOB = 'customer_segments'
+    INTERVAL_KEY = 'segments_refresh_interval'
+    
+    _lock = threading.Lock()
+    
+    def __init__(self, db, config=None):
+        self.db = db
+        self.config = config or CRM_CONFIG
+    
+    def load_aggregates(self):
+        """Столбцы агрегатов: ids, orders, spent, avg_order, last_order, days"""
+        columns = ([], [], [], [], [], [])
+        for row in self.db.stream_query(CUSTOMER_AGGREGATES, chunk_size=5000):
+            for column, value in zip(columns, row):
+                column.append(value)
+        return columns
+    
+    def thresholds(self, orders, spent, days):
+        """Пороги (recency, frequency, monetary) для текущего режима"""
+        fixed = self.config['rfm_thresholds']
+        if self.config.get('rfm_mode') != 'quantile':
+            return fixed['recency'], fixed['frequency'], fixed['monetary']
+        
+        buyers = [index for index, count in enumerate(orders) if count > 0]
+        if len(buyers) < 2:
+            return fixed['recency'], fixed['frequency'], fixed['monetary']
+        
+        def quantiles(values):
+            if np is not None:
+                return tuple(np.quantile(np.asarray(values, dtype=float), QUANTILES))
+            return tuple(statistics.quantiles(values, n=5, method='inclusive'))
+        
+        return (
+            quantiles([days[index] or 0 for index in buyers]),
+            quantiles([orders[index] for index in buyers]),
+            quantiles([spent[index] for index in buyers])
+        )
+    
+    def score(self, orders, spent, days, thresholds):
+        """Баллы R, F, M и коды сегментов для столбцов агрегатов"""
+        if np is not None:
+            return self._score_numpy(orders, spent, days, thresholds)
+        return self._score_python(orders, spent, days, thresholds)
+    
+    def _score_numpy(self, orders, spent, days, thresholds):
+        recency_bounds, frequency_bounds, monetary_bounds = (np.asarray(bounds, dtype=float) for bounds in thresholds)
+        orders = np.asarray(orders, dtype=float)
+        spent = np.asarray(spent, dtype=float)
+        days = np.asarray([value if value is not None else np.nan for value in days], dtype=float)
+        
+        # Давность: чем меньше дней, тем выше балл; граница входит в лучший балл
+        recency = 5 - np.searchsorted(recency_bounds, np.nan_to_num(days, nan=0.0), side='left')
+        frequency = 1 + np.searchsorted(frequency_bounds, orders, side='right')
+        monetary = 1 + np.searchsorted(monetary_bounds, spent, side='right')
+        
+        average = (recency + frequency + monetary) / 3
+        codes = np.select(
+            [
+                orders == 0,
+                average >= 4.5,
+                average >= 4,
+                average >= 3.5,
+                (average >= 3) & (orders == 1),
+                average >= 3,
+                average >= 2.5,
+                average >= 2,
+                days > 180
+            ],
+            [SEGMENT_CODES[name] for name in (
+                'new', 'champions', 'loyal', 'potential', 'new',
+                'promising', 'need_attention', 'at_risk', 'hibernating'
+            )],
+            default=SEGMENT_CODES['lost']
+        )
+        return recency.tolist(), frequency.tolist(), monetary.tolist(), codes.tolist()
+    
+    def _score_python(self, orders, spent, days, thresholds):
+        recency_bounds, frequency_bounds, monetary_bounds = thresholds
+        recency, frequency, monetary, codes = [], [], [], []
+        
+        for count, total, since in zip(orders, spent, days):
+            r = 5 - bisect.bisect_left(recency_bounds, since or 0)
+            f = 1 + bisect.bisect_right(frequency_bounds, count)
+            m = 1 + bisect.bisect_right(monetary_bounds, total)
+            average = (r + f + m) / 3
+            
+            if count == 0:
+                segment = 'new'
+            elif average >= 4.5:
+                segment = 'champions'
+            elif average >= 4:
+                segment = 'loyal'
+            elif average >= 3.5:
+                segment = 'potential'
+            elif average >= 3:
+                segment = 'new' if count == 1 else 'promising'
+            elif average >= 2.5:
+                segment = 'need_attention'
+            elif average >= 2:
+                segment = 'at_risk'
+            elif since and since > 180:
+                segment = 'hibernating'
+            else:
+                segment = 'lost'
+            
+            recency.append(r)
+            frequency.append(f)
+            monetary.append(m)
+            codes.append(SEGMENT_CODES[segment])
+        
+        return recency, frequency, monetary, codes
+    
+    def refresh(self):
+        """Пересчет сегментов всех клиентов; возвращает {сегмент: число клиентов}"""
+        with self._lock, track_job('customer_segments'):
+            started = time.perf_counter()
+            ids, orders, spent, avg_order, last_order, days = self.load_aggregates()
+            recency, frequency, monetary, codes = self.score(
+                orders, spent, days, self.thresholds(orders, spent, days)
+            )
+            
+            computed_at = datetime.now().strftime(TIME_FORMAT)
+            with self.db.transaction():
+                self.db.execute_query('DELETE FROM customer_segments')
+                self.db.execute_many('''
+                    INSERT INTO customer_segments (
+                        user_id, segment, recency_score, frequency_score, monetary_score,
+                        total_orders, total_spent, avg_order_value, last_order_date, computed_at
+                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ''', [
+                    (ids[index], SEGMENTS[codes[index]],
+                     int(recency[index]), int(frequency[index]), int(monetary[index]),
+                     orders[index], spent[index], avg_order[index], last_order[index], computed_at)
+                    for index in range(len(ids))
+                ])
+                self.mark_refreshed()
+            
+            counts = {name: 0 for name in SEGMENTS}
+            for code in codes:
+                counts[SEGMENTS[code]] += 1
+            
+            logger.performance('customer_segments', time.perf_counter() - started, f"{len(ids)} клиентов")
+            return counts
+    
+    def get_segments(self):
+        """Сохраненные сегменты: {сегмент: [строки клиентов]}; пусто до первого пересчета"""
+        segments = {name: [] for name in SEGMENTS}
+        for row in self.db.execute_query(SEGMENT_CUSTOMERS) or []:
+            segments[row[-1]].append(row[:-1])
+        return segments
+    
+    def get_segment(self, segment, limit=None):
+        """Клиенты одного сегмента из сохраненных, сначала с большей суммой покупок"""
+        query = SEGMENT_CUSTOMERS + ' WHERE cs.segment = ? ORDER BY cs.total_spent DESC'
+        params = [segment]
+        if limit:
+            query += ' LIMIT ?'
+            params.append(limit)
+        return [row[:-1] for row in self.db.execute_query(query, params) or []]
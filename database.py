@@ -2,35 +2,614 @@
 База данных для телеграм-бота интернет-магазина
 """
 
+import atexit
+import queue
+import re
 import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import lru_cache
+from catalog_cache import CatalogCache
+from config import DATABASE_CONFIG
+from events import event_bus, ORDER_CREATED, ORDER_STATUS_CHANGED, CART_UPDATED
+from logger import logger
+from metrics import registry
+from sales_rollup import SalesRollup
+from item_similarity import ItemSimilarity
+
+QUERY_DURATION = registry.histogram(
+    'bot_db_query_duration_seconds',
+    'Время выполнения SQL запросов по отпечатку',
+    ['query_id', 'statement']
+)
+QUERY_ERRORS = registry.counter(
+    'bot_db_query_errors_total',
+    'Ошибки SQL запросов по отпечатку',
+    ['query_id', 'statement']
+)
+
+class ConnectionPool:
+    """Ограниченный пул соединений SQLite, переиспользуемых между запросами"""
+    
+    def __init__(self, db_path, max_connections=10, timeout=30, health_check_interval=60,
+                 readonly=False, pragmas=None):
+        self.db_path = db_path
+        self.readonly = readonly
+        self.pragmas = pragmas or {}
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(max_connections)
+        self._lock = threading.Lock()
+        self._created = 0
+        self._closed = False
+        self._local = threading.local()
+    
+    def _connect(self):
+        """Открытие нового соединения"""
+        conn = sqlite3.connect(self.db_path, timeout=self.timeout, check_same_thread=False)
+        
+        # Профиль хранения применяется к каждому соединению
+        for name, value in self.pragmas.items():
+            conn.execute(f'PRAGMA {name} = {value}')
+        if self.readonly:
+            conn.execute('PRAGMA query_only = ON')
+        
+        with self._lock:
+            self._created += 1
+        return conn
+    
+    def _discard(self, conn):
+        """Закрытие соединения, выведенного из пула"""
+        try:
+            conn.close()
+        except Exception:
+            pass
+        with self._lock:
+            self._created -= 1
+    
+    def _is_healthy(self, conn):
+        """Проверка живости соединения"""
+        try:
+            conn.execute('SELECT 1').fetchone()
+            return True
+        except Exception:
+            return False
+    
+    def acquire(self):
+        """Получение соединения из пула (блокируется, если все заняты)"""
+        if self._closed:
+            raise sqlite3.ProgrammingError('Пул соединений закрыт')
+        
+        if not self._slots.acquire(timeout=self.timeout):
+            raise sqlite3.OperationalError(
+                f'Нет свободных соединений ({self.max_connections}) за {self.timeout}с'
+            )
+        
+        try:
+            try:
+                conn, released_at = self._idle.get_nowait()
+            except queue.Empty:
+                return self._connect()
+            
+            # Соединение долго простаивало - проверяем перед выдачей
+            if time.time() - released_at > self.health_check_interval and not self._is_healthy(conn):
+                self._discard(conn)
+                return self._connect()
+            return conn
+        except Exception:
+            self._slots.release()
+            raise
+    
+    def release(self, conn, broken=False):
+        """Возврат соединения в пул"""
+        try:
+            if not broken and conn.in_transaction:
+                conn.rollback()
+        except Exception:
+            broken = True
+        
+        try:
+            if broken or self._closed:
+                self._discard(conn)
+            else:
+                self._idle.put((conn, time.time()))
+        finally:
+            self._slots.release()
+    
+    @contextmanager
+    def connection(self):
+        """Контекстный менеджер для временного соединения"""
+        # Внутри транзакции поток работает со своим закрепленным соединением
+        bound = self.bound_connection()
+        if bound is not None:
+            yield bound
+            return
+        
+        conn = self.acquire()
+        broken = False
+        try:
+            yield conn
+        except sqlite3.DatabaseError:
+            broken = not self._is_healthy(conn)
+            raise
+        finally:
+            self.release(conn, broken=broken)
+    
+    def bound_connection(self):
+        """Соединение, закрепленное за текущим потоком транзакцией"""
+        return getattr(self._local, 'conn', None)
+    
+    @contextmanager
+    def bind(self):
+        """Закрепление соединения за текущим потоком на время транзакции"""
+        with self.connection() as conn:
+            self._local.conn = conn
+            self._local.failed = False
+            self._local.after_commit = []
+            try:
+                yield conn
+            finally:
+                self._local.conn = None
+                self._local.after_commit = []
+    
+    def after_commit(self, callback):
+        """Отложенный вызов после фиксации текущей транзакции"""
+        self._local.after_commit.append(callback)
+    
+    def run_after_commit(self):
+        """Вызовы, отложенные до commit; при откате они отбрасываются"""
+        callbacks, self._local.after_commit = self._local.after_commit, []
+        for callback in callbacks:
+            callback()
+    
+    def mark_failed(self):
+        """Пометка текущей транзакции как подлежащей откату"""
+        self._local.failed = True
+    
+    def is_failed(self):
+        """Был ли в текущей транзакции неудачный запрос"""
+        return getattr(self._local, 'failed', False)
+    
+    def health_check(self):
+        """Проверка простаивающих соединений, битые закрываются"""
+        checked = []
+        while True:
+            try:
+                checked.append(self._idle.get_nowait())
+            except queue.Empty:
+                break
+        
+        healthy = 0
+        for conn, released_at in checked:
+            if self._is_healthy(conn):
+                self._idle.put((conn, released_at))
+                healthy += 1
+            else:
+                self._discard(conn)
+        
+        return {'checked': len(checked), 'healthy': healthy}
+    
+    def get_stats(self):
+        """Статистика пула"""
+        with self._lock:
+            created = self._created
+        idle = self._idle.qsize()
+        return {
+            'max_connections': self.max_connections,
+            'readonly': self.readonly,
+            'open': created,
+            'idle': idle,
+            'in_use': created - idle,
+            'closed': self._closed
+        }
+    
+    def close(self):
+        """Закрытие пула и всех простаивающих соединений"""
+        self._closed = True
+        while True:
+            try:
+                conn, _ = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(conn)
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def get_connection_pool(db_path, readonly=False):
+    """Общий пул соединений для файла базы данных.
+    
+    Пул записи состоит из одного соединения, поэтому все изменения
+    сериализуются; читатели в режиме WAL не ждут писателя.
+    """
+    with _pools_lock:
+        pool = _pools.get((db_path, readonly))
+        if pool is None or pool._closed:
+            pool = ConnectionPool(
+                db_path,
+                max_connections=DATABASE_CONFIG['max_connections'] if readonly else 1,
+                timeout=DATABASE_CONFIG['pool_timeout'],
+                health_check_interval=DATABASE_CONFIG['pool_health_check_interval'],
+                readonly=readonly,
+                pragmas=DATABASE_CONFIG['connection_pragmas']
+            )
+            _pools[(db_path, readonly)] = pool
+        return pool
+
+def close_all_pools():
+    """Закрытие всех пулов при завершении процесса"""
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.close()
+        _pools.clear()
+
+atexit.register(close_all_pools)
+
+class UserCache:
+    """LRU кэш строк пользователей по telegram_id с ограниченным временем жизни.
+    
+    Почти каждое обновление начинается с поиска пользователя, а меняются
+    пользователи редко, поэтому строка берется из памяти, пока ее не
+    сбросит регистрация, смена языка или прав админа.
+    """
+    
+    def __init__(self, max_size=10000, ttl=300):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._user_ids = {}
+        self._lock = threading.Lock()
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+    
+    def get(self, telegram_id):
+        """Строка пользователя или None, если ее нет в кэше"""
+        with self._lock:
+            entry = self._entries.get(telegram_id)
+            if entry is not None and entry[1] > time.monotonic():
+                self._entries.move_to_end(telegram_id)
+                self.hits += 1
+                return entry[0]
+            if entry is not None:
+                self._remove(telegram_id)
+            self.misses += 1
+            return None
+    
+    def generation(self):
+        """Номер поколения; меняется при каждом сбросе"""
+        with self._lock:
+            return self._generation
+    
+    def put(self, telegram_id, row, generation):
+        """Сохранение строки, прочитанной в указанном поколении.
+        
+        Если за время запроса пользователя сбросили, строка могла
+        устареть и не сохраняется.
+        """
+        with self._lock:
+            if generation != self._generation:
+                return
+            self._entries[telegram_id] = (row, time.monotonic() + self.ttl)
+            self._entries.move_to_end(telegram_id)
+            self._user_ids[row[0]] = telegram_id
+            while len(self._entries) > self.max_size:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+    
+    def _remove(self, telegram_id):
+        entry = self._entries.pop(telegram_id, None)
+        if entry is not None:
+            self._user_ids.pop(entry[0][0], None)
+    
+    def invalidate(self, telegram_id):
+        """Сброс пользователя по telegram_id"""
+        with self._lock:
+            self._generation += 1
+            self._remove(telegram_id)
+    
+    def invalidate_user_id(self, user_id):
+        """Сброс пользователя по id в таблице users"""
+        with self._lock:
+            self._generation += 1
+            telegram_id = self._user_ids.get(user_id)
+            if telegram_id is not None:
+                self._remove(telegram_id)
+    
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            self._user_ids.clear()
+    
+    def get_stats(self):
+        """Размер и попадания кэша"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / total, 3) if total else 0.0
+            }
+
+_user_caches = {}
+
+def get_user_cache(db_path):
+    """Общий кэш пользователей для файла базы данных"""
+    with _pools_lock:
+        cache = _user_caches.get(db_path)
+        if cache is None:
+            cache = UserCache(
+                max_size=DATABASE_CONFIG['user_cache_size'],
+                ttl=DATABASE_CONFIG['user_cache_ttl']
+            )
+            _user_caches[db_path] = cache
+        return cache
+
+_catalog_caches = {}
+
+def get_catalog_cache(db):
+    """Общий кэш каталога для файла базы данных"""
+    with _pools_lock:
+        cache = _catalog_caches.get(db.db_path)
+        if cache is None:
+            cache = CatalogCache(db, check_interval=DATABASE_CONFIG['catalog_check_interval'])
+            _catalog_caches[db.db_path] = cache
+        return cache
+
+@lru_cache(maxsize=2048)
+def fingerprint_query(query):
+    """Отпечаток SQL: литералы заменены на ?, пробелы схлопнуты.
+    
+    Возвращает (query_id, текст отпечатка); запросы, отличающиеся
+    только значениями, получают один отпечаток.
+    """
+    text = re.sub(r"'(?:[^']|'')*'", '?', query)
+    text = re.sub(r'\b\d+(?:\.\d+)?\b', '?', text)
+    text = re.sub(r'\s+', ' ', text).strip()
+    text = re.sub(r'\(\s*\?(?:\s*,\s*\?)+\s*\)', '(?+)', text)
+    return f'{zlib.crc32(text.encode()):08x}', text
+
+class QueryStats:
+    """Статистика запросов по отпечаткам и журнал медленных запросов.
+    
+    Для перцентилей хранятся последние sample_size замеров каждого
+    отпечатка, поэтому память не растет с числом запросов.
+    """
+    
+    EXPLAIN_INTERVAL = 600  # Повторный EXPLAIN для отпечатка не чаще, сек
+    
+    def __init__(self, slow_threshold_ms=100, sample_size=256):
+        self.slow_threshold = slow_threshold_ms / 1000
+        self.sample_size = sample_size
+        self._stats = {}
+        self._explained_at = {}
+        self._lock = threading.Lock()
+    
+    def record(self, query_id, statement, duration, rows):
+        """Учет выполнения; True, если запрос медленный и его стоит разобрать"""
+        with self._lock:
+            entry = self._stats.get(query_id)
+            if entry is None:
+                entry = self._stats[query_id] = {
+                    'statement': statement,
+                    'count': 0,
+                    'total': 0.0,
+                    'max': 0.0,
+                    'rows': 0,
+                    'slow': 0,
+                    'samples': [],
+                    'next_sample': 0
+                }
+            entry['count'] += 1
+            entry['total'] += duration
+            entry['max'] = max(entry['max'], duration)
+            entry['rows'] += max(rows or 0, 0)
+            
+            samples = entry['samples']
+            if len(samples) < self.sample_size:
+                samples.append(duration)
+            else:
+                samples[entry['next_sample']] = duration
+                entry['next_sample'] = (entry['next_sample'] + 1) % self.sample_size
+            
+            if duration < self.slow_threshold:
+                return False
+            entry['slow'] += 1
+            now = time.monotonic()
+            if now - self._explained_at.get(query_id, -self.EXPLAIN_INTERVAL) < self.EXPLAIN_INTERVAL:
+                return False
+            self._explained_at[query_id] = now
+            return True
+    
+    @staticmethod
+    def _percentile(sorted_samples, fraction):
+        if not sorted_samples:
+            return 0.0
+        index = min(len(sorted_samples) - 1, int(round(fraction * (len(sorted_samples) - 1))))
+        return sorted_samples[index]
+    
+    def report(self, limit=20, order_by='total_ms'):
+        """Самые тяжелые отпечатки: время в миллисекундах"""
+        with self._lock:
+            entries = [(query_id, dict(entry, samples=list(entry['samples']))) for query_id, entry in self._stats.items()]
+        
+        report = []
+        for query_id, entry in entries:
+            samples = sorted(entry['samples'])
+            report.append({
+                'query_id': query_id,
+                'statement': entry['statement'],
+                'count': entry['count'],
+                'total_ms': round(entry['total'] * 1000, 2),
+                'avg_ms': round(entry['total'] / entry['count'] * 1000, 3),
+                'p50_ms': round(self._percentile(samples, 0.5) * 1000, 3),
+                'p95_ms': round(self._percentile(samples, 0.95) * 1000, 3),
+                'max_ms': round(entry['max'] * 1000, 3),
+                'rows': entry['rows'],
+                'avg_rows': round(entry['rows'] / entry['count'], 1),
+                'slow': entry['slow']
+            })
+        
+        report.sort(key=lambda item: item.get(order_by, 0), reverse=True)
+        return report[:limit]
+    
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+            self._explained_at.clear()
+
+query_stats = QueryStats(
+    slow_threshold_ms=DATABASE_CONFIG['slow_query_threshold_ms'],
+    sample_size=DATABASE_CONFIG['query_stats_samples']
+)
+
+# Индексы схемы: имя -> (таблица, столбцы). create_indexes приводит базу
+# к этому набору при каждом запуске
+INDEXES = {
+    'idx_users_telegram_id': ('users', ('telegram_id',)),
+    'idx_products_category': ('products', ('category_id',)),
+    'idx_products_subcategory': ('products', ('subcategory_id', 'is_active', 'name')),
+    'idx_orders_user_status': ('orders', ('user_id', 'status', 'created_at')),
+    'idx_orders_status': ('orders', ('status',)),
+    'idx_orders_created_day': ('orders', ('created_day', 'status')),
+    'idx_order_items_order': ('order_items', ('order_id',)),
+    'idx_order_items_product': ('order_items', ('product_id',)),
+    'idx_cart_user_product': ('cart', ('user_id', 'product_id')),
+    'idx_reviews_product': ('reviews', ('product_id',)),
+    'idx_favorites_product': ('favorites', ('product_id',)),
+    'idx_promo_uses_code_user': ('promo_uses', ('promo_code_id', 'user_id')),
+    'idx_notifications_user_read': ('notifications', ('user_id', 'is_read', 'created_at')),
+    'idx_inventory_movements_product': ('inventory_movements', ('product_id',)),
+    'idx_inventory_movements_type': ('inventory_movements', ('movement_type', 'created_at')),
+    'idx_inventory_movements_day': ('inventory_movements', ('created_day',)),
+    'idx_business_expenses_day': ('business_expenses', ('expense_day', 'expense_type')),
+    'idx_purchase_orders_day': ('purchase_orders', ('created_day', 'status')),
+    'idx_user_activity_user_action': ('user_activity_logs', ('user_id', 'action', 'created_at')),
+    'idx_user_activity_action_query': ('user_activity_logs', ('action', 'created_at', 'search_query')),
+    'idx_security_logs_user': ('security_logs', ('user_id',)),
+    'idx_automation_executions_user': ('automation_executions', ('user_id',)),
+    'idx_product_similarity_score': ('product_similarity', ('product_id', 'score')),
+    'idx_recommendation_store_expires': ('recommendation_store', ('expires_at',)),
+    'idx_customer_segments_segment': ('customer_segments', ('segment', 'total_spent')),
+    'idx_user_churn_scores_risk': ('user_churn_scores', ('risk', 'score')),
+    'idx_notification_outbox_status': ('notification_outbox', ('status', 'scheduled_at'))
+}
+
+# Столбцы дня для отчетов: таблица -> (столбец, исходная дата)
+DATE_COLUMNS = {
+    'orders': ('created_day', 'created_at'),
+    'business_expenses': ('expense_day', 'expense_date'),
+    'purchase_orders': ('created_day', 'created_at'),
+    'inventory_movements': ('created_day', 'created_at')
+}
+
+# Индексы, замененные составными с тем же первым столбцом
+OBSOLETE_INDEXES = ('idx_cart_user', 'idx_orders_user', 'idx_notifications_user')
+
+def normalize_search_text(text):
+    """Приведение текста к виду, в котором он лежит в полнотекстовом индексе"""
+    return (text or '').replace('ё', 'е').replace('Ё', 'Е')
+
+def build_fts_query(text, match_any=False):
+    """Построение MATCH-выражения FTS5 с префиксным поиском по каждому слову"""
+    tokens = re.findall(r"[\w'ʻ‘]+", normalize_search_text(text).lower())
+    terms = [f'"{token}"*' for token in tokens if token.strip("'ʻ‘")]
+    return (' OR ' if match_any else ' ').join(terms)
 
 class DatabaseManager:
     def __init__(self, db_path='shop_bot.db'):
         self.db_path = db_path
+        self.fts_enabled = False
+        self.pool = get_connection_pool(db_path)
+        self.read_pool = get_connection_pool(db_path, readonly=True)
+        self.user_cache = get_user_cache(db_path)
+        self.catalog = get_catalog_cache(self)
+        self.sales_rollup = SalesRollup(self)
+        self.item_similarity = ItemSimilarity(self)
         self.init_database()
     
     def init_database(self):
         """Инициализация базы данных"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            # Создаем все таблицы
-            self.create_tables(cursor)
-            
-            # Создаем тестовые данные если база пустая
-            if self.is_database_empty(cursor):
-                self.create_test_data(cursor)
-            
-            conn.commit()
+            with self.pool.connection() as conn:
+                cursor = conn.cursor()
+                
+                # Режим журнала хранится в файле базы, достаточно установить один раз
+                cursor.execute(f"PRAGMA journal_mode = {DATABASE_CONFIG['journal_mode']}")
+                
+                try:
+                    # Создаем все таблицы
+                    self.create_tables(cursor)
+                    
+                    # Создаем тестовые данные если база пустая
+                    if self.is_database_empty(cursor):
+                        self.create_test_data(cursor)
+                    
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
             
         except Exception as e:
             print(f"Ошибка инициализации базы данных: {e}")
-            if 'conn' in locals():
+    
+    def close(self):
+        """Закрытие соединений с базой данных"""
+        self.read_pool.close()
+        self.pool.close()
+    
+    def get_pool_status(self):
+        """Состояние пулов соединений с проверкой простаивающих"""
+        status = {}
+        for name, pool in (('writer', self.pool), ('readers', self.read_pool)):
+            status[name] = pool.get_stats()
+            status[name].update(pool.health_check())
+        return status
+    
+    @contextmanager
+    def transaction(self):
+        """Единица работы: все запросы внутри блока фиксируются одним commit.
+        
+        Если любой запрос в блоке завершился ошибкой, вся транзакция
+        откатывается и выбрасывается sqlite3.DatabaseError.
+        """
+        if self.pool.bound_connection() is not None:
+            # Вложенный блок входит во внешнюю транзакцию
+            yield
+            return
+        
+        with self.pool.bind() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield
+            except Exception:
                 conn.rollback()
-        finally:
-            if 'conn' in locals():
-                conn.close()
+                raise
+            
+            if self.pool.is_failed():
+                conn.rollback()
+                raise sqlite3.DatabaseError('Транзакция отменена из-за ошибки запроса')
+            conn.commit()
+            self.pool.run_after_commit()
+    
+    def publish_event(self, event_type, **payload):
+        """Публикация доменного события.
+        
+        Внутри транзакции событие уходит после commit, а при откате
+        отбрасывается, поэтому подписчики видят только записанные данные.
+        """
+        if self.pool.bound_connection() is not None:
+            self.pool.after_commit(lambda: event_bus.publish(event_type, **payload))
+        else:
+            event_bus.publish(event_type, **payload)
     
     def create_tables(self, cursor):
         """Создание всех таблиц"""
@@ -350,6 +929,58 @@ CREATE TABLE IF NOT EXISTS automation_executions (
 )
         ''')
         
+        # RFM-сегменты клиентов (пересчитываются целиком)
+        cursor.execute('''
+CREATE TABLE IF NOT EXISTS customer_segments (
+    user_id INTEGER PRIMARY KEY,
+    segment TEXT NOT NULL,
+    recency_score INTEGER,
+    frequency_score INTEGER,
+    monetary_score INTEGER,
+    total_orders INTEGER,
+    total_spent REAL,
+    avg_order_value REAL,
+    last_order_date TIMESTAMP,
+    computed_at TIMESTAMP NOT NULL,
+    FOREIGN KEY (user_id) REFERENCES users (id)
+)
+        ''')
+        
+        # Время последнего пересчета фоновых заданий
+        cursor.execute('''
+CREATE TABLE IF NOT EXISTS refresh_runs (
+    job TEXT PRIMARY KEY,
+    refreshed_at TIMESTAMP NOT NULL
+)
+        ''')
+        
+        # Риск ухода клиентов (пересчитывается целиком)
+        cursor.execute('''
+CREATE TABLE IF NOT EXISTS user_churn_scores (
+    user_id INTEGER PRIMARY KEY,
+    risk TEXT NOT NULL,
+    score INTEGER NOT NULL,
+    total_orders INTEGER,
+    avg_order_value REAL,
+    last_order_date TIMESTAMP,
+    days_since_last_order REAL,
+    favorite_category_id INTEGER,
+    computed_at TIMESTAMP NOT NULL,
+    FOREIGN KEY (user_id) REFERENCES users (id)
+)
+        ''')
+        
+        # Готовые рекомендации пользователя: товары по убыванию релевантности (JSON)
+        cursor.execute('''
+CREATE TABLE IF NOT EXISTS recommendation_store (
+    user_id INTEGER PRIMARY KEY,
+    product_ids TEXT NOT NULL,
+    computed_at TIMESTAMP NOT NULL,
+    expires_at TIMESTAMP NOT NULL,
+    FOREIGN KEY (user_id) REFERENCES users (id)
+)
+        ''')
+        
         # Логи безопасности
         cursor.execute('''
 CREATE TABLE IF NOT EXISTS security_logs (
@@ -512,29 +1143,324 @@ CREATE TABLE IF NOT EXISTS post_statistics (
 )
         ''')
         
+        # Очередь исходящих push-уведомлений
+        cursor.execute('''
+CREATE TABLE IF NOT EXISTS notification_outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER,
+    title TEXT NOT NULL,
+    message TEXT NOT NULL,
+    type TEXT DEFAULT 'info',
+    priority INTEGER DEFAULT 5,
+    scheduled_at TIMESTAMP NOT NULL,
+    status TEXT DEFAULT 'pending',
+    attempts INTEGER DEFAULT 0,
+    max_attempts INTEGER DEFAULT 3,
+    last_error TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    sent_at TIMESTAMP,
+    FOREIGN KEY (user_id) REFERENCES users (id)
+)
+        ''')
+        
+        # Нормализованные даты для отчетов
+        self.create_date_columns(cursor)
+        
+        # Дневные итоги продаж
+        self.create_sales_rollup(cursor)
+        
+        # Модель похожих товаров
+        self.create_item_similarity(cursor)
+        
         # Создаем индексы для оптимизации
         self.create_indexes(cursor)
+        
+        # Полнотекстовый индекс товаров
+        self.create_search_index(cursor)
+        
+        # Версия каталога для кэша
+        self.create_catalog_version(cursor)
     
     def create_indexes(self, cursor):
-        """Создание индексов для оптимизации"""
-        indexes = [
-            'CREATE INDEX IF NOT EXISTS idx_users_telegram_id ON users(telegram_id)',
-            'CREATE INDEX IF NOT EXISTS idx_products_category ON products(category_id)',
-            'CREATE INDEX IF NOT EXISTS idx_orders_user ON orders(user_id)',
-            'CREATE INDEX IF NOT EXISTS idx_orders_status ON orders(status)',
-            'CREATE INDEX IF NOT EXISTS idx_cart_user ON cart(user_id)',
-            'CREATE INDEX IF NOT EXISTS idx_reviews_product ON reviews(product_id)',
-            'CREATE INDEX IF NOT EXISTS idx_notifications_user ON notifications(user_id)',
-            'CREATE INDEX IF NOT EXISTS idx_inventory_movements_product ON inventory_movements(product_id)',
-            'CREATE INDEX IF NOT EXISTS idx_security_logs_user ON security_logs(user_id)',
-            'CREATE INDEX IF NOT EXISTS idx_automation_executions_user ON automation_executions(user_id)'
-        ]
+        """Приведение индексов базы к набору INDEXES"""
+        for index_name in OBSOLETE_INDEXES:
+            try:
+                cursor.execute(f'DROP INDEX IF EXISTS {index_name}')
+            except Exception as e:
+                print(f"Ошибка удаления индекса {index_name}: {e}")
         
-        for index_sql in indexes:
+        for index_name, (table, columns) in INDEXES.items():
             try:
-                cursor.execute(index_sql)
+                # Индекс с тем же именем, но другими столбцами пересоздается
+                existing = [row[2] for row in cursor.execute(f'PRAGMA index_info({index_name})')]
+                if existing == list(columns):
+                    continue
+                if existing:
+                    cursor.execute(f'DROP INDEX {index_name}')
+                cursor.execute(f'CREATE INDEX {index_name} ON {table}({", ".join(columns)})')
             except Exception as e:
-                print(f"Ошибка создания индекса: {e}")
+                print(f"Ошибка создания индекса {index_name}: {e}")
+    
+    def create_date_columns(self, cursor):
+        """Столбцы дат из DATE_COLUMNS, заполняемые триггерами.
+        
+        Отчеты фильтруют по дню через диапазон по индексированному столбцу,
+        а не через DATE(created_at), который не может использовать индекс.
+        """
+        for table, (column, source) in DATE_COLUMNS.items():
+            existing = [row[1] for row in cursor.execute(f'PRAGMA table_info({table})')]
+            if column not in existing:
+                cursor.execute(f'ALTER TABLE {table} ADD COLUMN {column} DATE')
+            
+            # Заполнение существующих строк
+            cursor.execute(f'UPDATE {table} SET {column} = DATE({source}) WHERE {column} IS NULL AND {source} IS NOT NULL')
+            
+            for event in ('INSERT', f'UPDATE OF {source}'):
+                cursor.execute(f'''
+CREATE TRIGGER IF NOT EXISTS {table}_{column}_{event.split()[0].lower()} AFTER {event} ON {table}
+BEGIN
+    UPDATE {table} SET {column} = DATE(new.{source}) WHERE id = new.id;
+END
+                ''')
+    
+    def create_sales_rollup(self, cursor):
+        """Таблицы дневных итогов продаж и триггеры, отмечающие измененные дни.
+        
+        Итоги пересчитывает SalesRollup.refresh() только для дней из
+        sales_rollup_dirty, куда триггеры записывают день заказа при его
+        создании, смене статуса, суммы или состава.
+        """
+        rollup_columns = '''
+    orders INTEGER NOT NULL DEFAULT 0,
+    customers INTEGER NOT NULL DEFAULT 0,
+    units INTEGER NOT NULL DEFAULT 0,
+    revenue REAL NOT NULL DEFAULT 0,
+    cogs REAL NOT NULL DEFAULT 0,
+    discounts REAL NOT NULL DEFAULT 0,'''
+        
+        cursor.execute(f'''
+CREATE TABLE IF NOT EXISTS sales_daily (
+    day DATE NOT NULL,
+    status TEXT,
+    payment_status TEXT,{rollup_columns}
+    delivery REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, status, payment_status)
+)
+        ''')
+        
+        cursor.execute(f'''
+CREATE TABLE IF NOT EXISTS sales_daily_products (
+    day DATE NOT NULL,
+    product_id INTEGER,
+    status TEXT,{rollup_columns}
+    PRIMARY KEY (day, product_id, status)
+)
+        ''')
+        
+        cursor.execute(f'''
+CREATE TABLE IF NOT EXISTS sales_daily_categories (
+    day DATE NOT NULL,
+    category_id INTEGER,
+    status TEXT,{rollup_columns}
+    PRIMARY KEY (day, category_id, status)
+)
+        ''')
+        
+        cursor.execute('''
+CREATE TABLE IF NOT EXISTS sales_rollup_dirty (
+    day DATE PRIMARY KEY NOT NULL
+)
+        ''')
+        
+        mark_day = "INSERT OR IGNORE INTO sales_rollup_dirty (day) VALUES (DATE({row}.created_at));"
+        mark_order_day = (
+            "INSERT OR IGNORE INTO sales_rollup_dirty (day) "
+            "SELECT DATE(created_at) FROM orders WHERE id = {row}.order_id;"
+        )
+        triggers = {
+            'orders_insert': ('AFTER INSERT ON orders', [mark_day.format(row='new')]),
+            'orders_update': (
+                'AFTER UPDATE OF status, payment_status, total_amount, promo_discount, '
+                'delivery_cost, user_id, created_at ON orders',
+                [mark_day.format(row='old'), mark_day.format(row='new')]
+            ),
+            'orders_delete': ('AFTER DELETE ON orders', [mark_day.format(row='old')]),
+            'order_items_insert': ('AFTER INSERT ON order_items', [mark_order_day.format(row='new')]),
+            'order_items_update': (
+                'AFTER UPDATE ON order_items',
+                [mark_order_day.format(row='old'), mark_order_day.format(row='new')]
+            ),
+            'order_items_delete': ('AFTER DELETE ON order_items', [mark_order_day.format(row='old')])
+        }
+        
+        for name, (event, statements) in triggers.items():
+            body = '\n    '.join(statements)
+            cursor.execute(f'''
+CREATE TRIGGER IF NOT EXISTS sales_rollup_{name} {event}
+BEGIN
+    {body}
+END
+            ''')
+        
+        # Первое построение: в базе есть заказы, а итогов еще нет
+        cursor.execute('''
+            INSERT OR IGNORE INTO sales_rollup_dirty (day)
+            SELECT DISTINCT created_day FROM orders
+            WHERE created_day IS NOT NULL
+            AND NOT EXISTS (SELECT 1 FROM sales_daily)
+        ''')
+    
+    def create_item_similarity(self, cursor):
+        """Таблицы модели "покупали вместе" и триггеры, отмечающие покупателей.
+        
+        ItemSimilarity.refresh() обновляет счетчики только по покупателям из
+        item_similarity_dirty, куда триггеры записывают владельца заказа при
+        изменении состава, статуса или владельца.
+        """
+        # Товары покупателя (без отмененных заказов)
+        cursor.execute('''
+CREATE TABLE IF NOT EXISTS user_products (
+    user_id INTEGER NOT NULL,
+    product_id INTEGER NOT NULL,
+    PRIMARY KEY (user_id, product_id)
+) WITHOUT ROWID
+        ''')
+        
+        # Число покупателей товара
+        cursor.execute('''
+CREATE TABLE IF NOT EXISTS product_buyers (
+    product_id INTEGER PRIMARY KEY,
+    buyers INTEGER NOT NULL
+)
+        ''')
+        
+        # Общие покупатели пары товаров, хранятся в обе стороны
+        cursor.execute('''
+CREATE TABLE IF NOT EXISTS product_pairs (
+    product_id INTEGER NOT NULL,
+    other_id INTEGER NOT NULL,
+    users INTEGER NOT NULL,
+    PRIMARY KEY (product_id, other_id)
+) WITHOUT ROWID
+        ''')
+        
+        # Ближайшие соседи товара
+        cursor.execute('''
+CREATE TABLE IF NOT EXISTS product_similarity (
+    product_id INTEGER NOT NULL,
+    similar_id INTEGER NOT NULL,
+    score REAL NOT NULL,
+    co_purchases INTEGER NOT NULL,
+    PRIMARY KEY (product_id, similar_id)
+) WITHOUT ROWID
+        ''')
+        
+        cursor.execute('''
+CREATE TABLE IF NOT EXISTS item_similarity_dirty (
+    user_id INTEGER PRIMARY KEY NOT NULL
+)
+        ''')
+        
+        mark_user = "INSERT OR IGNORE INTO item_similarity_dirty (user_id) VALUES ({row}.user_id);"
+        mark_order_user = (
+            "INSERT OR IGNORE INTO item_similarity_dirty (user_id) "
+            "SELECT user_id FROM orders WHERE id = {row}.order_id AND user_id IS NOT NULL;"
+        )
+        triggers = {
+            'orders_update': (
+                'AFTER UPDATE OF status, user_id ON orders',
+                [mark_user.format(row='old'), mark_user.format(row='new')]
+            ),
+            'orders_delete': ('AFTER DELETE ON orders', [mark_user.format(row='old')]),
+            'order_items_insert': ('AFTER INSERT ON order_items', [mark_order_user.format(row='new')]),
+            'order_items_update': (
+                'AFTER UPDATE OF order_id, product_id ON order_items',
+                [mark_order_user.format(row='old'), mark_order_user.format(row='new')]
+            ),
+            'order_items_delete': ('AFTER DELETE ON order_items', [mark_order_user.format(row='old')])
+        }
+        
+        for name, (event, statements) in triggers.items():
+            body = '\n    '.join(statements)
+            cursor.execute(f'''
+CREATE TRIGGER IF NOT EXISTS item_similarity_{name} {event}
+BEGIN
+    {body}
+END
+            ''')
+    
+    def create_search_index(self, cursor):
+        """Создание FTS5 индекса товаров с синхронизацией через триггеры"""
+        # Текст товара для индекса; ё сводится к е, как и в запросах
+        fts_select = '''
+            SELECT p.id,
+                   replace(replace(p.name, 'ё', 'е'), 'Ё', 'Е'),
+                   replace(replace(COALESCE(p.description, ''), 'ё', 'е'), 'Ё', 'Е'),
+                   COALESCE(p.brand, ''),
+                   replace(replace(COALESCE(c.name, ''), 'ё', 'е'), 'Ё', 'Е')
+            FROM products p LEFT JOIN categories c ON c.id = p.category_id
+        '''
+        
+        try:
+            # unicode61 приводит к нижнему регистру кириллицу и латиницу,
+            # апострофы входят в слово для узбекской латиницы (o'zbek, gʻisht)
+            cursor.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5("
+                "name, description, brand, category_name, "
+                "tokenize = \"unicode61 remove_diacritics 2 tokenchars '''ʻ‘'\")"
+            )
+            
+            cursor.execute(f'''
+CREATE TRIGGER IF NOT EXISTS products_fts_insert AFTER INSERT ON products
+BEGIN
+    INSERT INTO products_fts (rowid, name, description, brand, category_name)
+    {fts_select}
+    WHERE p.id = new.id;
+END
+            ''')
+            
+            cursor.execute(f'''
+CREATE TRIGGER IF NOT EXISTS products_fts_update
+AFTER UPDATE OF name, description, brand, category_id ON products
+BEGIN
+    DELETE FROM products_fts WHERE rowid = old.id;
+    INSERT INTO products_fts (rowid, name, description, brand, category_name)
+    {fts_select}
+    WHERE p.id = new.id;
+END
+            ''')
+            
+            cursor.execute('''
+CREATE TRIGGER IF NOT EXISTS products_fts_delete AFTER DELETE ON products
+BEGIN
+    DELETE FROM products_fts WHERE rowid = old.id;
+END
+            ''')
+            
+            cursor.execute('''
+CREATE TRIGGER IF NOT EXISTS products_fts_category_rename
+AFTER UPDATE OF name ON categories
+BEGIN
+    UPDATE products_fts
+    SET category_name = replace(replace(new.name, 'ё', 'е'), 'Ё', 'Е')
+    WHERE rowid IN (SELECT id FROM products WHERE category_id = new.id);
+END
+            ''')
+            
+            # Первичное заполнение для существующих баз
+            cursor.execute('SELECT (SELECT COUNT(*) FROM products_fts) = (SELECT COUNT(*) FROM products)')
+            if not cursor.fetchone()[0]:
+                cursor.execute('DELETE FROM products_fts')
+                cursor.execute(f'''
+                    INSERT INTO products_fts (rowid, name, description, brand, category_name)
+                    {fts_select}
+                ''')
+            
+            self.fts_enabled = True
+        except sqlite3.OperationalError as e:
+            # SQLite собран без FTS5 - поиск работает через LIKE
+            print(f"Полнотекстовый поиск недоступен: {e}")
+            self.fts_enabled = False
     
     def is_database_empty(self, cursor):
         """Проверка пустоты базы данных"""
@@ -644,36 +1570,152 @@ CREATE TABLE IF NOT EXISTS post_statistics (
     
     def execute_query(self, query, params=None):
         """Выполнение SQL запроса"""
+        is_select = query.strip().upper().startswith('SELECT')
+        in_transaction = self.pool.bound_connection() is not None
+        # В транзакции чтение идет через то же соединение, чтобы видеть свои изменения
+        pool = self.read_pool if is_select and not in_transaction else self.pool
+        started = time.perf_counter()
+        rows = 0
+        
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            if params:
-                cursor.execute(query, params)
-            else:
-                cursor.execute(query)
-            
-            if query.strip().upper().startswith('SELECT'):
-                result = cursor.fetchall()
-            else:
-                conn.commit()
-                result = cursor.lastrowid
-            
-            return result
+            with pool.connection() as conn:
+                cursor = conn.cursor()
+                
+                if params:
+                    cursor.execute(query, params)
+                else:
+                    cursor.execute(query)
+                
+                if is_select:
+                    result = cursor.fetchall()
+                    rows = len(result)
+                else:
+                    if not in_transaction:
+                        conn.commit()
+                    result = cursor.lastrowid
+                    rows = cursor.rowcount
+                
+                return result
             
         except Exception as e:
             print(f"Ошибка выполнения запроса: {e}")
+            self.record_query_error(query)
+            if in_transaction:
+                self.pool.mark_failed()
             return None
         finally:
-            if 'conn' in locals():
-                conn.close()
+            self.record_query(query, params, time.perf_counter() - started, rows)
+    
+    def stream_query(self, query, params=None, chunk_size=500):
+        """Построчное чтение результата SELECT блоками по chunk_size.
+        
+        Курсор остается открытым, пока генератор перебирают, поэтому
+        в памяти одновременно находится не больше одного блока строк.
+        """
+        started = time.perf_counter()
+        rows = 0
+        
+        try:
+            with self.read_pool.connection() as conn:
+                cursor = conn.execute(query, params or ())
+                while True:
+                    batch = cursor.fetchmany(chunk_size)
+                    if not batch:
+                        break
+                    rows += len(batch)
+                    yield from batch
+        except Exception as e:
+            print(f"Ошибка потокового чтения запроса: {e}")
+            self.record_query_error(query)
+            raise
+        finally:
+            self.record_query(query, params, time.perf_counter() - started, rows)
+    
+    def execute_many(self, query, rows):
+        """Пакетное выполнение запроса для множества строк одним commit"""
+        in_transaction = self.pool.bound_connection() is not None
+        started = time.perf_counter()
+        affected = 0
+        
+        try:
+            with self.pool.connection() as conn:
+                cursor = conn.cursor()
+                cursor.executemany(query, rows)
+                
+                if not in_transaction:
+                    conn.commit()
+                
+                affected = cursor.rowcount
+                return cursor.rowcount
+            
+        except Exception as e:
+            print(f"Ошибка пакетного выполнения запроса: {e}")
+            self.record_query_error(query)
+            if in_transaction:
+                self.pool.mark_failed()
+            return None
+        finally:
+            self.record_query(query, None, time.perf_counter() - started, affected)
+    
+    def record_query(self, query, params, duration, rows):
+        """Учет запроса в метриках и статистике; медленные попадают в журнал"""
+        query_id, statement = fingerprint_query(query)
+        QUERY_DURATION.observe(duration, query_id=query_id, statement=statement[:120])
+        if query_stats.record(query_id, statement, duration, rows):
+            logger.performance(
+                f"SQL {query_id}", duration,
+                f"rows={rows} {statement}\n{self.explain_query(query, params)}"
+            )
+    
+    def record_query_error(self, query):
+        query_id, statement = fingerprint_query(query)
+        QUERY_ERRORS.inc(query_id=query_id, statement=statement[:120])
+    
+    def explain_query(self, query, params=None):
+        """План выполнения запроса (EXPLAIN QUERY PLAN) в виде текста"""
+        try:
+            # План строится без выполнения, читающего соединения достаточно
+            with self.read_pool.connection() as conn:
+                plan = conn.execute(f'EXPLAIN QUERY PLAN {query}', params or ()).fetchall()
+        except Exception as e:
+            return f"  EXPLAIN недоступен: {e}"
+        
+        # Строки плана: (id, parent, notused, detail); отступ по глубине
+        depth = {0: 0}
+        lines = []
+        for node_id, parent_id, _, detail in plan:
+            depth[node_id] = depth.get(parent_id, 0) + 1
+            lines.append('  ' * depth[node_id] + detail)
+        return '\n'.join(lines)
+    
+    def get_query_report(self, limit=20, order_by='total_ms'):
+        """Отчет по самым тяжелым запросам"""
+        return query_stats.report(limit=limit, order_by=order_by)
     
     def get_user_by_telegram_id(self, telegram_id):
         """Получение пользователя по telegram_id"""
-        return self.execute_query(
+        row = self.user_cache.get(telegram_id)
+        if row is not None:
+            return [row]
+        
+        generation = self.user_cache.generation()
+        result = self.execute_query(
             'SELECT * FROM users WHERE telegram_id = ?',
             (telegram_id,)
         )
+        # Незафиксированные изменения транзакции в кэш не попадают
+        if result and self.pool.bound_connection() is None:
+            self.user_cache.put(telegram_id, result[0], generation)
+        return result
+    
+    def set_user_admin(self, telegram_id, is_admin=True):
+        """Выдача или снятие прав администратора"""
+        result = self.execute_query(
+            'UPDATE users SET is_admin = ? WHERE telegram_id = ?',
+            (1 if is_admin else 0, telegram_id)
+        )
+        self.user_cache.invalidate(telegram_id)
+        return result
     
     def add_user(self, telegram_id, name, phone=None, email=None, language='ru'):
         """Добавление нового пользователя"""
@@ -692,6 +1734,7 @@ CREATE TABLE IF NOT EXISTS post_statistics (
                 INSERT INTO users (telegram_id, name, phone, email, language)
                 VALUES (?, ?, ?, ?, ?)
             ''', (telegram_id, name, phone, email, language))
+            self.user_cache.invalidate(telegram_id)
             
             return result
         except Exception as e:
@@ -700,33 +1743,15 @@ CREATE TABLE IF NOT EXISTS post_statistics (
     
     def get_categories(self):
         """Получение всех активных категорий"""
-        return self.execute_query(
-            'SELECT * FROM categories WHERE is_active = 1 ORDER BY name'
-        )
+        return list(self.catalog.snapshot().get_categories())
     
     def get_products_by_category(self, category_id, limit=10, offset=0):
-        """Получение товаров по категории"""
-        # Сначала получаем подкатегории
-        subcategories = self.execute_query('''
-            SELECT DISTINCT s.id, s.name, s.emoji, COUNT(p.id) as products_count
-            FROM subcategories s
-            LEFT JOIN products p ON s.id = p.subcategory_id AND p.is_active = 1
-            WHERE s.category_id = ? AND s.is_active = 1
-            GROUP BY s.id, s.name, s.emoji
-            HAVING products_count > 0
-            ORDER BY s.name
-        ''', (category_id,))
-        
-        return subcategories
+        """Получение подкатегорий категории с количеством товаров"""
+        return list(self.catalog.snapshot().get_subcategories(category_id))
     
     def get_products_by_subcategory(self, subcategory_id, limit=10, offset=0):
         """Получение товаров по подкатегории"""
-        return self.execute_query('''
-            SELECT * FROM products 
-            WHERE subcategory_id = ? AND is_active = 1 
-            ORDER BY name 
-            LIMIT ? OFFSET ?
-        ''', (subcategory_id, limit, offset))
+        return list(self.catalog.snapshot().get_products_by_subcategory(subcategory_id, limit, offset))
     
     def get_product_by_id(self, product_id):
         """Получение товара по ID"""
@@ -774,6 +1799,7 @@ CREATE TABLE IF NOT EXISTS post_statistics (
                 (new_quantity, existing[0][0])
             )
             print(f"DEBUG: Обновление количества в корзине: {result}")
+            self.publish_event(CART_UPDATED, user_id=user_id)
             return existing[0][0]  # Возвращаем ID записи корзины
         else:
             # Добавляем новый товар
@@ -782,6 +1808,8 @@ CREATE TABLE IF NOT EXISTS post_statistics (
                 (user_id, product_id, quantity)
             )
             print(f"DEBUG: Добавление нового товара в корзину: {result}")
+            if result:
+                self.publish_event(CART_UPDATED, user_id=user_id)
             return result
     
     def get_cart_items(self, user_id):
@@ -796,25 +1824,29 @@ CREATE TABLE IF NOT EXISTS post_statistics (
     
     def clear_cart(self, user_id):
         """Очистка корзины"""
-        return self.execute_query(
+        result = self.execute_query(
             'DELETE FROM cart WHERE user_id = ?',
             (user_id,)
         )
+        self.publish_event(CART_UPDATED, user_id=user_id)
+        return result
     
     def create_order(self, user_id, total_amount, delivery_address, payment_method):
         """Создание заказа"""
-        return self.execute_query('''
+        order_id = self.execute_query('''
             INSERT INTO orders (user_id, total_amount, delivery_address, payment_method)
             VALUES (?, ?, ?, ?)
         ''', (user_id, total_amount, delivery_address, payment_method))
+        if order_id:
+            self.publish_event(ORDER_CREATED, order_id=order_id, user_id=user_id, total_amount=total_amount)
+        return order_id
     
     def add_order_items(self, order_id, cart_items):
         """Добавление товаров в заказ"""
-        for item in cart_items:
-            self.execute_query('''
-                INSERT INTO order_items (order_id, product_id, quantity, price)
-                VALUES (?, ?, ?, ?)
-            ''', (order_id, item[5], item[3], item[2]))  # product_id, quantity, price
+        return self.execute_many('''
+            INSERT INTO order_items (order_id, product_id, quantity, price)
+            VALUES (?, ?, ?, ?)
+        ''', [(order_id, item[5], item[3], item[2]) for item in cart_items])  # product_id, quantity, price
     
     def get_user_orders(self, user_id):
         """Получение заказов пользователя"""
@@ -847,13 +1879,76 @@ CREATE TABLE IF NOT EXISTS post_statistics (
     
     def update_order_status(self, order_id, status):
         """Обновление статуса заказа"""
-        return self.execute_query(
+        result = self.execute_query(
             'UPDATE orders SET status = ? WHERE id = ?',
             (status, order_id)
         )
+        if result is not None:
+            self.publish_event(ORDER_STATUS_CHANGED, order_id=order_id, status=status)
+        return result
     
-    def search_products(self, query, limit=10):
-        """Поиск товаров"""
+    def create_catalog_version(self, cursor):
+        """Счетчик версии каталога, который триггеры увеличивают при изменениях.
+        
+        Просмотры, остатки и продажи меняются постоянно и не сбрасывают кэш
+        каталога, поэтому на них триггеры не реагируют.
+        """
+        cursor.execute('''
+CREATE TABLE IF NOT EXISTS catalog_version (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    version INTEGER NOT NULL DEFAULT 1,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+)
+        ''')
+        cursor.execute('INSERT OR IGNORE INTO catalog_version (id, version) VALUES (1, 1)')
+        
+        bump = "UPDATE catalog_version SET version = version + 1, updated_at = CURRENT_TIMESTAMP WHERE id = 1;"
+        events = {
+            'categories': ['INSERT', 'DELETE', 'UPDATE'],
+            'subcategories': ['INSERT', 'DELETE', 'UPDATE'],
+            'products': [
+                'INSERT', 'DELETE',
+                'UPDATE OF name, description, price, category_id, subcategory_id, '
+                'brand, image_url, is_active, original_price'
+            ]
+        }
+        
+        for table, table_events in events.items():
+            for event in table_events:
+                trigger_name = f"catalog_version_{table}_{event.split()[0].lower()}"
+                cursor.execute(f'''
+CREATE TRIGGER IF NOT EXISTS {trigger_name} AFTER {event} ON {table}
+BEGIN
+    {bump}
+END
+                ''')
+    
+    def get_catalog_version(self):
+        """Текущая версия каталога"""
+        result = self.execute_query('SELECT version FROM catalog_version WHERE id = 1')
+        return result[0][0] if result else 0
+    
+    def bump_catalog_version(self):
+        """Принудительный сброс кэша каталога во всех процессах"""
+        return self.execute_query(
+            'UPDATE catalog_version SET version = version + 1, updated_at = CURRENT_TIMESTAMP WHERE id = 1'
+        )
+    
+    def search_products(self, query, limit=10, match_any=False):
+        """Поиск товаров с ранжированием BM25 (название важнее описания)"""
+        if self.fts_enabled:
+            fts_query = build_fts_query(query, match_any)
+            if not fts_query:
+                return []
+            
+            return self.execute_query('''
+                SELECT p.* FROM products_fts
+                JOIN products p ON p.id = products_fts.rowid
+                WHERE products_fts MATCH ? AND p.is_active = 1
+                ORDER BY bm25(products_fts, 10.0, 1.0, 5.0, 2.0)
+                LIMIT ?
+            ''', (fts_query, limit))
+        
         return self.execute_query('''
             SELECT * FROM products 
             WHERE (name LIKE ? OR description LIKE ?) AND is_active = 1
@@ -908,6 +2003,53 @@ CREATE TABLE IF NOT EXISTS post_statistics (
             VALUES (?, ?, ?, ?)
         ''', (user_id, title, message, notification_type))
     
+    def add_outbox_notification(self, user_id, title, message, notification_type, priority, scheduled_at, max_attempts=3):
+        """Постановка push-уведомления в очередь отправки"""
+        return self.execute_query('''
+            INSERT INTO notification_outbox (user_id, title, message, type, priority, scheduled_at, max_attempts)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', (user_id, title, message, notification_type, priority, scheduled_at, max_attempts))
+    
+    def get_pending_outbox_notifications(self):
+        """Неотправленные уведомления очереди"""
+        return self.execute_query('''
+            SELECT id, user_id, title, message, type, priority, scheduled_at, attempts, max_attempts
+            FROM notification_outbox
+            WHERE status = 'pending'
+            ORDER BY scheduled_at, priority
+        ''')
+    
+    def mark_outbox_sent(self, outbox_id):
+        """Отметка уведомления очереди как отправленного"""
+        return self.execute_query('''
+            UPDATE notification_outbox
+            SET status = 'sent', sent_at = CURRENT_TIMESTAMP
+            WHERE id = ?
+        ''', (outbox_id,))
+    
+    def reschedule_outbox_notification(self, outbox_id, attempts, scheduled_at, error):
+        """Перенос уведомления очереди после неудачной попытки"""
+        return self.execute_query('''
+            UPDATE notification_outbox
+            SET attempts = ?, scheduled_at = ?, last_error = ?
+            WHERE id = ?
+        ''', (attempts, scheduled_at, error, outbox_id))
+    
+    def mark_outbox_failed(self, outbox_id, attempts, error):
+        """Отметка уведомления очереди как неотправленного после всех попыток"""
+        return self.execute_query('''
+            UPDATE notification_outbox
+            SET status = 'failed', attempts = ?, last_error = ?
+            WHERE id = ?
+        ''', (attempts, error, outbox_id))
+    
+    def cleanup_outbox(self, days=7):
+        """Удаление старых отправленных уведомлений очереди"""
+        return self.execute_query('''
+            DELETE FROM notification_outbox
+            WHERE status = 'sent' AND sent_at < datetime('now', ?)
+        ''', (f'-{days} days',))
+    
     def get_unread_notifications(self, user_id):
         """Получение непрочитанных уведомлений"""
         return self.execute_query('''
@@ -952,20 +2094,28 @@ CREATE TABLE IF NOT EXISTS post_statistics (
     
     def remove_from_cart(self, cart_item_id):
         """Удаление товара из корзины"""
-        return self.execute_query(
+        owner = self.execute_query('SELECT user_id FROM cart WHERE id = ?', (cart_item_id,))
+        result = self.execute_query(
             'DELETE FROM cart WHERE id = ?',
             (cart_item_id,)
         )
+        if owner:
+            self.publish_event(CART_UPDATED, user_id=owner[0][0])
+        return result
     
     def update_cart_quantity(self, cart_item_id, quantity):
         """Обновление количества товара в корзине"""
         if quantity <= 0:
             return self.remove_from_cart(cart_item_id)
         else:
-            return self.execute_query(
+            owner = self.execute_query('SELECT user_id FROM cart WHERE id = ?', (cart_item_id,))
+            result = self.execute_query(
                 'UPDATE cart SET quantity = ? WHERE id = ?',
                 (quantity, cart_item_id)
             )
+            if owner:
+                self.publish_event(CART_UPDATED, user_id=owner[0][0])
+            return result
     
     def increment_product_views(self, product_id):
         """Увеличение счетчика просмотров товара"""
@@ -985,7 +2135,9 @@ CREATE TABLE IF NOT EXISTS post_statistics (
     
     def update_user_language(self, user_id, language):
         """Обновление языка пользователя"""
-        return self.execute_query(
+        result = self.execute_query(
             'UPDATE users SET language = ? WHERE id = ?',
             (language, user_id)
-        )
\ No newline at end of file
+        )
+        self.user_cache.invalidate_user_id(user_id)
+        return result
\ No newline at end of file
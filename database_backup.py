@@ -11,6 +11,7 @@ import time
 from datetime import datetime, timedelta
 from config import DATABASE_CONFIG
 from logger import logger
+from metrics import track_job
 
 class DatabaseBackup:
     def __init__(self, db_path):
@@ -24,8 +25,9 @@ class DatabaseBackup:
         def backup_worker():
             while True:
                 try:
-                    self.create_backup()
-                    self.cleanup_old_backups()
+                    with track_job('database_backup'):
+                        self.create_backup()
+                        self.cleanup_old_backups()
                     time.sleep(DATABASE_CONFIG['backup_interval'])
                 except Exception as e:
                     logger.error(f"Ошибка резервного копирования: {e}", exc_info=True)
@@ -42,15 +44,9 @@ class DatabaseBackup:
         backup_path = os.path.join(self.backup_dir, backup_filename)
         
         try:
-            # Создаем резервную копию с блокировкой
-            source_conn = sqlite3.connect(self.db_path)
-            source_conn.execute('BEGIN IMMEDIATE;')
-            
-            # Копируем базу данных
-            shutil.copy2(self.db_path, backup_path)
-            
-            source_conn.rollback()
-            source_conn.close()
+            # Копируем через backup API: в режиме WAL часть данных ещё
+            # лежит в -wal файле, и копия основного файла была бы неполной
+            self.copy_database(self.db_path, backup_path)
             
             # Сжимаем резервную копию
             compressed_path = f"{backup_path}.gz"
@@ -138,32 +134,53 @@ class DatabaseBackup:
                 logger.error(f"Резервная копия не найдена: {backup_path}")
                 return False
             
+            # Проверяем копию до того, как трогать рабочую базу
+            if backup_path.endswith('.gz') and not self.verify_backup(backup_path):
+                logger.error(f"Резервная копия повреждена: {backup_path}")
+                return False
+            
             # Создаем резервную копию текущей базы
             current_backup = f"{self.db_path}.before_restore"
-            shutil.copy2(self.db_path, current_backup)
+            self.copy_database(self.db_path, current_backup)
             
             # Распаковываем резервную копию
+            restore_source = backup_path
             if backup_path.endswith('.gz'):
+                restore_source = backup_path.replace('.gz', '.restore')
                 with gzip.open(backup_path, 'rb') as f_in:
-                    with open(self.db_path, 'wb') as f_out:
+                    with open(restore_source, 'wb') as f_out:
                         shutil.copyfileobj(f_in, f_out)
-            else:
-                shutil.copy2(backup_path, self.db_path)
             
-            # Проверяем восстановленную базу
-            if self.verify_backup(self.db_path):
-                logger.info(f"База данных восстановлена из: {backup_path}")
-                return True
-            else:
+            try:
+                # Записываем через backup API, чтобы не затереть файл
+                # под открытыми соединениями и -wal журналом
+                self.copy_database(restore_source, self.db_path)
+            except Exception:
                 # Откатываем изменения
-                shutil.copy2(current_backup, self.db_path)
+                self.copy_database(current_backup, self.db_path)
                 logger.error("Ошибка восстановления, откат изменений")
-                return False
+                raise
+            finally:
+                if restore_source != backup_path:
+                    os.remove(restore_source)
+            
+            logger.info(f"База данных восстановлена из: {backup_path}")
+            return True
                 
         except Exception as e:
             logger.error(f"Ошибка восстановления: {e}", exc_info=True)
             return False
     
+    def copy_database(self, source_path, target_path):
+        """Согласованная копия базы через SQLite backup API"""
+        source_conn = sqlite3.connect(source_path)
+        target_conn = sqlite3.connect(target_path)
+        try:
+            source_conn.backup(target_conn)
+        finally:
+            target_conn.close()
+            source_conn.close()
+    
     def list_backups(self):
         """Список доступных резервных копий"""
         backups = []
@@ -0,0 +1,95 @@
+"""
+Шина доменных событий: заказы, корзина и поступления на склад
+"""
+
+import queue
+import threading
+import time
+from collections import defaultdict
+from logger import logger
+from metrics import registry
+
+# Типы событий
+ORDER_CREATED = 'order_created'
+ORDER_STATUS_CHANGED = 'order_status_changed'
+CART_UPDATED = 'cart_updated'
+STOCK_INBOUND = 'stock_inbound'
+
+EVENTS_PUBLISHED = registry.counter(
+    'bot_domain_events_total',
+    'Опубликованные доменные события по типу',
+    ['event']
+)
+EVENT_LAG = registry.histogram(
+    'bot_domain_event_lag_seconds',
+    'Время от публикации события до окончания его обработки',
+    ['event'],
+    buckets=(0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 15.0, 60.0)
+)
+HANDLER_ERRORS = registry.counter(
+    'bot_domain_event_handler_errors_total',
+    'Исключения в обработчиках доменных событий',
+    ['event']
+)
+
+class EventBus:
+    """Подписка обработчиков на типы событий и доставка в фоновом потоке.
+    
+    publish() только ставит событие в очередь, поэтому запрос пользователя
+    не ждет правил автоматизации. Обработчик вызывается как
+    handler(event_type, payload); его исключение записывается в журнал и
+    не мешает остальным подписчикам.
+    """
+    
+    def __init__(self):
+        self._handlers = defaultdict(list)
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+    
+    def subscribe(self, event_type, handler):
+        """Подписка обработчика на событие"""
+        with self._lock:
+            if handler not in self._handlers[event_type]:
+                self._handlers[event_type].append(handler)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._worker, name='event-bus', daemon=True)
+                self._thread.start()
+    
+    def unsubscribe(self, event_type, handler):
+        """Отписка обработчика"""
+        with self._lock:
+            if handler in self._handlers[event_type]:
+                self._handlers[event_type].remove(handler)
+    
+    def publish(self, event_type, **payload):
+        """Постановка события в очередь доставки"""
+        EVENTS_PUBLISHED.inc(event=event_type)
+        if self._handlers.get(event_type):
+            self._queue.put((event_type, payload, time.perf_counter()))
+    
+    def wait_idle(self):
+        """Ожидание обработки всех поставленных событий"""
+        self._queue.join()
+    
+    def _worker(self):
+        while True:
+            event_type, payload, published_at = self._queue.get()
+            try:
+                self._dispatch(event_type, payload)
+            finally:
+                EVENT_LAG.observe(time.perf_counter() - published_at, event=event_type)
+                self._queue.task_done()
+    
+    def _dispatch(self, event_type, payload):
+        with self._lock:
+            handlers = list(self._handlers.get(event_type, ()))
+        for handler in handlers:
+            try:
+                handler(event_type, payload)
+            except Exception as e:
+                HANDLER_ERRORS.inc(event=event_type)
+                logger.error(f"Ошибка обработчика события {event_type}: {e}")
+
+# Глобальная шина
+event_bus = EventBus()
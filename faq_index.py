@@ -0,0 +1,148 @@
+"""
+Индекс базы знаний FAQ: токены, фразы (Ахо-Корасик) и ранжирование TF-IDF
+"""
+
+import math
+import re
+
+TOKEN = re.compile(r"[\w']+")
+
+# Окончания для усечения: русские и узбекские (латиница), длинные первыми
+SUFFIXES = sorted({
+    # Русские
+    'иями', 'ями', 'ами', 'иях', 'ией', 'ого', 'его', 'ему', 'ому', 'ыми', 'ими',
+    'ение', 'ения', 'ании', 'ания', 'ться', 'ется', 'ются', 'ишь', 'ешь',
+    'ить', 'ать', 'ять', 'еть', 'уть', 'ует', 'ают', 'яют', 'ите', 'ете',
+    'ов', 'ев', 'ей', 'ой', 'ий', 'ый', 'ая', 'яя', 'ое', 'ее', 'ые', 'ие',
+    'ую', 'юю', 'ам', 'ям', 'ах', 'ях', 'ом', 'ем', 'ию', 'ия', 'ть', 'ся',
+    'а', 'я', 'о', 'е', 'ы', 'и', 'у', 'ю', 'ь', 'й',
+    # Узбекские
+    'larning', 'larni', 'larga', 'larda', 'lardan', 'lar',
+    'ning', 'dan', 'ni', 'ga', 'ka', 'qa', 'da', 'mi'
+}, key=len, reverse=True)
+
+# Минимальная длина основы после усечения
+MIN_STEM = 3
+
+# Вес совпадения с ключевым словом и с названием темы
+KEYWORD_WEIGHT = 1.0
+TOPIC_WEIGHT = 2.0
+
+def stem(token):
+    """Основа слова: усечение одного окончания, основа не короче MIN_STEM"""
+    for suffix in SUFFIXES:
+        if token.endswith(suffix) and len(token) - len(suffix) >= MIN_STEM:
+            return token[:-len(suffix)]
+    return token
+
+def tokenize(text):
+    """Основы слов текста в нижнем регистре, ё сводится к е"""
+    text = text.lower().replace('ё', 'е')
+    return [stem(token) for token in TOKEN.findall(text)]
+
+class PhraseAutomaton:
+    """Автомат Ахо-Корасик над последовательностями основ.
+    
+    Находит все вхождения фраз из нескольких слов за один проход
+    по вопросу, независимо от числа фраз.
+    """
+    
+    def __init__(self, phrases):
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]
+        
+        for phrase_id, tokens in enumerate(phrases):
+            state = 0
+            for token in tokens:
+                if token not in self.goto[state]:
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append([])
+                    self.goto[state][token] = len(self.goto) - 1
+                state = self.goto[state][token]
+            self.output[state].append(phrase_id)
+        
+        # Ссылки неудач обходом в ширину
+        queue = list(self.goto[0].values())
+        for state in queue:
+            for token, target in self.goto[state].items():
+                queue.append(target)
+                fallback = self.fail[state]
+                while fallback and token not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[target] = self.goto[fallback].get(token, 0)
+                self.output[target] = self.output[target] + self.output[self.fail[target]]
+    
+    def find(self, tokens):
+        """Идентификаторы найденных фраз (с повторами)"""
+        found = []
+        state = 0
+        for token in tokens:
+            while state and token not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(token, 0)
+            found.extend(self.output[state])
+        return found
+
+class FAQIndex:
+    """Скомпилированный индекс тем FAQ.
+    
+    Однословные ключевые слова и названия тем - основа -> термины,
+    многословные - фразы автомата. Вес термина в теме - KEYWORD_WEIGHT
+    или TOPIC_WEIGHT, умноженный на IDF (редкие по темам термины
+    важнее). Ответ стоит O(длины вопроса + найденных терминов).
+    """
+    
+    def __init__(self, faq_data):
+        self.topics = list(faq_data)
+        self.answers = [faq_data[topic]['answer'] for topic in self.topics]
+        
+        # Термин - основа или кортеж основ фразы; веса по темам
+        term_weights = {}
+        for topic_id, topic in enumerate(self.topics):
+            entries = [(keyword, KEYWORD_WEIGHT) for keyword in faq_data[topic].get('keywords', [])]
+            entries.append((topic, TOPIC_WEIGHT))
+            for text, weight in entries:
+                tokens = tuple(tokenize(text))
+                if not tokens:
+                    continue
+                term = tokens[0] if len(tokens) == 1 else tokens
+                weights = term_weights.setdefault(term, {})
+                weights[topic_id] = weights.get(topic_id, 0) + weight
+        
+        total = len(self.topics)
+        self.postings = {}
+        phrases = []
+        self.phrase_postings = []
+        for term, weights in term_weights.items():
+            idf = math.log(1 + total / len(weights))
+            postings = [(topic_id, weight * idf) for topic_id, weight in weights.items()]
+            if isinstance(term, tuple):
+                phrases.append(term)
+                self.phrase_postings.append(postings)
+            else:
+                self.postings[term] = postings
+        
+        self.automaton = PhraseAutomaton(phrases)
+    
+    def rank(self, question, limit=3):
+        """Лучшие темы для вопроса: [(оценка, тема, ответ)]"""
+        tokens = tokenize(question)
+        scores = {}
+        
+        # Каждый термин учитывается один раз, как и раньше
+        matched = [self.postings[token] for token in set(tokens) if token in self.postings]
+        matched += [self.phrase_postings[phrase_id] for phrase_id in set(self.automaton.find(tokens))]
+        for postings in matched:
+            for topic_id, weight in postings:
+                scores[topic_id] = scores.get(topic_id, 0) + weight
+        
+        # При равенстве выигрывает тема, загруженная раньше
+        best = sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:limit]
+        return [(score, self.topics[topic_id], self.answers[topic_id]) for topic_id, score in best]
+    
+    def best_answer(self, question):
+        """Ответ лучшей темы или None"""
+        ranked = self.rank(question, limit=1)
+        return ranked[0][2] if ranked else None
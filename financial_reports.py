@@ -4,6 +4,7 @@
 
 from datetime import datetime, timedelta
 from utils import format_price
+from csv_export import stream_csv, write_chunks
 
 class FinancialReportsManager:
     def __init__(self, db):
@@ -18,26 +19,26 @@ class FinancialReportsManager:
     
     def generate_profit_loss_report(self, start_date, end_date):
         """Отчет о прибылях и убытках"""
+        self.db.sales_rollup.refresh()
+        
         # Доходы
         revenue_data = self.db.execute_query('''
             SELECT 
-                SUM(total_amount) as gross_revenue,
-                SUM(promo_discount) as total_discounts,
-                COUNT(*) as orders_count,
-                SUM(delivery_cost) as delivery_revenue
-            FROM orders 
-            WHERE DATE(created_at) BETWEEN ? AND ?
+                SUM(revenue) as gross_revenue,
+                SUM(discounts) as total_discounts,
+                COALESCE(SUM(orders), 0) as orders_count,
+                SUM(delivery) as delivery_revenue
+            FROM sales_daily 
+            WHERE day BETWEEN ? AND ?
             AND status IN ('confirmed', 'shipped', 'delivered')
         ''', (start_date, end_date))
         
         # Себестоимость товаров
         cogs_data = self.db.execute_query('''
-            SELECT SUM(oi.quantity * p.cost_price) as total_cogs
-            FROM order_items oi
-            JOIN products p ON oi.product_id = p.id
-            JOIN orders o ON oi.order_id = o.id
-            WHERE DATE(o.created_at) BETWEEN ? AND ?
-            AND o.status IN ('confirmed', 'shipped', 'delivered')
+            SELECT SUM(cogs) as total_cogs
+            FROM sales_daily
+            WHERE day BETWEEN ? AND ?
+            AND status IN ('confirmed', 'shipped', 'delivered')
         ''', (start_date, end_date))
         
         # Операционные расходы
@@ -46,7 +47,7 @@ class FinancialReportsManager:
                 expense_type,
                 SUM(amount) as total_amount
             FROM business_expenses
-            WHERE DATE(expense_date) BETWEEN ? AND ?
+            WHERE expense_day BETWEEN ? AND ?
             GROUP BY expense_type
         ''', (start_date, end_date))
         
@@ -86,38 +87,40 @@ class FinancialReportsManager:
     
     def generate_cash_flow_report(self, start_date, end_date):
         """Отчет о движении денежных средств"""
+        self.db.sales_rollup.refresh()
+        
         # Поступления
         cash_inflows = self.db.execute_query('''
             SELECT 
-                DATE(created_at) as date,
-                SUM(total_amount - COALESCE(promo_discount, 0)) as daily_revenue
-            FROM orders
-            WHERE DATE(created_at) BETWEEN ? AND ?
+                day as date,
+                SUM(revenue - discounts) as daily_revenue
+            FROM sales_daily
+            WHERE day BETWEEN ? AND ?
             AND payment_status = 'paid'
-            GROUP BY DATE(created_at)
+            GROUP BY day
             ORDER BY date
         ''', (start_date, end_date))
         
         # Расходы
         cash_outflows = self.db.execute_query('''
             SELECT 
-                DATE(expense_date) as date,
+                expense_day as date,
                 SUM(amount) as daily_expenses
             FROM business_expenses
-            WHERE DATE(expense_date) BETWEEN ? AND ?
-            GROUP BY DATE(expense_date)
+            WHERE expense_day BETWEEN ? AND ?
+            GROUP BY expense_day
             ORDER BY date
         ''', (start_date, end_date))
         
         # Закупки товаров
         inventory_purchases = self.db.execute_query('''
             SELECT 
-                DATE(created_at) as date,
+                created_day as date,
                 SUM(total_amount) as daily_purchases
             FROM purchase_orders
-            WHERE DATE(created_at) BETWEEN ? AND ?
+            WHERE created_day BETWEEN ? AND ?
             AND status = 'paid'
-            GROUP BY DATE(created_at)
+            GROUP BY created_day
             ORDER BY date
         ''', (start_date, end_date))
         
@@ -166,13 +169,15 @@ class FinancialReportsManager:
     
     def generate_tax_report(self, start_date, end_date):
         """Налоговый отчет"""
+        self.db.sales_rollup.refresh()
+        
         # Налогооблагаемые доходы
         taxable_income = self.db.execute_query('''
             SELECT 
-                SUM(total_amount - COALESCE(promo_discount, 0)) as net_revenue,
-                SUM(total_amount - COALESCE(promo_discount, 0)) * ? as vat_amount
-            FROM orders
-            WHERE DATE(created_at) BETWEEN ? AND ?
+                SUM(revenue - discounts) as net_revenue,
+                SUM(revenue - discounts) * ? as vat_amount
+            FROM sales_daily
+            WHERE day BETWEEN ? AND ?
             AND status IN ('confirmed', 'shipped', 'delivered')
         ''', (self.tax_rate, start_date, end_date))
         
@@ -182,7 +187,7 @@ class FinancialReportsManager:
                 expense_type,
                 SUM(amount) as total_amount
             FROM business_expenses
-            WHERE DATE(expense_date) BETWEEN ? AND ?
+            WHERE expense_day BETWEEN ? AND ?
             AND is_tax_deductible = 1
             GROUP BY expense_type
         ''', (start_date, end_date))
@@ -330,17 +335,22 @@ class FinancialReportsManager:
         
         return "❌ Неизвестный тип отчета"
     
-    def export_financial_data_csv(self, report_type, start_date, end_date):
-        """Экспорт финансовых данных в CSV"""
-        import csv
-        import io
-        
-        output = io.StringIO()
-        writer = csv.writer(output)
-        
+    def export_financial_data_csv(self, report_type, start_date, end_date, path=None, compress=False, progress=None):
+        """Экспорт финансовых данных в CSV.
+        
+        Без path возвращает текст CSV. С path выгрузка пишется в файл по
+        частям (при compress - в gzip) и возвращается размер файла в байтах.
+        """
+        chunks = self.iter_financial_data_csv(report_type, start_date, end_date, progress)
+        if path is None:
+            return ''.join(chunks)
+        return write_chunks(chunks, path, compress)
+    
+    def iter_financial_data_csv(self, report_type, start_date, end_date, progress=None):
+        """CSV финансовых данных частями, строки читаются из базы блоками"""
         if report_type == 'transactions':
             # Экспорт всех транзакций
-            transactions = self.db.execute_query('''
+            transactions = self.db.stream_query('''
                 SELECT 
                     o.id,
                     o.created_at,
@@ -351,21 +361,20 @@ class FinancialReportsManager:
                     o.status
                 FROM orders o
                 JOIN users u ON o.user_id = u.id
-                WHERE DATE(o.created_at) BETWEEN ? AND ?
+                WHERE o.created_day BETWEEN ? AND ?
                 ORDER BY o.created_at DESC
             ''', (start_date, end_date))
             
-            writer.writerow(['Order ID', 'Date', 'Customer', 'Amount', 'Discount', 'Payment Method', 'Status'])
-            for transaction in transactions:
-                writer.writerow([
-                    transaction[0], transaction[1], transaction[2],
-                    f"${transaction[3]:.2f}", f"${transaction[4] or 0:.2f}",
-                    transaction[5], transaction[6]
-                ])
+            header = ['Order ID', 'Date', 'Customer', 'Amount', 'Discount', 'Payment Method', 'Status']
+            yield from stream_csv(header, transactions, lambda transaction: [
+                transaction[0], transaction[1], transaction[2],
+                f"${transaction[3]:.2f}", f"${transaction[4] or 0:.2f}",
+                transaction[5], transaction[6]
+            ], progress)
         
         elif report_type == 'products_performance':
             # Экспорт эффективности товаров
-            products = self.db.execute_query('''
+            products = self.db.stream_query('''
                 SELECT 
                     p.name,
                     SUM(oi.quantity) as units_sold,
@@ -377,21 +386,18 @@ class FinancialReportsManager:
                 FROM products p
                 LEFT JOIN order_items oi ON p.id = oi.product_id
                 LEFT JOIN orders o ON oi.order_id = o.id 
-                    AND DATE(o.created_at) BETWEEN ? AND ?
+                    AND o.created_day BETWEEN ? AND ?
                     AND o.status != 'cancelled'
                 GROUP BY p.id, p.name, p.stock, p.views
                 ORDER BY profit DESC
             ''', (start_date, end_date))
             
-            writer.writerow(['Product', 'Units Sold', 'Revenue', 'Cost', 'Profit', 'Stock', 'Views'])
-            for product in products:
-                writer.writerow([
-                    product[0], product[1] or 0, f"${product[2] or 0:.2f}",
-                    f"${product[3] or 0:.2f}", f"${product[4] or 0:.2f}",
-                    product[5], product[6]
-                ])
-        
-        return output.getvalue()
+            header = ['Product', 'Units Sold', 'Revenue', 'Cost', 'Profit', 'Stock', 'Views']
+            yield from stream_csv(header, products, lambda product: [
+                product[0], product[1] or 0, f"${product[2] or 0:.2f}",
+                f"${product[3] or 0:.2f}", f"${product[4] or 0:.2f}",
+                product[5], product[6]
+            ], progress)
     
     def calculate_business_metrics(self):
         """Расчет ключевых бизнес-метрик"""
@@ -403,12 +409,12 @@ class FinancialReportsManager:
         marketing_spend = self.db.execute_query('''
             SELECT SUM(amount) FROM business_expenses
             WHERE expense_type = 'marketing'
-            AND DATE(expense_date) >= ?
+            AND expense_day >= ?
         ''', (start_date.strftime('%Y-%m-%d'),))[0][0] or 0
         
         new_customers = self.db.execute_query('''
             SELECT COUNT(*) FROM users
-            WHERE DATE(created_at) >= ?
+            WHERE created_at >= ?
             AND is_admin = 0
         ''', (start_date.strftime('%Y-%m-%d'),))[0][0]
         
@@ -440,7 +446,7 @@ class FinancialReportsManager:
         # Churn Rate (отток клиентов)
         active_customers_30_days_ago = self.db.execute_query('''
             SELECT COUNT(DISTINCT user_id) FROM orders
-            WHERE DATE(created_at) BETWEEN ? AND ?
+            WHERE created_day BETWEEN ? AND ?
             AND status != 'cancelled'
         ''', (
             (start_date - timedelta(days=30)).strftime('%Y-%m-%d'),
@@ -449,7 +455,7 @@ class FinancialReportsManager:
         
         active_customers_now = self.db.execute_query('''
             SELECT COUNT(DISTINCT user_id) FROM orders
-            WHERE DATE(created_at) >= ?
+            WHERE created_day >= ?
             AND status != 'cancelled'
         ''', (start_date.strftime('%Y-%m-%d'),))[0][0]
         
@@ -457,10 +463,11 @@ class FinancialReportsManager:
                      active_customers_30_days_ago * 100) if active_customers_30_days_ago > 0 else 0
         
         # Monthly Recurring Revenue (MRR) - для подписочных товаров
+        self.db.sales_rollup.refresh()
         mrr = self.db.execute_query('''
-            SELECT SUM(total_amount) / 30 as daily_revenue
-            FROM orders
-            WHERE DATE(created_at) >= ?
+            SELECT SUM(revenue) / 30 as daily_revenue
+            FROM sales_daily
+            WHERE day >= ?
             AND status != 'cancelled'
         ''', (start_date.strftime('%Y-%m-%d'),))[0][0] or 0
         
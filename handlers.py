@@ -21,6 +21,7 @@ from utils import (
 )
 from localization import t, get_user_language
 from payments import PaymentProcessor, create_payment_keyboard, format_payment_info
+from router import Router
 
 logger = logging.getLogger(__name__)
 
@@ -31,6 +32,68 @@ class MessageHandler:
         self.user_states = {}
         self.notification_manager = None
         self.payment_processor = PaymentProcessor()
+        self.command_routes = Router('user_commands')
+        self.button_routes = Router('user_buttons')
+        self.state_routes = Router('user_states')
+        self.callback_routes = Router('user_callbacks')
+        self.register_routes()
+    
+    def register_routes(self):
+        """Маршруты пользовательских команд, кнопок, состояний и callback'ов"""
+        # Команды проверяются раньше состояний пользователя
+        commands = self.command_routes
+        commands.add('/start', self.handle_start_command)
+        commands.add('/help', self.show_help)
+        commands.add('/notifications', self.show_user_notifications)
+        commands.add_prefix('/order_', self.handle_order_command)
+        commands.add_prefix('/track_', self.handle_track_command)
+        commands.add_prefix('/promo_', self.handle_promo_command)
+        commands.add_prefix('/restore_', self.handle_restore_command)
+        
+        # Кнопки меню
+        buttons = self.button_routes
+        buttons.add('🛍 Каталог', self.show_catalog)
+        buttons.add('🛒 Корзина', self.show_cart)
+        buttons.add('📋 Мои заказы', self.show_user_orders)
+        buttons.add('👤 Профиль', self.show_user_profile)
+        buttons.add('🔍 Поиск', self.start_product_search)
+        buttons.add('ℹ️ Помощь', self.show_help)
+        buttons.add('⭐ Программа лояльности', self.show_loyalty_program)
+        buttons.add('🎁 Промокоды', self.show_available_promos)
+        buttons.add(['🔙 Главная', '🏠 Главная'], self.show_main_menu)
+        buttons.add('🌍 Сменить язык', self.start_language_change)
+        buttons.add('📦 Оформить заказ', self.start_order_process)
+        buttons.add(['💳 Онлайн оплата', '💵 Наличными при получении'], self.handle_payment_method_selection)
+        buttons.add('🗑 Очистить корзину', self.clear_user_cart)
+        buttons.add('➕ Добавить товары', self.show_catalog)
+        
+        # Выбор категории, подкатегории/бренда и товара по эмодзи кнопки
+        # ('📱 ' есть и у категорий, и у брендов - кнопка ведет в категорию)
+        buttons.add_prefix(['📱 ', '👕 ', '🏠 ', '⚽ ', '💄 ', '📚 '], self.handle_category_selection)
+        buttons.add_prefix(['🍎 ', '✔️ ', '👖 ', '☕ ', '👟 ', '💎 ', '📖 '], self.handle_subcategory_selection)
+        buttons.add_prefix('🛍 ', self.handle_product_selection)
+        
+        # Состояния пользователя
+        states = self.state_routes
+        states.add('registration_name', self.handle_registration_name)
+        states.add('registration_phone', self.handle_registration_phone)
+        states.add('registration_email', self.handle_registration_email)
+        states.add('registration_language', self.handle_registration_language)
+        states.add('searching', self.handle_search_query)
+        states.add('order_address', self.handle_order_address)
+        states.add('changing_language', self.handle_language_change)
+        if hasattr(self, 'handle_product_rating'):
+            states.add_prefix('rating_product_', self.handle_product_rating)
+        
+        # Callback'и инлайн кнопок
+        callbacks = self.callback_routes
+        callbacks.add_prefix('add_to_cart_', self.handle_add_to_cart)
+        callbacks.add_prefix('add_to_favorites_', self.handle_add_to_favorites)
+        callbacks.add_prefix('reviews_', self.handle_show_reviews)
+        callbacks.add_prefix('rate_product_', self.handle_rate_product)
+        callbacks.add_prefix('cart_', self.handle_cart_action)
+        callbacks.add_prefix('pay_', self.handle_payment_selection)
+        callbacks.add('cancel_payment', self.handle_cancel_payment)
     
     def handle_message(self, message):
         """Главный обработчик сообщений"""
@@ -51,77 +114,16 @@ class MessageHandler:
             if user_data:
                 user_language = user_data[0][5] or 'ru'
             
-            # Обрабатываем команды
-            if text == '/start':
-                self.handle_start_command(message)
-            elif text == '/help':
-                self.handle_help_command(message, user_language)
-            elif text.startswith('/order_'):
-                self.handle_order_command(message)
-            elif text.startswith('/track_'):
-                self.handle_track_command(message)
-            elif text.startswith('/promo_'):
-                self.handle_promo_command(message)
-            elif text.startswith('/restore_'):
-                self.handle_restore_command(message)
-            elif text == '/notifications':
-                self.show_user_notifications(message)
-            
-            # Обрабатываем состояния пользователя
-            elif telegram_id in self.user_states:
+            # Команды, затем состояние пользователя, затем кнопки меню
+            route = self.command_routes.resolve(text)
+            if route is None and telegram_id in self.user_states:
                 self.handle_user_state(message)
+                return
+            if route is None:
+                route = self.button_routes.resolve(text)
             
-            # Обрабатываем кнопки меню
-            elif text == '🛍 Каталог':
-                self.show_catalog(message)
-            elif text == '🛒 Корзина':
-                self.show_cart(message)
-            elif text == '📋 Мои заказы':
-                self.show_user_orders(message)
-            elif text == '👤 Профиль':
-                self.show_user_profile(message)
-            elif text == '🔍 Поиск':
-                self.start_product_search(message)
-            elif text == 'ℹ️ Помощь':
-                self.handle_help_command(message, user_language)
-            elif text == '⭐ Программа лояльности':
-                self.show_loyalty_program(message)
-            elif text == '🎁 Промокоды':
-                self.show_available_promos(message)
-            elif text == '🔙 Главная' or text == '🏠 Главная':
-                self.show_main_menu(message)
-            elif text == '🌍 Сменить язык':
-                self.start_language_change(message)
-            
-            # Обрабатываем выбор категории
-            elif text.startswith('📱 ') or text.startswith('👕 ') or text.startswith('🏠 ') or text.startswith('⚽ ') or text.startswith('💄 ') or text.startswith('📚 '):
-                self.handle_category_selection(message)
-            
-            # Обрабатываем выбор подкатегории/бренда
-            elif text.startswith('🍎 ') or text.startswith('📱 ') or text.startswith('✔️ ') or text.startswith('👖 ') or text.startswith('☕ ') or text.startswith('👟 ') or text.startswith('💎 ') or text.startswith('📖 '):
-                self.handle_subcategory_selection(message)
-            
-            # Обрабатываем выбор товара
-            elif text.startswith('🛍 '):
-                self.handle_product_selection(message)
-            
-            # Обрабатываем поиск
-            elif telegram_id in self.user_states and self.user_states[telegram_id] == 'searching':
-                self.handle_search_query(message)
-            
-            # Обрабатываем оформление заказа
-            elif text == '📦 Оформить заказ':
-                self.start_order_process(message)
-            elif text in ['💳 Онлайн оплата', '💵 Наличными при получении']:
-                self.handle_payment_method_selection(message)
-            
-            # Обрабатываем управление корзиной
-            elif text == '🗑 Очистить корзину':
-                self.clear_user_cart(message)
-            elif text == '➕ Добавить товары':
-                self.show_catalog(message)
-            
-            # Неизвестная команда
+            if route:
+                route(message)
             else:
                 self.handle_unknown_command(message, user_language)
                 
@@ -174,22 +176,9 @@ class MessageHandler:
         telegram_id = message['from']['id']
         state = self.user_states.get(telegram_id)
         
-        if state == 'registration_name':
-            self.handle_registration_name(message)
-        elif state == 'registration_phone':
-            self.handle_registration_phone(message)
-        elif state == 'registration_email':
-            self.handle_registration_email(message)
-        elif state == 'registration_language':
-            self.handle_registration_language(message)
-        elif state == 'searching':
-            self.handle_search_query(message)
-        elif state == 'order_address':
-            self.handle_order_address(message)
-        elif state == 'changing_language':
-            self.handle_language_change(message)
-        elif state.startswith('rating_product_'):
-            self.handle_product_rating(message)
+        route = self.state_routes.resolve(state)
+        if route:
+            route(message)
     
     def handle_registration_name(self, message):
         """Обработка ввода имени при регистрации"""
@@ -328,6 +317,11 @@ class MessageHandler:
         prompt_text = "👋 Добро пожаловать!\n\nДля использования бота необходимо пройти регистрацию.\n\nНажмите /start для начала."
         self.bot.send_message(chat_id, prompt_text)
     
+    def show_help(self, message):
+        """Справка на языке пользователя"""
+        language = get_user_language(self.db, message['from']['id']) or 'ru'
+        self.handle_help_command(message, language)
+    
     def handle_help_command(self, message, language='ru'):
         """Обработка команды помощи"""
         chat_id = message['chat']['id']
@@ -368,14 +362,10 @@ class MessageHandler:
         # Извлекаем название категории
         category_name = text[2:].strip()  # Убираем эмодзи
         
-        # Находим категорию в базе
-        category = self.db.execute_query(
-            'SELECT id FROM categories WHERE name = ? AND is_active = 1',
-            (category_name,)
-        )
+        # Находим категорию в кэше каталога
+        category_id = self.db.catalog.snapshot().find_category_id(category_name)
         
-        if category:
-            category_id = category[0][0]
+        if category_id:
             
             # Получаем подкатегории/бренды
             subcategories = self.db.get_products_by_category(category_id)
@@ -397,13 +387,9 @@ class MessageHandler:
         subcategory_name = text[2:].strip()  # Убираем эмодзи
         
         # Находим подкатегорию
-        subcategory = self.db.execute_query(
-            'SELECT id FROM subcategories WHERE name = ? AND is_active = 1',
-            (subcategory_name,)
-        )
+        subcategory_id = self.db.catalog.snapshot().find_subcategory_id(subcategory_name)
         
-        if subcategory:
-            subcategory_id = subcategory[0][0]
+        if subcategory_id:
             
             # Получаем товары подкатегории
             products = self.db.get_products_by_subcategory(subcategory_id)
@@ -431,16 +417,20 @@ class MessageHandler:
             product_name = product_info
         
         # Находим товар
-        product = self.db.execute_query(
-            'SELECT * FROM products WHERE name = ? AND is_active = 1',
-            (product_name,)
-        )
+        product = self.db.catalog.snapshot().find_product(product_name)
         
         if product:
-            self.show_product_details(chat_id, product[0])
+            self.show_product_details(chat_id, product)
         else:
             self.bot.send_message(chat_id, "❌ Товар не найден")
     
+    def get_product(self, product_id):
+        """Товар из снимка каталога; снимок может отставать от базы - тогда из базы"""
+        product = self.db.catalog.snapshot().get_product(product_id)
+        if product is None:
+            product = self.db.get_product_by_id(product_id)
+        return product
+    
     def show_product_details(self, chat_id, product):
         """Показ деталей товара"""
         try:
@@ -573,7 +563,8 @@ class MessageHandler:
         if user[4]:
             profile_text += f"📧 Email: {user[4]}\n"
         
-        profile_text += f"🌍 Язык: {'🇷🇺 Русский' if user[5] == 'ru' else '🇺🇿 O\\'zbekcha'}\n"
+        language_name = '🇷🇺 Русский' if user[5] == 'ru' else "🇺🇿 O'zbekcha"
+        profile_text += f"🌍 Язык: {language_name}\n"
         profile_text += f"📅 Регистрация: {format_date(user[7])}\n\n"
         
         profile_text += f"📊 <b>Статистика:</b>\n"
@@ -738,19 +729,27 @@ class MessageHandler:
         order_data = getattr(self, 'order_data', {}).get(telegram_id, {})
         delivery_address = order_data.get('address', 'Не указан')
         
-        order_id = self.db.create_order(user_id, total_amount, delivery_address, payment_method)
+        points_earned = int(total_amount * 0.05)  # 5% от суммы
+        
+        # Заказ, его товары, очистка корзины и баллы - одна транзакция
+        try:
+            with self.db.transaction():
+                order_id = self.db.create_order(user_id, total_amount, delivery_address, payment_method)
+                
+                if order_id:
+                    # Добавляем товары в заказ
+                    self.db.add_order_items(order_id, cart_items)
+                    
+                    # Очищаем корзину
+                    self.db.clear_cart(user_id)
+                    
+                    # Начисляем баллы лояльности
+                    self.db.update_loyalty_points(user_id, points_earned)
+        except Exception as e:
+            logger.error(f"Ошибка оформления заказа: {e}")
+            order_id = None
         
         if order_id:
-            # Добавляем товары в заказ
-            self.db.add_order_items(order_id, cart_items)
-            
-            # Очищаем корзину
-            self.db.clear_cart(user_id)
-            
-            # Начисляем баллы лояльности
-            points_earned = int(total_amount * 0.05)  # 5% от суммы
-            self.db.update_loyalty_points(user_id, points_earned)
-            
             # Уведомляем клиента
             success_text = f"✅ <b>Заказ #{order_id} оформлен!</b>\n\n"
             success_text += f"💰 Сумма: {format_price(total_amount)}\n"
@@ -1092,28 +1091,18 @@ class MessageHandler:
     def handle_callback_query(self, callback_query):
         """Обработка callback запросов"""
         try:
-            data = callback_query['data']
-            chat_id = callback_query['message']['chat']['id']
-            telegram_id = callback_query['from']['id']
-            
-            if data.startswith('add_to_cart_'):
-                self.handle_add_to_cart(callback_query)
-            elif data.startswith('add_to_favorites_'):
-                self.handle_add_to_favorites(callback_query)
-            elif data.startswith('reviews_'):
-                self.handle_show_reviews(callback_query)
-            elif data.startswith('rate_product_'):
-                self.handle_rate_product(callback_query)
-            elif data.startswith('cart_'):
-                self.handle_cart_action(callback_query)
-            elif data.startswith('pay_'):
-                self.handle_payment_selection(callback_query)
-            elif data == 'cancel_payment':
-                self.bot.send_message(chat_id, "❌ Оплата отменена")
+            route = self.callback_routes.resolve(callback_query.get('data'))
+            if route:
+                route(callback_query)
             
         except Exception as e:
             logger.error(f"Ошибка обработки callback: {e}")
     
+    def handle_cancel_payment(self, callback_query):
+        """Отмена оплаты"""
+        chat_id = callback_query['message']['chat']['id']
+        self.bot.send_message(chat_id, "❌ Оплата отменена")
+    
     def handle_add_to_cart(self, callback_query):
         """Добавление товара в корзину"""
         data = callback_query['data']
@@ -1133,8 +1122,9 @@ class MessageHandler:
             result = self.db.add_to_cart(user_id, product_id, 1)
             
             if result:
-                product = self.db.get_product_by_id(product_id)
-                success_text = f"✅ <b>{product[1]}</b> добавлен в корзину!"
+                product = self.get_product(product_id)
+                product_name = product[1] if product else 'Товар'
+                success_text = f"✅ <b>{product_name}</b> добавлен в корзину!"
                 
                 # Показываем кнопку перехода в корзину
                 cart_keyboard = {
@@ -1173,8 +1163,9 @@ class MessageHandler:
             result = self.db.add_to_favorites(user_id, product_id)
             
             if result:
-                product = self.db.get_product_by_id(product_id)
-                self.bot.send_message(chat_id, f"❤️ {product[1]} добавлен в избранное!")
+                product = self.get_product(product_id)
+                product_name = product[1] if product else 'Товар'
+                self.bot.send_message(chat_id, f"❤️ {product_name} добавлен в избранное!")
             else:
                 self.bot.send_message(chat_id, "❌ Ошибка добавления в избранное")
                 
@@ -1189,8 +1180,12 @@ class MessageHandler:
         try:
             product_id = int(data.split('_')[1])
             
+            product = self.get_product(product_id)
+            if not product:
+                self.bot.send_message(chat_id, "❌ Товар не найден")
+                return
+            
             reviews = self.db.get_product_reviews(product_id)
-            product = self.db.get_product_by_id(product_id)
             
             if reviews:
                 reviews_text = f"⭐ <b>Отзывы о товаре:</b>\n{product[1]}\n\n"
@@ -8,6 +8,7 @@ import psutil
 from datetime import datetime
 from config import MONITORING_CONFIG
 from logger import logger
+from metrics import track_job
 
 class HealthMonitor:
     def __init__(self, db, bot):
@@ -22,6 +23,7 @@ class HealthMonitor:
             'memory_usage': 0,
             'cpu_usage': 0
         }
+        self.metrics_lock = threading.Lock()
         self.start_monitoring()
     
     def start_monitoring(self):
@@ -29,8 +31,9 @@ class HealthMonitor:
         def monitor_worker():
             while True:
                 try:
-                    self.update_metrics()
-                    self.check_health()
+                    with track_job('health_check'):
+                        self.update_metrics()
+                        self.check_health()
                     time.sleep(MONITORING_CONFIG['health_check_interval'])
                 except Exception as e:
                     logger.error(f"Ошибка мониторинга: {e}", exc_info=True)
@@ -49,7 +52,10 @@ class HealthMonitor:
         
         # Проверка базы данных
         try:
-            self.db.execute_query('SELECT 1')
+            self.metrics['db_pool'] = self.db.get_pool_status()
+            self.metrics['user_cache'] = self.db.user_cache.get_stats()
+            if self.db.execute_query('SELECT 1') is None:
+                raise RuntimeError('SELECT 1 не выполнен')
             self.metrics['database_status'] = 'healthy'
         except Exception as e:
             self.metrics['database_status'] = 'error'
@@ -107,11 +113,13 @@ class HealthMonitor:
     
     def increment_messages(self):
         """Увеличить счетчик сообщений"""
-        self.metrics['messages_processed'] += 1
+        with self.metrics_lock:
+            self.metrics['messages_processed'] += 1
     
     def increment_errors(self, error_message=None):
         """Увеличить счетчик ошибок"""
-        self.metrics['errors_count'] += 1
+        with self.metrics_lock:
+            self.metrics['errors_count'] += 1
         if error_message:
             self.metrics['last_error'] = {
                 'message': error_message,
@@ -127,7 +135,9 @@ class HealthMonitor:
             'cpu_percent': self.metrics['cpu_usage'],
             'messages_processed': self.metrics['messages_processed'],
             'errors_count': self.metrics['errors_count'],
-            'database_status': self.metrics['database_status']
+            'database_status': self.metrics['database_status'],
+            'db_pool': self.metrics.get('db_pool', {}),
+            'user_cache': self.metrics.get('user_cache', {})
         }
     
     def create_health_endpoint(self):
@@ -137,7 +147,14 @@ class HealthMonitor:
         
         class HealthHandler(BaseHTTPRequestHandler):
             def do_GET(self):
-                if self.path == '/health':
+                if self.path == '/health/queries':
+                    report = self.server.health_monitor.db.get_query_report(limit=50)
+                    
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'application/json')
+                    self.end_headers()
+                    self.wfile.write(json.dumps(report, indent=2, ensure_ascii=False).encode())
+                elif self.path == '/health':
                     health_status = self.server.health_monitor.get_health_status()
                     
                     self.send_response(200 if health_status['status'] == 'healthy' else 503)
@@ -0,0 +1,215 @@
+"""
+Проверка планов горячих запросов на полные сканирования таблиц
+
+Запуск из командной строки:
+    python index_advisor.py [путь к базе]
+"""
+
+import re
+import sys
+from database import DatabaseManager
+from logger import logger
+
+# Горячие запросы: (имя, SQL, параметры для построения плана).
+# Текст совпадает с запросами в коде, значения параметров не важны
+HOT_QUERIES = [
+    (
+        'cart_item',
+        'SELECT id, quantity FROM cart WHERE user_id = ? AND product_id = ?',
+        (1, 1)
+    ),
+    (
+        'cart_items',
+        '''SELECT c.id, p.name, p.price, c.quantity, p.image_url, p.id as product_id
+           FROM cart c
+           JOIN products p ON c.product_id = p.id
+           WHERE c.user_id = ?
+           ORDER BY c.created_at DESC''',
+        (1,)
+    ),
+    (
+        'user_orders',
+        '''SELECT COUNT(*), SUM(total_amount), MIN(created_at), MAX(created_at)
+           FROM orders
+           WHERE user_id = ? AND status != 'cancelled' ''',
+        (1,)
+    ),
+    (
+        'order_items',
+        '''SELECT oi.quantity, oi.price, p.name, p.image_url
+           FROM order_items oi
+           JOIN products p ON oi.product_id = p.id
+           WHERE oi.order_id = ?''',
+        (1,)
+    ),
+    (
+        'product_sales_history',
+        '''SELECT DATE(o.created_at) as sale_date, SUM(oi.quantity) as daily_sales
+           FROM order_items oi
+           JOIN orders o ON oi.order_id = o.id
+           WHERE oi.product_id = ?
+           AND o.created_at >= datetime('now', '-90 days')
+           AND o.status != 'cancelled'
+           GROUP BY DATE(o.created_at)
+           ORDER BY sale_date''',
+        (1,)
+    ),
+    (
+        'user_purchased_product',
+        '''SELECT COUNT(*) FROM order_items oi
+           JOIN orders o ON oi.order_id = o.id
+           WHERE o.user_id = ? AND oi.product_id = ? AND o.status != 'cancelled' ''',
+        (1, 1)
+    ),
+    (
+        'subcategory_products',
+        '''SELECT * FROM products
+           WHERE subcategory_id = ? AND is_active = 1
+           ORDER BY name LIMIT ? OFFSET ?''',
+        (1, 10, 0)
+    ),
+    (
+        'promo_uses_by_user',
+        'SELECT COUNT(*) FROM promo_uses WHERE promo_code_id = ? AND user_id = ?',
+        (1, 1)
+    ),
+    (
+        'unread_notifications',
+        '''SELECT * FROM notifications
+           WHERE user_id = ? AND is_read = 0
+           ORDER BY created_at DESC''',
+        (1,)
+    ),
+    (
+        'recent_inbound',
+        '''SELECT product_id FROM inventory_movements
+           WHERE movement_type = 'inbound'
+           AND created_at >= datetime('now', '-1 hour')''',
+        ()
+    ),
+    (
+        'product_subscribers',
+        'SELECT user_id FROM favorites WHERE product_id = ?',
+        (1,)
+    ),
+    (
+        'similar_products',
+        '''SELECT similar_id, score FROM product_similarity
+           WHERE product_id = ?
+           ORDER BY score DESC
+           LIMIT ?''',
+        (1, 5)
+    ),
+    (
+        'churn_at_risk',
+        '''SELECT user_id, score FROM user_churn_scores
+           WHERE risk = ?
+           ORDER BY score DESC
+           LIMIT ?''',
+        ('high', 100)
+    ),
+    (
+        'automation_executed',
+        '''SELECT 1 FROM automation_executions
+           WHERE user_id IS ? AND rule_id = ? AND executed_at >= ?
+           LIMIT 1''',
+        (1, 1, '2024-01-01 00:00:00')
+    ),
+    (
+        'search_history',
+        '''SELECT search_query, created_at
+           FROM user_activity_logs
+           WHERE user_id = ? AND action = 'search'
+           ORDER BY created_at DESC
+           LIMIT 20''',
+        (1,)
+    ),
+    (
+        'sales_report',
+        '''SELECT COUNT(*), SUM(total_amount), AVG(total_amount), COUNT(DISTINCT user_id)
+           FROM orders
+           WHERE created_day BETWEEN ? AND ?
+           AND status != 'cancelled' ''',
+        ('2024-01-01', '2024-01-31')
+    ),
+    (
+        'daily_expenses',
+        '''SELECT expense_day as date, SUM(amount) as daily_expenses
+           FROM business_expenses
+           WHERE expense_day BETWEEN ? AND ?
+           GROUP BY expense_day
+           ORDER BY date''',
+        ('2024-01-01', '2024-01-31')
+    )
+]
+
+# Полное сканирование таблицы: SCAN без индекса ("SCAN orders", "SCAN o")
+FULL_SCAN = re.compile(r'^SCAN (\w+)$')
+
+def analyze_plan(plan):
+    """Разбор строк плана (id, parent, notused, detail).
+    
+    Возвращает (warnings, notes): полные сканирования таблиц и
+    сортировки во временном B-дереве.
+    """
+    warnings = []
+    notes = []
+    for _, _, _, detail in plan:
+        if FULL_SCAN.match(detail):
+            warnings.append(f'полное сканирование: {detail}')
+        elif 'USE TEMP B-TREE' in detail:
+            notes.append(detail)
+    return warnings, notes
+
+def check_query_plans(db, queries=None):
+    """EXPLAIN QUERY PLAN для горячих запросов.
+    
+    Возвращает список {'name', 'plan', 'warnings', 'notes'}.
+    """
+    results = []
+    for name, query, params in (queries or HOT_QUERIES):
+        try:
+            with db.read_pool.connection() as conn:
+                plan = conn.execute(f'EXPLAIN QUERY PLAN {query}', params).fetchall()
+        except Exception as e:
+            results.append({'name': name, 'plan': [], 'warnings': [f'EXPLAIN недоступен: {e}'], 'notes': []})
+            continue
+        
+        warnings, notes = analyze_plan(plan)
+        results.append({
+            'name': name,
+            'plan': [row[3] for row in plan],
+            'warnings': warnings,
+            'notes': notes
+        })
+    return results
+
+def log_query_plan_warnings(db):
+    """Проверка при запуске: предупреждения в журнал, число проблемных запросов"""
+    problems = [result for result in check_query_plans(db) if result['warnings']]
+    for result in problems:
+        logger.warning(f"План запроса {result['name']}: {'; '.join(result['warnings'])}")
+    if not problems:
+        logger.info(f"Планы горячих запросов в порядке: {len(HOT_QUERIES)} проверено")
+    return len(problems)
+
+def main(db_path='shop_bot.db'):
+    db = DatabaseManager(db_path)
+    results = check_query_plans(db)
+    for result in results:
+        status = '⚠️' if result['warnings'] else '✅'
+        print(f"{status} {result['name']}")
+        for line in result['plan']:
+            print(f"    {line}")
+        for warning in result['warnings']:
+            print(f"    -> {warning}")
+        for note in result['notes']:
+            print(f"    -> заметка: {note}")
+    db.close()
+    
+    problems = sum(1 for result in results if result['warnings'])
+    print(f"\nПроверено запросов: {len(results)}, с замечаниями: {problems}")
+    return 1 if problems else 0
+
+if __name__ == '__main__':
+    sys.exit(main(*sys.argv[1:2]))
@@ -4,6 +4,8 @@
 
 from datetime import datetime, timedelta
 from utils import format_price, format_date
+from csv_export import stream_csv, write_chunks
+from events import STOCK_INBOUND
 
 class InventoryManager:
     def __init__(self, db):
@@ -83,6 +85,12 @@ class InventoryManager:
             datetime.now().strftime('%Y-%m-%d %H:%M:%S')
         ))
         
+        if movement_type == 'inbound' and quantity_change > 0:
+            self.db.publish_event(
+                STOCK_INBOUND, product_id=product_id,
+                quantity=quantity_change, old_quantity=old_quantity, new_quantity=new_quantity
+            )
+        
         # Проверяем правила автопополнения
         if new_quantity <= self.reorder_rules.get(product_id, {}).get('reorder_point', 0):
             self.trigger_automatic_reorder(product_id)
@@ -116,6 +124,11 @@ class InventoryManager:
             datetime.now().strftime('%Y-%m-%d %H:%M:%S')
         ))
         
+        self.db.publish_event(
+            STOCK_INBOUND, product_id=product_id,
+            quantity=quantity, old_quantity=current_stock, new_quantity=new_stock
+        )
+        
         # Уведомляем о поступлении
         self.notify_restock(product_id)
         
@@ -123,54 +136,53 @@ class InventoryManager:
     
     def reserve_stock(self, product_id, quantity, order_id):
         """Резервирование товара для заказа"""
-        current_stock = self.db.execute_query(
-            'SELECT stock FROM products WHERE id = ?',
-            (product_id,)
-        )[0][0]
-        
-        if current_stock < quantity:
-            return False, "Недостаточно товара на складе"
-        
-        # Создаем резерв
-        self.db.execute_query('''
-            INSERT INTO stock_reservations (
-                product_id, order_id, quantity, expires_at, created_at
-            ) VALUES (?, ?, ?, ?, ?)
-        ''', (
-            product_id, order_id, quantity,
-            (datetime.now() + timedelta(hours=24)).strftime('%Y-%m-%d %H:%M:%S'),
-            datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        ))
-        
-        # Уменьшаем доступный остаток
-        self.db.execute_query(
-            'UPDATE products SET stock = stock - ? WHERE id = ?',
-            (quantity, product_id)
-        )
+        with self.db.transaction():
+            current_stock = self.db.execute_query(
+                'SELECT stock FROM products WHERE id = ?',
+                (product_id,)
+            )[0][0]
+            
+            if current_stock < quantity:
+                return False, "Недостаточно товара на складе"
+            
+            # Создаем резерв
+            self.db.execute_query('''
+                INSERT INTO stock_reservations (
+                    product_id, order_id, quantity, expires_at, created_at
+                ) VALUES (?, ?, ?, ?, ?)
+            ''', (
+                product_id, order_id, quantity,
+                (datetime.now() + timedelta(hours=24)).strftime('%Y-%m-%d %H:%M:%S'),
+                datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            ))
+            
+            # Уменьшаем доступный остаток
+            self.db.execute_query(
+                'UPDATE products SET stock = stock - ? WHERE id = ?',
+                (quantity, product_id)
+            )
         
         return True, "Товар зарезервирован"
     
     def release_reservation(self, order_id):
         """Освобождение резерва при отмене заказа"""
-        reservations = self.db.execute_query(
-            'SELECT product_id, quantity FROM stock_reservations WHERE order_id = ?',
-            (order_id,)
-        )
-        
-        for reservation in reservations:
-            product_id, quantity = reservation
+        with self.db.transaction():
+            reservations = self.db.execute_query(
+                'SELECT product_id, quantity FROM stock_reservations WHERE order_id = ?',
+                (order_id,)
+            ) or []
             
             # Возвращаем товар на склад
-            self.db.execute_query(
+            self.db.execute_many(
                 'UPDATE products SET stock = stock + ? WHERE id = ?',
-                (quantity, product_id)
+                [(quantity, product_id) for product_id, quantity in reservations]
+            )
+            
+            # Удаляем резервы
+            self.db.execute_query(
+                'DELETE FROM stock_reservations WHERE order_id = ?',
+                (order_id,)
             )
-        
-        # Удаляем резервы
-        self.db.execute_query(
-            'DELETE FROM stock_reservations WHERE order_id = ?',
-            (order_id,)
-        )
     
     def trigger_automatic_reorder(self, product_id):
         """Автоматическое пополнение товара"""
@@ -340,7 +352,7 @@ class InventoryManager:
             FROM inventory_movements im
             JOIN products p ON im.product_id = p.id
             LEFT JOIN suppliers s ON im.supplier_id = s.id
-            WHERE DATE(im.created_at) >= ?
+            WHERE im.created_day >= ?
             ORDER BY im.created_at DESC
         ''', (start_date,))
         
@@ -351,7 +363,7 @@ class InventoryManager:
                 COUNT(*) as count,
                 SUM(ABS(quantity_change)) as total_quantity
             FROM inventory_movements
-            WHERE DATE(created_at) >= ?
+            WHERE created_day >= ?
             GROUP BY movement_type
         ''', (start_date,))
         
@@ -430,7 +442,7 @@ class InventoryManager:
             FROM products p
             LEFT JOIN order_items oi ON p.id = oi.product_id
             LEFT JOIN orders o ON oi.order_id = o.id AND o.status != 'cancelled'
-                AND DATE(o.created_at) >= ?
+                AND o.created_day >= ?
             WHERE p.is_active = 1
             GROUP BY p.id, p.name, p.stock, p.price
             ORDER BY turnover_ratio DESC
@@ -461,14 +473,14 @@ class InventoryManager:
         # Анализируем продажи за последние 90 дней
         sales_history = self.db.execute_query('''
             SELECT 
-                DATE(o.created_at) as sale_date,
+                o.created_day as sale_date,
                 SUM(oi.quantity) as daily_sales
             FROM order_items oi
             JOIN orders o ON oi.order_id = o.id
             WHERE oi.product_id = ?
             AND o.created_at >= datetime('now', '-90 days')
             AND o.status != 'cancelled'
-            GROUP BY DATE(o.created_at)
+            GROUP BY o.created_day
             ORDER BY sale_date
         ''', (product_id,))
         
@@ -622,7 +634,7 @@ class InventoryManager:
                     COUNT(CASE WHEN po.status = 'completed' THEN 1 END) * 100.0 / COUNT(po.id) as completion_rate
                 FROM suppliers s
                 LEFT JOIN purchase_orders po ON s.id = po.supplier_id
-                    AND DATE(po.created_at) >= ?
+                    AND po.created_day >= ?
                 WHERE s.id = ?
                 GROUP BY s.id, s.name
             ''', (start_date, supplier_id))
@@ -636,7 +648,7 @@ class InventoryManager:
                     COUNT(CASE WHEN po.status = 'completed' THEN 1 END) * 100.0 / COUNT(po.id) as completion_rate
                 FROM suppliers s
                 LEFT JOIN purchase_orders po ON s.id = po.supplier_id
-                    AND DATE(po.created_at) >= ?
+                    AND po.created_day >= ?
                 GROUP BY s.id, s.name
                 ORDER BY total_spent DESC
             ''', (start_date,))
@@ -686,23 +698,20 @@ class InventoryManager:
     
     def create_stocktaking_session(self, location="Основной склад"):
         """Создание сессии инвентаризации"""
-        session_id = self.db.execute_query('''
-            INSERT INTO stocktaking_sessions (
-                location, status, started_at, created_by
-            ) VALUES (?, 'active', ?, 1)
-        ''', (location, datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
-        
-        # Создаем записи для всех товаров
-        products = self.db.execute_query(
-            'SELECT id, stock FROM products WHERE is_active = 1'
-        )
-        
-        for product in products:
+        with self.db.transaction():
+            session_id = self.db.execute_query('''
+                INSERT INTO stocktaking_sessions (
+                    location, status, started_at, created_by
+                ) VALUES (?, 'active', ?, 1)
+            ''', (location, datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+            
+            # Создаем записи для всех товаров
             self.db.execute_query('''
                 INSERT INTO stocktaking_items (
                     session_id, product_id, system_quantity, counted_quantity
-                ) VALUES (?, ?, ?, NULL)
-            ''', (session_id, product[0], product[1]))
+                )
+                SELECT ?, id, stock, NULL FROM products WHERE is_active = 1
+            ''', (session_id,))
         
         return session_id
     
@@ -731,34 +740,34 @@ class InventoryManager:
             AND si.counted_quantity != si.system_quantity
         ''', (session_id,))
         
-        # Применяем корректировки
-        for discrepancy in discrepancies:
-            product_id, name, system_qty, counted_qty, difference = discrepancy
-            
-            # Обновляем остаток
-            self.db.execute_query(
+        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        
+        # Применяем корректировки и закрываем сессию одной транзакцией
+        with self.db.transaction():
+            # Обновляем остатки
+            self.db.execute_many(
                 'UPDATE products SET stock = ? WHERE id = ?',
-                (counted_qty, product_id)
+                [(counted_qty, product_id) for product_id, _, _, counted_qty, _ in discrepancies]
             )
             
-            # Записываем движение
-            self.db.execute_query('''
+            # Записываем движения
+            self.db.execute_many('''
                 INSERT INTO inventory_movements (
                     product_id, movement_type, quantity_change,
                     old_quantity, new_quantity, reason, created_at
                 ) VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                product_id, 'adjustment', difference,
-                system_qty, counted_qty, f'Инвентаризация #{session_id}',
-                datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            ))
-        
-        # Закрываем сессию
-        self.db.execute_query('''
-            UPDATE stocktaking_sessions 
-            SET status = 'completed', completed_at = ?
-            WHERE id = ?
-        ''', (datetime.now().strftime('%Y-%m-%d %H:%M:%S'), session_id))
+            ''', [
+                (product_id, 'adjustment', difference,
+                 system_qty, counted_qty, f'Инвентаризация #{session_id}', now)
+                for product_id, _, system_qty, counted_qty, difference in discrepancies
+            ])
+            
+            # Закрываем сессию
+            self.db.execute_query('''
+                UPDATE stocktaking_sessions 
+                SET status = 'completed', completed_at = ?
+                WHERE id = ?
+            ''', (now, session_id))
         
         return {
             'discrepancies_count': len(discrepancies),
@@ -899,16 +908,21 @@ Email: {order[8]}
         
         return "❌ Неизвестный тип отчета"
     
-    def export_inventory_csv(self, report_type):
-        """Экспорт данных склада в CSV"""
-        import csv
-        import io
-        
-        output = io.StringIO()
-        writer = csv.writer(output)
+    def export_inventory_csv(self, report_type, path=None, compress=False, progress=None):
+        """Экспорт данных склада в CSV.
         
+        Без path возвращает текст CSV. С path выгрузка пишется в файл по
+        частям (при compress - в gzip) и возвращается размер файла в байтах.
+        """
+        chunks = self.iter_inventory_csv(report_type, progress)
+        if path is None:
+            return ''.join(chunks)
+        return write_chunks(chunks, path, compress)
+    
+    def iter_inventory_csv(self, report_type, progress=None):
+        """CSV данных склада частями, строки читаются из базы блоками"""
         if report_type == 'stock_levels':
-            products = self.db.execute_query('''
+            products = self.db.stream_query('''
                 SELECT 
                     p.id, p.name, p.stock, p.price,
                     (p.stock * p.price) as inventory_value,
@@ -919,30 +933,26 @@ Email: {order[8]}
                 ORDER BY inventory_value DESC
             ''')
             
-            writer.writerow(['ID', 'Название', 'Остаток', 'Цена', 'Стоимость запасов', 'Категория'])
-            for product in products:
-                writer.writerow([
-                    product[0], product[1], product[2], f"${product[3]:.2f}",
-                    f"${product[4]:.2f}", product[5]
-                ])
+            header = ['ID', 'Название', 'Остаток', 'Цена', 'Стоимость запасов', 'Категория']
+            yield from stream_csv(header, products, lambda product: [
+                product[0], product[1], product[2], f"${product[3]:.2f}",
+                f"${product[4]:.2f}", product[5]
+            ], progress)
         
         elif report_type == 'movements':
-            movements = self.db.execute_query('''
+            movements = self.db.stream_query('''
                 SELECT 
                     im.created_at, p.name, im.movement_type,
                     im.quantity_change, im.reason, s.name
                 FROM inventory_movements im
                 JOIN products p ON im.product_id = p.id
                 LEFT JOIN suppliers s ON im.supplier_id = s.id
-                WHERE DATE(im.created_at) >= date('now', '-30 days')
+                WHERE im.created_day >= date('now', '-30 days')
                 ORDER BY im.created_at DESC
             ''')
             
-            writer.writerow(['Дата', 'Товар', 'Тип', 'Изменение', 'Причина', 'Поставщик'])
-            for movement in movements:
-                writer.writerow([
-                    movement[0], movement[1], movement[2],
-                    movement[3], movement[4], movement[5] or ''
-                ])
-        
-        return output.getvalue()
\ No newline at end of file
+            header = ['Дата', 'Товар', 'Тип', 'Изменение', 'Причина', 'Поставщик']
+            yield from stream_csv(header, movements, lambda movement: [
+                movement[0], movement[1], movement[2],
+                movement[3], movement[4], movement[5] or ''
+            ], progress)
\ No newline at end of file
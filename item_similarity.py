@@ -0,0 +1,244 @@
+"""
+Похожие товары по совместным покупкам ("покупатели также покупали")
+"""
+
+import heapq
+import math
+import threading
+from config import RECOMMENDATION_CONFIG
+from logger import logger
+
+# Покупателей за одну транзакцию обновления
+USER_BATCH = 500
+
+# Текущие товары покупателя по его неотмененным заказам
+USER_PRODUCTS = '''
+    SELECT DISTINCT oi.product_id
+    FROM orders o
+    JOIN order_items oi ON oi.order_id = o.id
+    WHERE o.user_id = ? AND o.status != 'cancelled'
+'''
+
+def cosine(users, buyers, other_buyers):
+    return users / math.sqrt(buyers * other_buyers)
+
+def jaccard(users, buyers, other_buyers):
+    return users / (buyers + other_buyers - users)
+
+SIMILARITY = {
+    'cosine': cosine,
+    'jaccard': jaccard
+}
+
+class ItemSimilarity:
+    """Разреженная матрица совместных покупок и top-K соседей товара.
+    
+    product_pairs хранит число общих покупателей пары, product_buyers -
+    покупателей товара; из них по косинусу или коэффициенту Жаккара
+    в product_similarity сохраняются ближайшие соседи. refresh() по
+    покупателям из item_similarity_dirty применяет разницу между прежним
+    и текущим набором их товаров и пересчитывает соседей затронутых
+    товаров, а также всех партнеров товаров, у которых изменилось число
+    покупателей: их оценки с таким товаром зависят от этого числа.
+    """
+    
+    def __init__(self, db, config=None):
+        self.db = db
+        self.config = config or RECOMMENDATION_CONFIG
+        self.similarity = SIMILARITY[self.config.get('similarity', 'cosine')]
+        self._lock = threading.Lock()
+    
+    def handle_order_event(self, event_type, payload):
+        """Обработчик событий заказов: обновление по отмеченным покупателям"""
+        self.refresh()
+    
+    def refresh(self):
+        """Обновление по отмеченным покупателям; возвращает их число"""
+        if not self.db.execute_query('SELECT 1 FROM item_similarity_dirty LIMIT 1'):
+            return 0
+        
+        processed = 0
+        with self._lock:
+            try:
+                while True:
+                    with self.db.transaction():
+                        users = [row[0] for row in self.db.execute_query(
+                            'SELECT user_id FROM item_similarity_dirty LIMIT ?', (USER_BATCH,)
+                        ) or []]
+                        if not users:
+                            break
+                        
+                        affected = set()
+                        for user_id in users:
+                            affected |= self._update_user(user_id)
+                        self._rebuild_neighbours(affected)
+                        
+                        self.db.execute_many(
+                            'DELETE FROM item_similarity_dirty WHERE user_id = ?',
+                            [(user_id,) for user_id in users]
+                        )
+                    processed += len(users)
+            except Exception as e:
+                logger.error(f"Ошибка обновления похожих товаров: {e}")
+        
+        if processed:
+            logger.info(f"Похожие товары обновлены по {processed} покупателям")
+        return processed
+    
+    def _update_user(self, user_id):
+        """Разница наборов товаров покупателя; возвращает затронутые товары"""
+        current = {row[0] for row in self.db.execute_query(USER_PRODUCTS, (user_id,)) or []}
+        stored = {row[0] for row in self.db.execute_query(
+            'SELECT product_id FROM user_products WHERE user_id = ?', (user_id,)
+        ) or []}
+        added = current - stored
+        removed = stored - current
+        if not added and not removed:
+            return set()
+        
+        # Пары с новым товаром прибавляют покупателя, с убранным - вычитают
+        deltas = []
+        for products, changed, delta in ((current, added, 1), (stored, removed, -1)):
+            for product_id in changed:
+                for other_id in products:
+                    if other_id != product_id and (other_id not in changed or product_id < other_id):
+                        deltas.append((product_id, other_id, delta))
+                        deltas.append((other_id, product_id, delta))
+        
+        self.db.execute_many('''
+            INSERT INTO product_pairs (product_id, other_id, users) VALUES (?, ?, ?)
+            ON CONFLICT (product_id, other_id) DO UPDATE SET users = users + excluded.users
+        ''', deltas)
+        self.db.execute_many(
+            'DELETE FROM product_pairs WHERE product_id = ? AND other_id = ? AND users <= 0',
+            [(product_id, other_id) for product_id, other_id, delta in deltas if delta < 0]
+        )
+        
+        self.db.execute_many('''
+            INSERT INTO product_buyers (product_id, buyers) VALUES (?, ?)
+            ON CONFLICT (product_id) DO UPDATE SET buyers = buyers + excluded.buyers
+        ''', [(product_id, 1) for product_id in added] + [(product_id, -1) for product_id in removed])
+        self.db.execute_many(
+            'DELETE FROM product_buyers WHERE product_id = ? AND buyers <= 0',
+            [(product_id,) for product_id in removed]
+        )
+        
+        self.db.execute_many(
+            'INSERT INTO user_products (user_id, product_id) VALUES (?, ?)',
+            [(user_id, product_id) for product_id in added]
+        )
+        self.db.execute_many(
+            'DELETE FROM user_products WHERE user_id = ? AND product_id = ?',
+            [(user_id, product_id) for product_id in removed]
+        )
+        
+        # Число покупателей изменилось у added и removed - пересчитываются и их партнеры
+        changed = list(added | removed)
+        placeholders = ','.join('?' * len(changed))
+        partners = {row[0] for row in self.db.execute_query(
+            f'SELECT DISTINCT other_id FROM product_pairs WHERE product_id IN ({placeholders})', changed
+        ) or []}
+        
+        return current | stored | partners
+    
+    def _rebuild_neighbours(self, product_ids):
+        """Top-K соседей товаров по текущим счетчикам; вызывается в транзакции"""
+        limit = self.config.get('neighbours', 20)
+        min_users = self.config.get('min_co_purchases', 1)
+        
+        for product_id in product_ids:
+            self.db.execute_query('DELETE FROM product_similarity WHERE product_id = ?', (product_id,))
+            
+            buyers = self.db.execute_query(
+                'SELECT buyers FROM product_buyers WHERE product_id = ?', (product_id,)
+            )
+            if not buyers:
+                continue
+            
+            pairs = self.db.execute_query('''
+                SELECT pp.other_id, pp.users, pb.buyers
+                FROM product_pairs pp
+                JOIN product_buyers pb ON pb.product_id = pp.other_id
+                WHERE pp.product_id = ? AND pp.users >= ?
+            ''', (product_id, min_users)) or []
+            
+            neighbours = heapq.nlargest(limit, (
+                (self.similarity(users, buyers[0][0], other_buyers), users, other_id)
+                for other_id, users, other_buyers in pairs
+            ))
+            self.db.execute_many('''
+                INSERT INTO product_similarity (product_id, similar_id, score, co_purchases)
+                VALUES (?, ?, ?, ?)
+            ''', [(product_id, other_id, score, users) for score, users, other_id in neighbours])
+    
+    def rebuild(self):
+        """Полное построение модели по всем заказам; возвращает число товаров"""
+        with self._lock:
+            with self.db.transaction():
+                for table in ('item_similarity_dirty', 'user_products', 'product_buyers',
+                              'product_pairs', 'product_similarity'):
+                    self.db.execute_query(f'DELETE FROM {table}')
+                
+                self.db.execute_query('''
+                    INSERT INTO user_products (user_id, product_id)
+                    SELECT DISTINCT o.user_id, oi.product_id
+                    FROM orders o
+                    JOIN order_items oi ON oi.order_id = o.id
+                    WHERE o.status != 'cancelled' AND o.user_id IS NOT NULL AND oi.product_id IS NOT NULL
+                ''')
+                self.db.execute_query('''
+                    INSERT INTO product_buyers (product_id, buyers)
+                    SELECT product_id, COUNT(*) FROM user_products GROUP BY product_id
+                ''')
+                self.db.execute_query('''
+                    INSERT INTO product_pairs (product_id, other_id, users)
+                    SELECT a.product_id, b.product_id, COUNT(*)
+                    FROM user_products a
+                    JOIN user_products b ON b.user_id = a.user_id AND b.product_id != a.product_id
+                    GROUP BY a.product_id, b.product_id
+                ''')
+                
+                products = [row[0] for row in self.db.execute_query('SELECT product_id FROM product_buyers') or []]
+                self._rebuild_neighbours(products)
+        
+        logger.info(f"Модель похожих товаров построена: {len(products)} товаров")
+        return len(products)
+    
+    def ensure_built(self):
+        """Первое построение, если заказы есть, а модели еще нет"""
+        if self.db.execute_query('SELECT 1 FROM product_buyers LIMIT 1'):
+            return self.refresh()
+        if not self.db.execute_query('SELECT 1 FROM order_items LIMIT 1'):
+            return 0
+        return self.rebuild()
+    
+    def similar_products(self, product_id, limit=5):
+        """Товары, которые покупали вместе с данным: чтение top-K соседей"""
+        return self.db.execute_query('''
+            SELECT p.*, c.name as category_name, ps.score as similarity_score
+            FROM product_similarity ps
+            JOIN products p ON p.id = ps.similar_id
+            JOIN categories c ON p.category_id = c.id
+            WHERE ps.product_id = ? AND p.is_active = 1
+            ORDER BY ps.score DESC
+            LIMIT ?
+        ''', (product_id, limit))
+    
+    def recommend_for_user(self, user_id, limit=5):
+        """Соседи купленных товаров, еще не купленные пользователем"""
+        return self.db.execute_query('''
+            SELECT p.*, c.name as category_name, n.score as recommendation_score
+            FROM (
+                SELECT ps.similar_id, SUM(ps.score) as score
+                FROM user_products up
+                JOIN product_similarity ps ON ps.product_id = up.product_id
+                WHERE up.user_id = ?
+                AND ps.similar_id NOT IN (SELECT product_id FROM user_products WHERE user_id = ?)
+                GROUP BY ps.similar_id
+            ) n
+            JOIN products p ON p.id = n.similar_id
+            JOIN categories c ON p.category_id = c.id
+            WHERE p.is_active = 1
+            ORDER BY n.score DESC, p.views DESC
+            LIMIT ?
+        ''', (user_id, user_id, limit))
@@ -2,27 +2,34 @@
 Главный файл запуска телеграм-бота интернет-магазина
 """
 
-import json
-import urllib.request
-import urllib.parse
 import os
 import time
 import signal
 import sys
 import threading
+from datetime import datetime, timedelta
 from database import DatabaseManager
+from index_advisor import log_query_plan_warnings
+from csv_export import send_csv_document, log_progress
 from handlers import MessageHandler
 from notifications import NotificationManager
-from utils import format_date
+from utils import format_date, escape_html
 from payments import PaymentProcessor
 from logistics import LogisticsManager
 from promotions import PromotionManager
 from crm import CRMManager
+from customer_segments import CustomerSegmentation
+from churn_scores import ChurnScoring
+from periodic_refresh import start_refresh_worker
 from logger import logger
 from health_check import HealthMonitor
 from database_backup import DatabaseBackup
 from scheduled_posts import ScheduledPostsManager
-from config import BOT_CONFIG
+from update_pipeline import UpdateDispatcher, WebhookReceiver
+from router import RouteTable
+from metrics import registry, track_job, start_metrics_server
+from telegram_api import get_api_client
+from config import BOT_CONFIG, MONITORING_CONFIG
 
 # Импорты с обработкой ошибок
 try:
@@ -75,19 +82,26 @@ except ImportError:
     MarketingAutomationManager = None
     print("⚠️ MarketingAutomationManager не найден, автоматизация недоступна")
 
+UPDATES = registry.counter('bot_updates_total', 'Полученные обновления по типу', ['type'])
+UPDATE_DURATION = registry.histogram(
+    'bot_update_duration_seconds',
+    'Полное время обработки обновления по типу',
+    ['type']
+)
+
 class TelegramShopBot:
     def __init__(self, token):
         self.token = token
         self.base_url = f"https://api.telegram.org/bot{token}"
+        self.api = get_api_client(token)
         self.offset = 0
         self.running = True
         self.error_count = 0
         self.max_errors = 10
-        self.data_cache = {}
-        self.last_data_reload = time.time()
         
         # Инициализация компонентов
         self.db = DatabaseManager()
+        log_query_plan_warnings(self.db)
         self.setup_admin_from_env()
         self.backup_manager = DatabaseBackup(self.db.db_path)
         self.message_handler = MessageHandler(self, self.db)
@@ -97,6 +111,14 @@ class TelegramShopBot:
         # Система мониторинга
         self.health_monitor = HealthMonitor(self.db, self)
         
+        # Пул обработчиков обновлений (порядок сохраняется в пределах чата)
+        self.update_dispatcher = UpdateDispatcher(
+            self.process_update,
+            workers=BOT_CONFIG['update_workers'],
+            queue_size=BOT_CONFIG['update_queue_size']
+        )
+        self.webhook_receiver = None
+        
         # Инициализация админ-панели
         if AdminHandler:
             self.admin_handler = AdminHandler(self, self.db)
@@ -148,6 +170,8 @@ class TelegramShopBot:
         # Инициализируем AI функции
         if AIRecommendationEngine:
             self.ai_recommendations = AIRecommendationEngine(self.db)
+            self.ai_recommendations.start_similarity_updates()
+            self.ai_recommendations.start_recommendation_store()
         else:
             self.ai_recommendations = None
             
@@ -180,11 +204,20 @@ class TelegramShopBot:
         
         # Запускаем автоматические проверки склада ПОСЛЕ инициализации всех компонентов
         self.schedule_inventory_checks()
+        self.schedule_customer_segmentation()
+        self.schedule_churn_scoring()
         
         # Инициализируем автоматизацию маркетинга только если модуль доступен
         if self.marketing_automation:
             self.setup_default_automation_rules()
         
+        # Таблица маршрутов обновлений
+        self.routes = RouteTable()
+        self.register_routes()
+        
+        # Метрики Prometheus
+        self.register_metrics()
+        
         # Настройка обработчиков сигналов
         signal.signal(signal.SIGINT, self.signal_handler)
         signal.signal(signal.SIGTERM, self.signal_handler)
@@ -210,12 +243,13 @@ class TelegramShopBot:
         logger.info("Мониторинг синхронизации данных запущен")
     
     def check_for_data_updates(self):
-        """Проверка обновлений данных"""
-        # Проверяем обычный флаг обновления
-        update_flag_file = 'data_update_flag.txt'
+        """Проверка флага принудительной перезагрузки.
+        
+        Изменения каталога отслеживает кэш каталога по версии в базе,
+        файл нужен только для перезагрузки автопостов и автоматизации.
+        """
         force_reload_flag = 'force_reload_flag.txt'
         
-        # Проверяем принудительную перезагрузку
         if os.path.exists(force_reload_flag):
             try:
                 logger.info("🔄 ПРИНУДИТЕЛЬНАЯ ПЕРЕЗАГРУЗКА данных...")
@@ -228,33 +262,6 @@ class TelegramShopBot:
                     os.remove(force_reload_flag)
                 except Exception:
                     pass
-        
-        # Проверяем обычное обновление
-        elif os.path.exists(update_flag_file):
-            try:
-                # Читаем время последнего обновления
-                with open(update_flag_file, 'r') as f:
-                    update_time_str = f.read().strip()
-                
-                update_time = float(update_time_str)
-                
-                # Если обновление новее нашего последнего обновления
-                if update_time > self.last_data_reload:
-                    logger.info("🔄 Обнаружено обновление данных, перезагружаем...")
-                    self.reload_data_cache()
-                    self.last_data_reload = update_time
-                    
-                    # Удаляем флаг
-                    os.remove(update_flag_file)
-                    logger.info("✅ Данные обновлены в боте")
-                    
-            except Exception as e:
-                logger.error(f"Ошибка обработки флага обновления: {e}")
-                # Удаляем поврежденный флаг
-                try:
-                    os.remove(update_flag_file)
-                except Exception:
-                    pass
     
     def full_data_reload(self):
         """Полная перезагрузка всех данных и компонентов"""
@@ -281,16 +288,8 @@ class TelegramShopBot:
     def reload_data_cache(self):
         """Перезагрузка кэша данных"""
         try:
-            # Очищаем кэш
-            self.data_cache.clear()
-            
-            # Перезагружаем категории
-            self.data_cache['categories'] = self.db.get_categories()
-            
-            # Перезагружаем товары
-            self.data_cache['products'] = self.db.execute_query(
-                'SELECT * FROM products WHERE is_active = 1 ORDER BY name'
-            )
+            # Каталог перечитывается при следующем обращении
+            self.db.catalog.invalidate()
             
             # Перезагружаем автопосты если есть модуль
             if hasattr(self, 'scheduled_posts') and self.scheduled_posts:
@@ -324,13 +323,8 @@ class TelegramShopBot:
     
     def trigger_data_update(self):
         """Принудительное обновление данных"""
-        update_flag_file = 'data_update_flag.txt'
-        try:
-            with open(update_flag_file, 'w') as f:
-                f.write(str(time.time()))
-            logger.info("Флаг обновления данных установлен")
-        except Exception as e:
-            logger.error(f"Ошибка установки флага обновления: {e}")
+        self.db.bump_catalog_version()
+        logger.info("Версия каталога увеличена")
     
     def setup_admin_from_env(self):
         """Настройка админа из переменных окружения"""
@@ -352,10 +346,7 @@ class TelegramShopBot:
                 if existing_admin:
                     # Обновляем права админа если нужно
                     if existing_admin[0][1] != 1:
-                        self.db.execute_query(
-                            'UPDATE users SET is_admin = 1 WHERE telegram_id = ?',
-                            (admin_telegram_id,)
-                        )
+                        self.db.set_user_admin(admin_telegram_id)
                         logger.info(f"✅ Права админа обновлены для {admin_name}")
                     else:
                         logger.info(f"✅ Админ уже существует: {admin_name}")
@@ -376,6 +367,9 @@ class TelegramShopBot:
         """Обработчик сигналов для graceful shutdown"""
         logger.info(f"Получен сигнал {signum}, завершение работы...")
         self.running = False
+        self.update_dispatcher.stop()
+        self.notification_manager.outbox.stop()
+        self.db.close()
         sys.exit(0)
     
     def schedule_inventory_checks(self):
@@ -391,8 +385,9 @@ class TelegramShopBot:
                 try:
                     # Проверяем каждые 6 часов
                     if hasattr(self, 'inventory_manager') and self.inventory_manager:
-                        self.inventory_manager.check_reorder_alerts()
-                        self.inventory_manager.process_automatic_reorders()
+                        with track_job('inventory_checks'):
+                            self.inventory_manager.check_reorder_alerts()
+                            self.inventory_manager.process_automatic_reorders()
                     time.sleep(21600)  # 6 часов
                 except Exception as e:
                     print(f"Ошибка проверки склада: {e}")
@@ -401,6 +396,14 @@ class TelegramShopBot:
         inventory_thread = threading.Thread(target=inventory_worker, daemon=True)
         inventory_thread.start()
     
+    def schedule_customer_segmentation(self):
+        """Фоновый пересчет RFM-сегментов клиентов"""
+        start_refresh_worker(CustomerSegmentation(self.db), lambda: self.running, 'сегментов клиентов')
+    
+    def schedule_churn_scoring(self):
+        """Фоновый пересчет риска ухода клиентов"""
+        start_refresh_worker(ChurnScoring(self.db), lambda: self.running, 'риска ухода клиентов')
+    
     def setup_default_automation_rules(self):
         """Настройка базовых правил автоматизации"""
         try:
@@ -437,7 +440,6 @@ class TelegramShopBot:
     
     def send_message(self, chat_id, text, reply_markup=None):
         """Отправка сообщения"""
-        url = f"{self.base_url}/sendMessage"
         data = {
             'chat_id': chat_id,
             'text': text,
@@ -445,23 +447,20 @@ class TelegramShopBot:
         }
         
         if reply_markup:
-            data['reply_markup'] = json.dumps(reply_markup)
+            data['reply_markup'] = reply_markup
         
         try:
-            data_encoded = urllib.parse.urlencode(data).encode('utf-8')
-            req = urllib.request.Request(url, data=data_encoded, method='POST')
-            with urllib.request.urlopen(req) as response:
-                result = json.loads(response.read().decode('utf-8'))
-                if not result.get('ok'):
-                    print(f"Ошибка отправки сообщения: {result}")
-                return result
+            # После 429 сообщение откладывается, поток обработчика не ждет
+            result = self.api.call('sendMessage', data, requeue=True)
+            if not result.get('ok'):
+                print(f"Ошибка отправки сообщения: {result}")
+            return result
         except Exception as e:
             print(f"Ошибка отправки сообщения: {e}")
             return None
     
     def send_photo(self, chat_id, photo_url, caption="", reply_markup=None):
         """Отправка фото"""
-        url = f"{self.base_url}/sendPhoto"
         data = {
             'chat_id': chat_id,
             'photo': photo_url,
@@ -470,115 +469,183 @@ class TelegramShopBot:
         }
         
         if reply_markup:
-            data['reply_markup'] = json.dumps(reply_markup)
+            data['reply_markup'] = reply_markup
         
         try:
-            data_encoded = urllib.parse.urlencode(data).encode('utf-8')
-            req = urllib.request.Request(url, data=data_encoded, method='POST')
-            with urllib.request.urlopen(req) as response:
-                result = json.loads(response.read().decode('utf-8'))
-                if not result.get('ok'):
-                    print(f"Ошибка отправки фото: {result}")
-                return result
+            result = self.api.call('sendPhoto', data, requeue=True)
+            if not result.get('ok'):
+                print(f"Ошибка отправки фото: {result}")
+            return result
         except Exception as e:
             print(f"Ошибка отправки фото: {e}")
             return None
     
+    def send_csv_export(self, chat_id, chunks, filename, compress=True, caption=None):
+        """Отправка CSV выгрузки документом; chunks - части текста CSV"""
+        try:
+            with track_job('csv_export'):
+                result = send_csv_document(self.api, chat_id, chunks, filename, compress, caption)
+            if not result.get('ok'):
+                print(f"Ошибка отправки выгрузки: {result}")
+            return result
+        except Exception as e:
+            print(f"Ошибка отправки выгрузки: {e}")
+            return None
+    
     def get_updates(self):
         """Получение обновлений"""
-        url = f"{self.base_url}/getUpdates"
-        params = {'offset': self.offset, 'timeout': 30}
+        poll_timeout = 30
+        params = {'offset': self.offset, 'timeout': poll_timeout}
         
         try:
-            url_with_params = f"{url}?{urllib.parse.urlencode(params)}"
-            with urllib.request.urlopen(url_with_params) as response:
-                data = json.loads(response.read().decode('utf-8'))
-                return data
+            # HTTP таймаут должен быть больше времени long polling
+            return self.api.call(
+                'getUpdates', params,
+                timeout=poll_timeout + BOT_CONFIG['request_timeout']
+            )
         except Exception as e:
             print(f"Ошибка получения обновлений: {e}")
             return None
     
+    def register_routes(self):
+        """Таблица маршрутов: админка, общие команды бота и маршруты модулей"""
+        self.admin_message_routes = self.routes.router('admin_messages')
+        self.admin_state_routes = self.routes.router('admin_states')
+        self.admin_callback_routes = self.routes.router('admin_callbacks')
+        self.bot_message_routes = self.routes.router('messages')
+        
+        if self.admin_handler:
+            admin = self.admin_handler
+            self.admin_message_routes.add_prefix('/admin', admin.handle_admin_command)
+            self.admin_message_routes.add([
+                '📊 Статистика', '📦 Заказы', '🛠 Товары', '👥 Пользователи', '🔙 Пользовательский режим',
+                '📈 Аналитика', '🛡 Безопасность', '💰 Финансы', '📦 Склад', '🤖 AI',
+                '🎯 Автоматизация', '👥 CRM', '📢 Рассылка'
+            ], admin.handle_admin_command)
+            self.admin_message_routes.add_prefix('/admin_order_', admin.handle_order_management)
+            self.admin_message_routes.add_prefix(['/edit_product_', '/delete_product_'], admin.handle_product_commands)
+            
+            self.admin_state_routes.add_prefix('adding_product_', admin.handle_add_product_process)
+            self.admin_state_routes.add_prefix('creating_broadcast_', admin.handle_broadcast_creation)
+            
+            self.admin_callback_routes.add_prefix(['admin_', 'change_status_', 'order_details_'], admin.handle_callback_query)
+            self.admin_callback_routes.add_prefix(['analytics_', 'period_'], admin.handle_analytics_callback)
+            self.admin_callback_routes.add_prefix('export_', admin.handle_export_callback)
+            self.admin_callback_routes.add_prefix(
+                ['security_', 'unblock_user_'],
+                getattr(admin, 'handle_security_callback', admin.handle_callback_query)
+            )
+            self.admin_callback_routes.add_prefix(
+                'broadcast_',
+                getattr(admin, 'handle_broadcast_callback', admin.handle_callback_query)
+            )
+        
+        self.bot_message_routes.add('/notifications', self.show_user_notifications)
+        self.bot_message_routes.add('/slow_queries', self.show_query_report)
+        self.bot_message_routes.add('/rebuild_rollups', self.rebuild_sales_rollup)
+        self.bot_message_routes.add_prefix('/export', self.handle_export_command)
+        
+        # Пользовательские маршруты обработчика сообщений
+        for router in (self.message_handler.command_routes, self.message_handler.button_routes,
+                       self.message_handler.state_routes, self.message_handler.callback_routes):
+            self.routes.attach(router)
+        
+        # Модули могут добавить собственные маршруты
+        for module in (self.admin_handler, self.crm_manager, self.ai_recommendations,
+                       self.chatbot_support, self.smart_notifications, self.marketing_automation):
+            if module is not None and hasattr(module, 'register_routes'):
+                module.register_routes(self.routes)
+    
+    def register_metrics(self):
+        """Метрики очередей и запуск сервера /metrics"""
+        registry.gauge(
+            'bot_update_queue_depth', 'Обновления в очереди обработчика', ['worker']
+        ).set_function(lambda: {
+            (index,): size for index, size in enumerate(self.update_dispatcher.get_queue_sizes())
+        })
+        registry.gauge(
+            'bot_notification_outbox_depth', 'Push-уведомления в очереди', ['state']
+        ).set_function(lambda: {
+            (state,): size for state, size in self.notification_manager.outbox.get_stats().items()
+        })
+        registry.gauge(
+            'bot_db_pool_in_use', 'Занятые соединения пулов базы', ['pool']
+        ).set_function(lambda: {
+            ('writer',): self.db.pool.get_stats()['in_use'],
+            ('readers',): self.db.read_pool.get_stats()['in_use']
+        })
+        
+        if MONITORING_CONFIG['metrics_enabled']:
+            start_metrics_server(MONITORING_CONFIG['prometheus_port'])
+    
+    def get_admin_state(self, telegram_id):
+        """Текущее состояние админа или None"""
+        if self.admin_handler and hasattr(self.admin_handler, 'admin_states'):
+            return self.admin_handler.admin_states.get(telegram_id)
+        return None
+    
+    def process_update(self, update):
+        """Обработка одного обновления (выполняется в пуле обработчиков)"""
+        update_type = 'message' if 'message' in update else 'callback_query' if 'callback_query' in update else 'other'
+        UPDATES.inc(type=update_type)
+        started = time.perf_counter()
+        try:
+            self.health_monitor.increment_messages()
+            
+            if update_type == 'message':
+                self.route_message(update['message'])
+            elif update_type == 'callback_query':
+                self.route_callback_query(update['callback_query'])
+        except Exception as e:
+            logger.error(f"Ошибка обработки обновления: {e}", exc_info=True)
+            self.health_monitor.increment_errors(str(e))
+        finally:
+            UPDATE_DURATION.observe(time.perf_counter() - started, type=update_type)
+    
+    def route_message(self, message):
+        """Маршрутизация сообщения: админка, состояние админа, общие команды, пользователь"""
+        text = message.get('text', '')
+        telegram_id = message['from']['id']
+        
+        # Логируем сообщение
+        logger.info(f"Сообщение от {telegram_id}: {text[:50]}...")
+        
+        route = self.admin_message_routes.resolve(text)
+        if route is None:
+            admin_state = self.get_admin_state(telegram_id)
+            if admin_state:
+                route = self.admin_state_routes.resolve(admin_state)
+                if route:
+                    route(message)
+                return
+            route = self.bot_message_routes.resolve(text)
+        
+        if route:
+            route(message)
+        else:
+            self.message_handler.handle_message(message)
+    
+    def route_callback_query(self, callback_query):
+        """Маршрутизация callback-запроса: сначала админка, затем пользователь"""
+        route = self.admin_callback_routes.resolve(callback_query.get('data'))
+        if route:
+            route(callback_query)
+        else:
+            self.message_handler.handle_callback_query(callback_query)
+    
     def run(self):
         """Запуск бота"""
         logger.info("🛍 Телеграм-бот интернет-магазина запущен!")
         logger.info("📱 Ожидание сообщений...")
         logger.info("Нажмите Ctrl+C для остановки")
         
+        self.update_dispatcher.start()
+        
         try:
-            while self.running:
-                updates = self.get_updates()
-                
-                if updates and updates.get('ok'):
-                    self.error_count = 0  # Сбрасываем счетчик ошибок при успехе
-                    
-                    for update in updates['result']:
-                        self.offset = update['update_id'] + 1
-                        
-                        try:
-                            self.health_monitor.increment_messages()
-                            
-                            if 'message' in update:
-                                message = update['message']
-                                text = message.get('text', '')
-                                telegram_id = message['from']['id']
-                                
-                                # Логируем сообщение
-                                logger.info(f"Сообщение от {telegram_id}: {text[:50]}...")
-                                
-                                # Проверяем админ команды
-                                if self.admin_handler and (text.startswith('/admin') or text in ['📊 Статистика', '📦 Заказы', '🛠 Товары', '👥 Пользователи', '🔙 Пользовательский режим']):
-                                    self.admin_handler.handle_admin_command(message)
-                                elif self.admin_handler and text in ['📈 Аналитика', '🛡 Безопасность', '💰 Финансы', '📦 Склад', '🤖 AI', '🎯 Автоматизация', '👥 CRM', '📢 Рассылка']:
-                                    self.admin_handler.handle_admin_command(message)
-                                elif self.admin_handler and text.startswith('/admin_order_'):
-                                    self.admin_handler.handle_order_management(message)
-                                elif self.admin_handler and (text.startswith('/edit_product_') or text.startswith('/delete_product_')):
-                                    self.admin_handler.handle_product_commands(message)
-                                elif self.admin_handler and hasattr(self.admin_handler, 'admin_states') and self.admin_handler.admin_states.get(telegram_id):
-                                    state = self.admin_handler.admin_states.get(telegram_id, '')
-                                    if state.startswith('adding_product_'):
-                                        self.admin_handler.handle_add_product_process(message)
-                                    elif state.startswith('creating_broadcast_'):
-                                        self.admin_handler.handle_broadcast_creation(message)
-                                elif text == '/notifications':
-                                    self.show_user_notifications(message)
-                                else:
-                                    self.message_handler.handle_message(message)
-                            elif 'callback_query' in update:
-                                callback_query = update['callback_query']
-                                data = callback_query['data']
-                                telegram_id = callback_query['from']['id']
-                                
-                                # Проверяем админ callback'и
-                                if self.admin_handler and (data.startswith('admin_') or data.startswith('change_status_') or data.startswith('order_details_')):
-                                    self.admin_handler.handle_callback_query(callback_query)
-                                elif self.admin_handler and (data.startswith('analytics_') or data.startswith('period_')):
-                                    self.admin_handler.handle_analytics_callback(callback_query)
-                                elif self.admin_handler and data.startswith('export_'):
-                                    self.admin_handler.handle_export_callback(callback_query)
-                                elif self.admin_handler and (data.startswith('security_') or data.startswith('unblock_user_')):
-                                    if hasattr(self.admin_handler, 'handle_security_callback'):
-                                        self.admin_handler.handle_security_callback(callback_query)
-                                    else:
-                                        self.admin_handler.handle_callback_query(callback_query)
-                                elif self.admin_handler and data.startswith('broadcast_'):
-                                    if hasattr(self.admin_handler, 'handle_broadcast_callback'):
-                                        self.admin_handler.handle_broadcast_callback(callback_query)
-                                    else:
-                                        self.admin_handler.handle_callback_query(callback_query)
-                                else:
-                                    self.message_handler.handle_callback_query(callback_query)
-                        except Exception as e:
-                            logger.error(f"Ошибка обработки обновления: {e}", exc_info=True)
-                            self.health_monitor.increment_errors(str(e))
-                else:
-                    self.error_count += 1
-                    if self.error_count >= self.max_errors:
-                        logger.critical("Превышено максимальное количество ошибок, перезапуск...")
-                        time.sleep(60)
-                        self.error_count = 0
-                
-                time.sleep(1)
+            if BOT_CONFIG['update_mode'] == 'webhook':
+                self.run_webhook()
+            else:
+                self.run_polling()
                 
         except KeyboardInterrupt:
             logger.info("🛑 Бот остановлен пользователем")
@@ -587,6 +654,156 @@ class TelegramShopBot:
         finally:
             logger.info("🔄 Закрытие соединений...")
             self.running = False
+            if self.webhook_receiver:
+                self.webhook_receiver.stop()
+            self.update_dispatcher.stop()
+            self.notification_manager.outbox.stop()
+            self.api.close()
+            self.db.close()
+    
+    def run_polling(self):
+        """Получение обновлений через long polling"""
+        # getUpdates не работает, пока у бота установлен webhook
+        self.delete_webhook()
+        
+        # Поллер только забирает обновления и раздает их обработчикам;
+        # следующий long-poll запрос уходит сразу, без паузы
+        while self.running:
+            updates = self.get_updates()
+            
+            if updates and updates.get('ok'):
+                self.error_count = 0  # Сбрасываем счетчик ошибок при успехе
+                
+                for update in updates['result']:
+                    self.offset = update['update_id'] + 1
+                    self.update_dispatcher.submit(update)
+            else:
+                self.error_count += 1
+                if self.error_count >= self.max_errors:
+                    logger.critical("Превышено максимальное количество ошибок, перезапуск...")
+                    time.sleep(60)
+                    self.error_count = 0
+                else:
+                    time.sleep(1)
+    
+    def delete_webhook(self):
+        """Снятие webhook с повторами: сеть при запуске может быть еще недоступна"""
+        delay = 1
+        while self.running:
+            try:
+                result = self.api.call('deleteWebhook')
+                if result.get('ok'):
+                    return True
+                logger.error(f"Не удалось снять webhook: {result}")
+            except Exception as e:
+                logger.error(f"Ошибка снятия webhook: {e}")
+            
+            time.sleep(delay)
+            delay = min(delay * 2, 60)
+        return False
+    
+    def run_webhook(self):
+        """Получение обновлений через webhook"""
+        webhook_url = BOT_CONFIG['webhook_url']
+        if not webhook_url:
+            raise ValueError('Для режима webhook нужен WEBHOOK_URL')
+        
+        self.webhook_receiver = WebhookReceiver(
+            self.update_dispatcher,
+            webhook_url,
+            secret=BOT_CONFIG['webhook_secret'],
+            host=BOT_CONFIG['webhook_host'],
+            port=BOT_CONFIG['webhook_port'],
+            certfile=BOT_CONFIG['webhook_cert'],
+            keyfile=BOT_CONFIG['webhook_key']
+        )
+        self.webhook_receiver.start()
+        
+        # Секрет обязателен: без него любой, кто знает адрес, подделает обновление
+        params = {'url': webhook_url, 'secret_token': self.webhook_receiver.secret}
+        result = self.api.call('setWebhook', params)
+        if not result.get('ok'):
+            raise RuntimeError(f"Не удалось установить webhook: {result}")
+        logger.info(f"Webhook установлен: {webhook_url}")
+        
+        while self.running:
+            time.sleep(1)
+    
+    def show_query_report(self, message):
+        """Отчет по самым тяжелым SQL запросам (только для админов)"""
+        chat_id = message['chat']['id']
+        user_data = self.db.get_user_by_telegram_id(message['from']['id'])
+        if not user_data or user_data[0][6] != 1:
+            self.message_handler.handle_message(message)
+            return
+        
+        report = self.db.get_query_report(limit=10)
+        if not report:
+            self.send_message(chat_id, "📊 Статистика запросов пока пуста")
+            return
+        
+        report_text = "🐢 <b>Самые тяжелые запросы</b>\n\n"
+        for item in report:
+            report_text += f"<code>{item['query_id']}</code> × {item['count']}, всего {item['total_ms']:.0f} мс\n"
+            report_text += f"p50 {item['p50_ms']:.1f} / p95 {item['p95_ms']:.1f} / max {item['max_ms']:.1f} мс, строк ~{item['avg_rows']}\n"
+            report_text += f"<code>{escape_html(item['statement'][:200])}</code>\n\n"
+        
+        self.send_message(chat_id, report_text[:BOT_CONFIG['max_message_length']])
+    
+    def rebuild_sales_rollup(self, message):
+        """Пересчет дневных итогов продаж за всю историю (только для админов)"""
+        chat_id = message['chat']['id']
+        user_data = self.db.get_user_by_telegram_id(message['from']['id'])
+        if not user_data or user_data[0][6] != 1:
+            self.message_handler.handle_message(message)
+            return
+        
+        with track_job('sales_rollup_rebuild'):
+            days = self.db.sales_rollup.rebuild()
+        self.send_message(chat_id, f"✅ Итоги продаж пересчитаны: {days} дн.")
+    
+    def handle_export_command(self, message):
+        """Выгрузка CSV документом (только для админов):
+        /export transactions|products_performance [дней] или /export stock_levels|movements
+        """
+        chat_id = message['chat']['id']
+        user_data = self.db.get_user_by_telegram_id(message['from']['id'])
+        if not user_data or user_data[0][6] != 1:
+            self.message_handler.handle_message(message)
+            return
+        
+        parts = message.get('text', '').split()
+        report_type = parts[1] if len(parts) > 1 else ''
+        days = int(parts[2]) if len(parts) > 2 and parts[2].isdigit() else 30
+        progress = log_progress(report_type)
+        
+        if report_type in ('transactions', 'products_performance') and self.financial_reports:
+            end_date = datetime.now().date()
+            start_date = end_date - timedelta(days=days)
+            chunks = self.financial_reports.iter_financial_data_csv(
+                report_type, start_date.isoformat(), end_date.isoformat(), progress
+            )
+            filename = f"{report_type}_{start_date}_{end_date}.csv"
+        elif report_type in ('stock_levels', 'movements') and self.inventory_manager:
+            chunks = self.inventory_manager.iter_inventory_csv(report_type, progress)
+            filename = f"{report_type}_{datetime.now().date()}.csv"
+        else:
+            self.send_message(
+                chat_id,
+                "📄 Выгрузки: /export transactions [дней], /export products_performance [дней], "
+                "/export stock_levels, /export movements"
+            )
+            return
+        
+        self.send_message(chat_id, f"⏳ Готовлю выгрузку {filename}...")
+        
+        # Большая выгрузка не должна держать обработчик обновлений
+        threading.Thread(
+            target=self.send_csv_export,
+            args=(chat_id, chunks, filename),
+            name='csv-export',
+            daemon=True
+        ).start()
     
     def show_user_notifications(self, message):
         """Показ уведомлений пользователя"""
@@ -661,19 +878,15 @@ class TelegramShopBot:
     
     def edit_message_reply_markup(self, chat_id, message_id, reply_markup):
         """Редактирование клавиатуры сообщения"""
-        url = f"{self.base_url}/editMessageReplyMarkup"
         data = {
             'chat_id': chat_id,
             'message_id': message_id,
-            'reply_markup': json.dumps(reply_markup)
+            'reply_markup': reply_markup
         }
         
         try:
-            data_encoded = urllib.parse.urlencode(data).encode('utf-8')
-            req = urllib.request.Request(url, data=data_encoded, method='POST')
-            with urllib.request.urlopen(req) as response:
-                result = json.loads(response.read().decode('utf-8'))
-                return result.get('ok', False)
+            result = self.api.call('editMessageReplyMarkup', data)
+            return result.get('ok', False)
         except Exception as e:
             print(f"Ошибка редактирования клавиатуры: {e}")
             return False
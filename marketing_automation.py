@@ -4,33 +4,112 @@
 
 from datetime import datetime, timedelta
 from utils import format_price, format_date
+import heapq
+import itertools
 import json
 import threading
 import time
+from events import event_bus, ORDER_CREATED, ORDER_STATUS_CHANGED, CART_UPDATED, STOCK_INBOUND
+from logger import logger
+from metrics import track_job
+
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# События, по которым проверяются правила, по типу триггера. Брошенная
+# корзина проверяется отложенно, сезонные правила - раз в сутки по таймеру
+TRIGGER_EVENTS = {
+    'cart_abandonment': (CART_UPDATED, ORDER_CREATED),
+    'customer_milestone': (ORDER_CREATED, ORDER_STATUS_CHANGED),
+    'product_restock': (STOCK_INBOUND,)
+}
+
+SEASONAL_MONTHS = {
+    'winter': [12, 1, 2],
+    'spring': [3, 4, 5],
+    'summer': [6, 7, 8],
+    'autumn': [9, 10, 11]
+}
+
+# Интервал проверки сезонных правил, секунды
+SEASONAL_CHECK_INTERVAL = 24 * 3600
 
 class MarketingAutomationManager:
     def __init__(self, db, notification_manager):
         self.db = db
         self.notification_manager = notification_manager
         self.automation_rules = {}
+        self._rules_lock = threading.Lock()
+        self._timers = []
+        self._cart_deadlines = {}
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
         self.start_automation_engine()
     
     def start_automation_engine(self):
-        """Запуск движка автоматизации"""
-        def automation_worker():
-            while True:
-                try:
-                    self.process_automation_rules()
-                    time.sleep(300)  # Проверяем каждые 5 минут
-                except Exception as e:
-                    print(f"Ошибка автоматизации: {e}")
-                    time.sleep(60)
-        
-        automation_thread = threading.Thread(target=automation_worker, daemon=True)
-        automation_thread.start()
+        """Запуск движка автоматизации.
+        
+        Правила загружаются в память один раз и проверяются по доменным
+        событиям только для затронутого пользователя или товара, без
+        периодического пересмотра таблиц. Отложенные проверки брошенных
+        корзин и сезонные правила ждут своего срока в куче таймеров.
+        """
+        self.load_automation_rules()
+        for event_type in (ORDER_CREATED, ORDER_STATUS_CHANGED, CART_UPDATED, STOCK_INBOUND):
+            event_bus.subscribe(event_type, self.handle_event)
+        
+        self.schedule_pending_carts()
+        for rule_id, _ in self.get_rules('seasonal'):
+            self._schedule(0, ('seasonal', rule_id))
+        
+        timer_thread = threading.Thread(target=self._timer_worker, name='automation-timers', daemon=True)
+        timer_thread.start()
+    
+    def load_automation_rules(self):
+        """Загрузка активных правил в память"""
+        rules = self.db.execute_query('''
+            SELECT id, name, trigger_type, conditions, actions
+            FROM automation_rules
+            WHERE is_active = 1
+        ''') or []
+        
+        loaded = {}
+        for rule_id, name, trigger_type, conditions_json, actions_json in rules:
+            try:
+                loaded[rule_id] = {
+                    'name': name,
+                    'trigger': trigger_type,
+                    'conditions': json.loads(conditions_json or '{}'),
+                    'actions': json.loads(actions_json or '[]'),
+                    'active': True
+                }
+            except ValueError as e:
+                logger.error(f"Ошибка разбора правила {name}: {e}")
+        
+        with self._rules_lock:
+            self.automation_rules = loaded
+        return len(loaded)
+    
+    def get_rules(self, trigger_type):
+        """Активные правила с данным триггером: [(rule_id, rule)]"""
+        with self._rules_lock:
+            return [
+                (rule_id, rule) for rule_id, rule in self.automation_rules.items()
+                if rule['trigger'] == trigger_type and rule['active']
+            ]
     
     def create_automation_rule(self, rule_name, trigger_type, conditions, actions):
-        """Создание правила автоматизации"""
+        """Создание правила автоматизации.
+        
+        Активное правило с тем же именем и триггером не дублируется:
+        повторная настройка при запуске возвращает его id.
+        """
+        existing = self.db.execute_query(
+            'SELECT id FROM automation_rules WHERE name = ? AND trigger_type = ? AND is_active = 1',
+            (rule_name, trigger_type)
+        )
+        if existing:
+            return existing[0][0]
+        
         rule_id = self.db.execute_query('''
             INSERT INTO automation_rules (
                 name, trigger_type, conditions, actions, is_active, created_at
@@ -38,150 +117,254 @@ class MarketingAutomationManager:
         ''', (
             rule_name, trigger_type, 
             json.dumps(conditions), json.dumps(actions),
-            datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            datetime.now().strftime(TIME_FORMAT)
         ))
         
-        self.automation_rules[rule_id] = {
-            'name': rule_name,
-            'trigger': trigger_type,
-            'conditions': conditions,
-            'actions': actions,
-            'active': True
-        }
+        with self._rules_lock:
+            self.automation_rules[rule_id] = {
+                'name': rule_name,
+                'trigger': trigger_type,
+                'conditions': conditions,
+                'actions': actions,
+                'active': True
+            }
+        
+        if trigger_type == 'seasonal':
+            self._schedule(0, ('seasonal', rule_id))
         
         return rule_id
     
-    def process_automation_rules(self):
-        """Обработка правил автоматизации"""
-        # Загружаем активные правила
-        active_rules = self.db.execute_query('''
-            SELECT id, name, trigger_type, conditions, actions
-            FROM automation_rules
-            WHERE is_active = 1
-        ''')
-        
-        for rule in active_rules:
-            rule_id, name, trigger_type, conditions_json, actions_json = rule
+    def handle_event(self, event_type, payload):
+        """Проверка правил, подписанных на доменное событие"""
+        with track_job('marketing_automation'):
+            user_id = payload.get('user_id')
+            if user_id is None and payload.get('order_id') is not None:
+                order = self.db.execute_query('SELECT user_id FROM orders WHERE id = ?', (payload['order_id'],))
+                user_id = order[0][0] if order else None
             
-            try:
-                conditions = json.loads(conditions_json)
-                actions = json.loads(actions_json)
-                
-                # Проверяем условия срабатывания
-                if self.check_trigger_conditions(trigger_type, conditions):
-                    self.execute_automation_actions(rule_id, actions)
-                    
-            except Exception as e:
-                print(f"Ошибка обработки правила {name}: {e}")
+            for trigger_type, event_types in TRIGGER_EVENTS.items():
+                if event_type not in event_types:
+                    continue
+                for rule_id, rule in self.get_rules(trigger_type):
+                    try:
+                        self.evaluate_rule(rule_id, rule, event_type, user_id, payload)
+                    except Exception as e:
+                        logger.error(f"Ошибка обработки правила {rule['name']}: {e}")
     
-    def check_trigger_conditions(self, trigger_type, conditions):
-        """Проверка условий срабатывания"""
+    def evaluate_rule(self, rule_id, rule, event_type, user_id, payload):
+        """Проверка одного правила для пользователя или товара из события"""
+        trigger_type = rule['trigger']
+        conditions = rule['conditions']
+        
         if trigger_type == 'cart_abandonment':
-            # Проверяем брошенные корзины
-            hours_threshold = conditions.get('hours_since_last_activity', 24)
-            min_cart_value = conditions.get('min_cart_value', 0)
-            
-            abandoned_carts = self.db.execute_query('''
-                SELECT DISTINCT c.user_id
-                FROM cart c
-                JOIN products p ON c.product_id = p.id
-                WHERE c.created_at <= datetime('now', '-{} hours')
-                AND c.user_id NOT IN (
-                    SELECT DISTINCT user_id FROM orders 
-                    WHERE created_at >= datetime('now', '-{} hours')
-                )
-                GROUP BY c.user_id
-                HAVING SUM(p.price * c.quantity) >= ?
-            '''.format(hours_threshold, hours_threshold), (min_cart_value,))
-            
-            return len(abandoned_carts) > 0
+            if user_id is None:
+                return
+            if event_type == CART_UPDATED:
+                hours = conditions.get('hours_since_last_activity', 24)
+                self._schedule_cart_check(rule_id, user_id, hours * 3600)
+            else:
+                # Заказ оформлен - корзина не брошена
+                self._cancel_cart_check(rule_id, user_id)
         
         elif trigger_type == 'customer_milestone':
-            # Проверяем достижения клиентов
-            milestone_type = conditions.get('milestone_type')
-            
-            if milestone_type == 'first_order':
-                # Клиенты, сделавшие первый заказ за последний час
-                first_orders = self.db.execute_query('''
-                    SELECT user_id FROM orders
-                    WHERE created_at >= datetime('now', '-1 hour')
-                    AND user_id NOT IN (
-                        SELECT DISTINCT user_id FROM orders
-                        WHERE created_at < datetime('now', '-1 hour')
-                    )
-                ''')
-                return len(first_orders) > 0
-            
-            elif milestone_type == 'spending_threshold':
-                threshold = conditions.get('spending_amount', 500)
-                # Клиенты, достигшие порога трат
-                milestone_customers = self.db.execute_query('''
-                    SELECT user_id, SUM(total_amount) as total_spent
-                    FROM orders
-                    WHERE status != 'cancelled'
-                    GROUP BY user_id
-                    HAVING total_spent >= ?
-                    AND user_id NOT IN (
-                        SELECT user_id FROM automation_executions
-                        WHERE rule_type = 'spending_milestone'
-                        AND created_at >= datetime('now', '-30 days')
-                    )
-                ''', (threshold,))
-                return len(milestone_customers) > 0
+            if user_id is not None and self.check_customer_milestone(rule_id, user_id, conditions, event_type):
+                self.execute_automation_actions(
+                    rule_id, rule['actions'], [user_id], conditions.get('milestone_type')
+                )
         
         elif trigger_type == 'product_restock':
-            # Проверяем поступления товаров
-            restocked_products = self.db.execute_query('''
-                SELECT product_id FROM inventory_movements
-                WHERE movement_type = 'inbound'
-                AND created_at >= datetime('now', '-1 hour')
-            ''')
-            return len(restocked_products) > 0
-        
-        elif trigger_type == 'seasonal':
-            # Сезонные триггеры
-            season = conditions.get('season')
-            current_month = datetime.now().month
-            
-            seasonal_months = {
-                'winter': [12, 1, 2],
-                'spring': [3, 4, 5],
-                'summer': [6, 7, 8],
-                'autumn': [9, 10, 11]
-            }
-            
-            return current_month in seasonal_months.get(season, [])
+            # Поступивший товар интересен добавившим его в избранное
+            subscribers = self.db.execute_query(
+                'SELECT user_id FROM favorites WHERE product_id = ?',
+                (payload['product_id'],)
+            ) or []
+            self.execute_automation_actions(
+                rule_id, rule['actions'], [row[0] for row in subscribers], trigger_type
+            )
+    
+    def check_customer_milestone(self, rule_id, user_id, conditions, event_type):
+        """Достижение клиента по его собственным заказам"""
+        milestone_type = conditions.get('milestone_type')
+        
+        if milestone_type == 'first_order':
+            if event_type != ORDER_CREATED:
+                return False
+            orders = self.db.execute_query('SELECT COUNT(*) FROM orders WHERE user_id = ?', (user_id,))
+            return bool(orders) and orders[0][0] == 1 and not self.was_executed(rule_id, user_id)
+        
+        elif milestone_type == 'spending_threshold':
+            threshold = conditions.get('spending_amount', 500)
+            spent = self.db.execute_query('''
+                SELECT COALESCE(SUM(total_amount), 0) FROM orders
+                WHERE user_id = ? AND status != 'cancelled'
+            ''', (user_id,))
+            if not spent or spent[0][0] < threshold:
+                return False
+            # Не чаще раза в 30 дней для одного клиента
+            since = (datetime.now() - timedelta(days=30)).strftime(TIME_FORMAT)
+            return not self.was_executed(rule_id, user_id, since)
         
         return False
     
-    def execute_automation_actions(self, rule_id, actions):
-        """Выполнение действий автоматизации"""
+    def check_abandoned_cart(self, rule_id, user_id, conditions):
+        """Брошенная корзина пользователя: давно не менялась и не оформлена"""
+        hours_threshold = conditions.get('hours_since_last_activity', 24)
+        min_cart_value = conditions.get('min_cart_value', 0)
+        
+        cart = self.db.execute_query('''
+            SELECT (julianday('now') - julianday(MAX(c.created_at))) * 24,
+                   SUM(p.price * c.quantity)
+            FROM cart c
+            JOIN products p ON c.product_id = p.id
+            WHERE c.user_id = ?
+        ''', (user_id,))
+        if not cart or cart[0][0] is None:
+            return False
+        
+        idle_hours, cart_value = cart[0]
+        if idle_hours < hours_threshold:
+            # Корзину меняли после постановки проверки
+            self._schedule_cart_check(rule_id, user_id, (hours_threshold - idle_hours) * 3600)
+            return False
+        if cart_value < min_cart_value:
+            return False
+        
+        recent_order = self.db.execute_query('''
+            SELECT 1 FROM orders
+            WHERE user_id = ? AND created_at >= datetime('now', ?)
+            LIMIT 1
+        ''', (user_id, f'-{hours_threshold} hours'))
+        if recent_order:
+            return False
+        
+        # Одно напоминание на одно состояние корзины
+        since = (datetime.now() - timedelta(hours=idle_hours)).strftime(TIME_FORMAT)
+        return not self.was_executed(rule_id, user_id, since)
+    
+    def check_seasonal(self, rule_id, conditions):
+        """Сезонное правило срабатывает раз в день в течение сезона"""
+        if datetime.now().month not in SEASONAL_MONTHS.get(conditions.get('season'), []):
+            return False
+        return not self.was_executed(rule_id, None, datetime.now().strftime('%Y-%m-%d 00:00:00'))
+    
+    def was_executed(self, rule_id, user_id, since=None):
+        """Срабатывало ли правило для пользователя (None - без пользователя)"""
+        query = 'SELECT 1 FROM automation_executions WHERE user_id IS ? AND rule_id = ?'
+        params = [user_id, rule_id]
+        if since:
+            query += ' AND executed_at >= ?'
+            params.append(since)
+        return bool(self.db.execute_query(query + ' LIMIT 1', params))
+    
+    def schedule_pending_carts(self):
+        """Отложенные проверки корзин, оставшихся с прошлого запуска"""
+        for rule_id, rule in self.get_rules('cart_abandonment'):
+            hours = rule['conditions'].get('hours_since_last_activity', 24)
+            carts = self.db.execute_query('''
+                SELECT user_id,
+                       MAX(0, (julianday(MAX(created_at)) + ? / 24.0 - julianday('now')) * 86400)
+                FROM cart
+                GROUP BY user_id
+            ''', (hours,)) or []
+            for user_id, delay in carts:
+                self._schedule_cart_check(rule_id, user_id, delay)
+    
+    def _schedule(self, delay, key):
+        with self._condition:
+            heapq.heappush(self._timers, (time.monotonic() + delay, next(self._sequence), key))
+            self._condition.notify()
+    
+    def _schedule_cart_check(self, rule_id, user_id, delay):
+        """Проверка корзины через delay секунд; новая активность сдвигает срок"""
+        due = time.monotonic() + delay
+        with self._condition:
+            current = self._cart_deadlines.get((rule_id, user_id))
+            self._cart_deadlines[(rule_id, user_id)] = due
+            # В куче одна запись на корзину: поздний срок переносится при ее извлечении
+            if current is None or due < current:
+                heapq.heappush(self._timers, (due, next(self._sequence), ('cart', rule_id, user_id)))
+                self._condition.notify()
+    
+    def _cancel_cart_check(self, rule_id, user_id):
+        with self._condition:
+            self._cart_deadlines.pop((rule_id, user_id), None)
+    
+    def _timer_worker(self):
+        while True:
+            with self._condition:
+                while not self._timers or self._timers[0][0] > time.monotonic():
+                    timeout = self._timers[0][0] - time.monotonic() if self._timers else None
+                    self._condition.wait(timeout)
+                due, _, key = heapq.heappop(self._timers)
+                
+                if key[0] == 'cart':
+                    deadline = self._cart_deadlines.get(key[1:])
+                    if deadline is None:
+                        continue
+                    if deadline > due:
+                        heapq.heappush(self._timers, (deadline, next(self._sequence), key))
+                        continue
+                    del self._cart_deadlines[key[1:]]
+            
+            try:
+                with track_job('marketing_automation'):
+                    self.run_timer(key)
+            except Exception as e:
+                logger.error(f"Ошибка отложенной проверки автоматизации {key}: {e}")
+    
+    def run_timer(self, key):
+        """Наступивший срок: проверка корзины или сезонного правила"""
+        with self._rules_lock:
+            rule = self.automation_rules.get(key[1])
+        if not rule or not rule['active']:
+            return
+        
+        if key[0] == 'cart':
+            _, rule_id, user_id = key
+            if self.check_abandoned_cart(rule_id, user_id, rule['conditions']):
+                self.execute_automation_actions(rule_id, rule['actions'], [user_id], rule['trigger'])
+        
+        elif key[0] == 'seasonal':
+            rule_id = key[1]
+            self._schedule(SEASONAL_CHECK_INTERVAL, key)
+            if self.check_seasonal(rule_id, rule['conditions']):
+                self.execute_automation_actions(rule_id, rule['actions'], rule_type=rule['trigger'])
+    
+    def execute_automation_actions(self, rule_id, actions, user_ids=None, rule_type=None):
+        """Выполнение действий автоматизации.
+        
+        user_ids - пользователи из события; если None, аудиторию
+        выбирает само действие.
+        """
         for action in actions:
             action_type = action.get('type')
             
             if action_type == 'send_notification':
-                self.execute_notification_action(rule_id, action)
+                self.execute_notification_action(rule_id, action, user_ids)
             elif action_type == 'create_promo_code':
                 self.execute_promo_creation_action(rule_id, action)
             elif action_type == 'update_product_price':
                 self.execute_price_update_action(rule_id, action)
             elif action_type == 'send_personalized_offer':
-                self.execute_personalized_offer_action(rule_id, action)
-        
-        # Записываем выполнение
-        self.db.execute_query('''
-            INSERT INTO automation_executions (rule_id, executed_at)
-            VALUES (?, ?)
-        ''', (rule_id, datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+                self.execute_personalized_offer_action(rule_id, action, user_ids)
+        
+        # Записываем выполнение по каждому пользователю - по нему правило не срабатывает повторно
+        executed_at = datetime.now().strftime(TIME_FORMAT)
+        self.db.execute_many('''
+            INSERT INTO automation_executions (rule_id, user_id, rule_type, executed_at)
+            VALUES (?, ?, ?, ?)
+        ''', [(rule_id, user_id, rule_type, executed_at) for user_id in (user_ids or [None])])
     
-    def execute_notification_action(self, rule_id, action):
+    def execute_notification_action(self, rule_id, action, user_ids=None):
         """Выполнение действия отправки уведомления"""
         target_audience = action.get('target_audience', 'all')
         message_template = action.get('message_template', '')
         notification_type = action.get('notification_type', 'promotion')
         
         # Определяем целевую аудиторию
-        if target_audience == 'abandoned_cart':
+        if user_ids is not None:
+            target_users = [(user_id,) for user_id in user_ids]
+        elif target_audience == 'abandoned_cart':
             target_users = self.db.execute_query('''
                 SELECT DISTINCT c.user_id
                 FROM cart c
@@ -299,39 +482,38 @@ class MarketingAutomationManager:
                     (new_price, product_id)
                 )
     
-    def execute_personalized_offer_action(self, rule_id, action):
+    def execute_personalized_offer_action(self, rule_id, action, user_ids=None):
         """Создание персональных предложений"""
         from crm import CRMManager
         crm = CRMManager(self.db)
         
         # Получаем клиентов для персональных предложений
-        segments = crm.segment_customers()
-        target_segment = action.get('target_segment', 'need_attention')
+        if user_ids is not None:
+            customers = [(user_id,) for user_id in user_ids]
+        else:
+            customers = crm.get_segment_customers(action.get('target_segment', 'need_attention'), limit=10)
         
-        if target_segment in segments:
-            customers = segments[target_segment]
+        for customer in customers[:10]:  # Ограничиваем 10 клиентами за раз
+            user_id = customer[0]
             
-            for customer in customers[:10]:  # Ограничиваем 10 клиентами за раз
-                user_id = customer[0]
-                
-                # Создаем персональное предложение
-                offer = crm.create_personalized_offer(user_id)
-                
-                # Генерируем персональный промокод
-                from promotions import PromotionManager
-                promo_manager = PromotionManager(self.db)
-                personal_promo = promo_manager.generate_personal_promo(user_id, 'automation')
-                
-                # Отправляем предложение
-                offer_message = f"🎯 <b>Персональное предложение!</b>\n\n"
-                offer_message += f"{offer['description']}\n\n"
-                offer_message += f"🎁 Ваш промокод: <code>{personal_promo['code']}</code>\n"
-                offer_message += f"💰 Скидка: {personal_promo['discount']}%\n"
-                offer_message += f"⏰ Действует до: {format_date(personal_promo['expires_at'])}"
-                
-                self.notification_manager.send_instant_push(
-                    user_id, 'Персональное предложение', offer_message, 'promotion'
-                )
+            # Создаем персональное предложение
+            offer = crm.create_personalized_offer(user_id)
+            
+            # Генерируем персональный промокод
+            from promotions import PromotionManager
+            promo_manager = PromotionManager(self.db)
+            personal_promo = promo_manager.generate_personal_promo(user_id, 'automation')
+            
+            # Отправляем предложение
+            offer_message = f"🎯 <b>Персональное предложение!</b>\n\n"
+            offer_message += f"{offer['description']}\n\n"
+            offer_message += f"🎁 Ваш промокод: <code>{personal_promo['code']}</code>\n"
+            offer_message += f"💰 Скидка: {personal_promo['discount']}%\n"
+            offer_message += f"⏰ Действует до: {format_date(personal_promo['expires_at'])}"
+            
+            self.notification_manager.send_instant_push(
+                user_id, 'Персональное предложение', offer_message, 'promotion'
+            )
     
     def personalize_message(self, user_id, message_template):
         """Персонализация сообщения"""
@@ -447,8 +629,7 @@ class MarketingAutomationManager:
         from crm import CRMManager
         crm = CRMManager(self.db)
         
-        segments = crm.segment_customers()
-        target_customers = segments.get(target_segment, [])
+        target_customers = crm.get_segment_customers(target_segment)
         
         upsell_results = []
         
@@ -0,0 +1,161 @@
+"""
+Постоянная очередь push-уведомлений с приоритетами
+"""
+
+import heapq
+import itertools
+import threading
+import time
+from datetime import datetime
+from logger import logger
+
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+class NotificationOutbox:
+    """Очередь уведомлений, сохраненная в таблице notification_outbox.
+    
+    Отложенные уведомления лежат в куче по времени отправки, наступившие -
+    в куче по приоритету (меньше - важнее). Обработчики спят до ближайшего
+    срока, а не опрашивают очередь, и после перезапуска бота неотправленные
+    уведомления загружаются из базы.
+    """
+    
+    def __init__(self, db, sender, workers=4, retry_delay=300):
+        self.db = db
+        self.sender = sender
+        self.workers = max(1, workers)
+        self.retry_delay = retry_delay
+        self._delayed = []
+        self._ready = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self.threads = []
+        self.running = False
+    
+    def start(self):
+        """Загрузка неотправленных уведомлений и запуск обработчиков"""
+        self.db.cleanup_outbox()
+        pending = self.db.get_pending_outbox_notifications() or []
+        with self._condition:
+            for row in pending:
+                outbox_id, user_id, title, message, notification_type, priority, scheduled_at, attempts, max_attempts = row
+                self._push({
+                    'id': outbox_id,
+                    'user_id': user_id,
+                    'title': title,
+                    'message': message,
+                    'type': notification_type,
+                    'priority': priority,
+                    'scheduled_time': datetime.strptime(scheduled_at, TIME_FORMAT),
+                    'attempts': attempts,
+                    'max_attempts': max_attempts
+                })
+        
+        self.running = True
+        for index in range(self.workers):
+            thread = threading.Thread(
+                target=self._worker,
+                name=f'push-worker-{index}',
+                daemon=True
+            )
+            thread.start()
+            self.threads.append(thread)
+        logger.info(f"Очередь уведомлений запущена: {len(pending)} ожидают отправки")
+    
+    def put(self, user_id, title, message, notification_type='info', priority=5, scheduled_time=None, max_attempts=3):
+        """Сохранение уведомления в базе и постановка в очередь"""
+        scheduled_time = (scheduled_time or datetime.now()).replace(microsecond=0)
+        outbox_id = self.db.add_outbox_notification(
+            user_id, title, message, notification_type, priority,
+            scheduled_time.strftime(TIME_FORMAT), max_attempts
+        )
+        if outbox_id is None:
+            raise RuntimeError('Не удалось сохранить уведомление в очереди')
+        
+        notification = {
+            'id': outbox_id,
+            'user_id': user_id,
+            'title': title,
+            'message': message,
+            'type': notification_type,
+            'priority': priority,
+            'scheduled_time': scheduled_time,
+            'attempts': 0,
+            'max_attempts': max_attempts
+        }
+        with self._condition:
+            self._push(notification)
+        return outbox_id
+    
+    def _push(self, notification):
+        """Добавление в кучу; вызывается под блокировкой"""
+        heapq.heappush(self._delayed, (
+            notification['scheduled_time'].timestamp(),
+            notification['priority'],
+            next(self._sequence),
+            notification
+        ))
+        self._condition.notify()
+    
+    def _take(self):
+        """Следующее наступившее уведомление с наивысшим приоритетом"""
+        with self._condition:
+            while self.running:
+                now = time.time()
+                while self._delayed and self._delayed[0][0] <= now:
+                    scheduled, priority, sequence, notification = heapq.heappop(self._delayed)
+                    heapq.heappush(self._ready, (priority, scheduled, sequence, notification))
+                
+                if self._ready:
+                    return heapq.heappop(self._ready)[3]
+                
+                timeout = self._delayed[0][0] - now if self._delayed else None
+                self._condition.wait(timeout)
+            return None
+    
+    def _worker(self):
+        """Цикл обработчика очереди"""
+        while True:
+            notification = self._take()
+            if notification is None:
+                return
+            try:
+                self.sender(notification)
+                self.db.mark_outbox_sent(notification['id'])
+            except Exception as e:
+                self._retry(notification, str(e))
+    
+    def _retry(self, notification, error):
+        """Повтор через retry_delay или отметка об окончательной ошибке"""
+        notification['attempts'] += 1
+        logger.warning(f"Ошибка отправки push пользователю {notification['user_id']}: {error}")
+        
+        if notification['attempts'] >= notification['max_attempts']:
+            self.db.mark_outbox_failed(notification['id'], notification['attempts'], error)
+            return
+        
+        notification['scheduled_time'] = datetime.fromtimestamp(int(time.time() + self.retry_delay))
+        self.db.reschedule_outbox_notification(
+            notification['id'],
+            notification['attempts'],
+            notification['scheduled_time'].strftime(TIME_FORMAT),
+            error
+        )
+        with self._condition:
+            self._push(notification)
+    
+    def get_stats(self):
+        """Размеры очереди"""
+        with self._condition:
+            return {'ready': len(self._ready), 'delayed': len(self._delayed)}
+    
+    def stop(self, timeout=10):
+        """Остановка обработчиков; неотправленное остается в базе"""
+        if not self.running:
+            return
+        with self._condition:
+            self.running = False
+            self._condition.notify_all()
+        for thread in self.threads:
+            thread.join(timeout)
+        self.threads = []
@@ -4,104 +4,98 @@
 
 from datetime import datetime, timedelta
 from utils import format_date, format_price
-import threading
-import time
+from config import BOT_CONFIG
+from notification_outbox import NotificationOutbox
+from recommendation_store import RecommendationStore
 
 class NotificationManager:
+    # Очередность отправки наступивших уведомлений: меньше - раньше
+    PUSH_PRIORITIES = {
+        'order': 1,
+        'payment': 1,
+        'delivery': 2,
+        'warning': 2,
+        'success': 3,
+        'reminder': 4,
+        'info': 5,
+        'promotion': 8
+    }
+    
     def __init__(self, bot, db):
         self.bot = bot
         self.db = db
-        self.push_queue = []
+        self.outbox = NotificationOutbox(
+            db, self.send_push_notification,
+            workers=BOT_CONFIG['notification_workers']
+        )
         self.start_push_service()
     
     def start_push_service(self):
         """Запуск службы push-уведомлений"""
-        def push_worker():
-            while True:
-                try:
-                    if self.push_queue:
-                        notification = self.push_queue.pop(0)
-                        self.send_push_notification(notification)
-                    time.sleep(1)
-                except Exception as e:
-                    print(f"Ошибка push-службы: {e}")
-        
-        push_thread = threading.Thread(target=push_worker, daemon=True)
-        push_thread.start()
+        self.outbox.start()
     
-    def queue_push_notification(self, user_id, title, message, notification_type='info', delay_seconds=0):
+    def queue_push_notification(self, user_id, title, message, notification_type='info', delay_seconds=0, priority=None):
         """Добавление push-уведомления в очередь"""
-        notification = {
-            'user_id': user_id,
-            'title': title,
-            'message': message,
-            'type': notification_type,
-            'scheduled_time': datetime.now() + timedelta(seconds=delay_seconds),
-            'attempts': 0,
-            'max_attempts': 3
-        }
-        self.push_queue.append(notification)
-    
-    def send_push_notification(self, notification):
-        """Отправка push-уведомления"""
-        if datetime.now() < notification['scheduled_time']:
-            # Возвращаем в очередь если время еще не пришло
-            self.push_queue.append(notification)
-            return
+        if priority is None:
+            priority = self.PUSH_PRIORITIES.get(notification_type, 5)
         
         try:
-            # Получаем telegram_id пользователя
-            user = self.db.execute_query(
-                'SELECT telegram_id, language FROM users WHERE id = ?',
-                (notification['user_id'],)
+            self.outbox.put(
+                user_id, title, message, notification_type,
+                priority=priority,
+                scheduled_time=datetime.now() + timedelta(seconds=delay_seconds)
             )
-            
-            if user:
-                telegram_id, language = user[0]
-                
-                # Локализуем сообщение
-                from localization import t
-                localized_title = t(notification['title'], language=language) if notification['title'].startswith('push_') else notification['title']
-                localized_message = t(notification['message'], language=language) if notification['message'].startswith('push_') else notification['message']
-                
-                # Добавляем эмодзи в зависимости от типа
-                type_emojis = {
-                    'order': '📦',
-                    'payment': '💳',
-                    'delivery': '🚚',
-                    'promotion': '🎁',
-                    'reminder': '⏰',
-                    'warning': '⚠️',
-                    'success': '✅',
-                    'info': 'ℹ️'
-                }
-                
-                emoji = type_emojis.get(notification['type'], '📱')
-                push_text = f"{emoji} <b>{localized_title}</b>\n\n{localized_message}"
-                
-                # Отправляем уведомление
-                result = self.bot.send_message(telegram_id, push_text)
-                
-                if result and result.get('ok'):
-                    # Сохраняем в базу как доставленное
-                    self.db.add_notification(
-                        notification['user_id'],
-                        localized_title,
-                        localized_message,
-                        notification['type']
-                    )
-                    print(f"✅ Push отправлен пользователю {telegram_id}")
-                else:
-                    raise Exception("Не удалось отправить сообщение")
-                    
         except Exception as e:
-            notification['attempts'] += 1
-            print(f"❌ Ошибка отправки push пользователю {notification['user_id']}: {e}")
+            print(f"❌ Ошибка постановки push в очередь для пользователя {user_id}: {e}")
+    
+    def send_push_notification(self, notification):
+        """Отправка push-уведомления.
+        
+        Исключение означает неудачную попытку - очередь повторит ее позже.
+        """
+        # Получаем telegram_id пользователя
+        user = self.db.execute_query(
+            'SELECT telegram_id, language FROM users WHERE id = ?',
+            (notification['user_id'],)
+        )
+        
+        if user:
+            telegram_id, language = user[0]
+            
+            # Локализуем сообщение
+            from localization import t
+            localized_title = t(notification['title'], language=language) if notification['title'].startswith('push_') else notification['title']
+            localized_message = t(notification['message'], language=language) if notification['message'].startswith('push_') else notification['message']
             
-            # Повторная попытка если не превышен лимит
-            if notification['attempts'] < notification['max_attempts']:
-                notification['scheduled_time'] = datetime.now() + timedelta(minutes=5)
-                self.push_queue.append(notification)
+            # Добавляем эмодзи в зависимости от типа
+            type_emojis = {
+                'order': '📦',
+                'payment': '💳',
+                'delivery': '🚚',
+                'promotion': '🎁',
+                'reminder': '⏰',
+                'warning': '⚠️',
+                'success': '✅',
+                'info': 'ℹ️'
+            }
+            
+            emoji = type_emojis.get(notification['type'], '📱')
+            push_text = f"{emoji} <b>{localized_title}</b>\n\n{localized_message}"
+            
+            # Отправляем уведомление
+            result = self.bot.send_message(telegram_id, push_text)
+            
+            if result and result.get('ok'):
+                # Сохраняем в базу как доставленное
+                self.db.add_notification(
+                    notification['user_id'],
+                    localized_title,
+                    localized_message,
+                    notification['type']
+                )
+                print(f"✅ Push отправлен пользователю {telegram_id}")
+            else:
+                raise Exception("Не удалось отправить сообщение")
     
     def send_instant_push(self, user_id, title, message, notification_type='info'):
         """Мгновенная отправка push-уведомления"""
@@ -351,8 +345,11 @@ class NotificationManager:
             try:
                 # Можно добавить локализацию сообщения по языку пользователя
                 localized_message = self.localize_broadcast_message(message_text, user[2])
-                self.bot.send_message(user[0], localized_message)
-                success_count += 1
+                result = self.bot.send_message(user[0], localized_message)
+                if result and result.get('ok'):
+                    success_count += 1
+                else:
+                    error_count += 1
             except Exception as e:
                 error_count += 1
                 print(f"Ошибка рассылки пользователю {user[0]}: {e}")
@@ -454,45 +451,26 @@ class NotificationManager:
                 print(f"Ошибка уведомления о поступлении {user[0]}: {e}")
     
     def send_weekly_recommendations(self):
-        """Еженедельные персональные рекомендации"""
-        # Получаем активных пользователей
-        active_users = self.db.execute_query('''
-            SELECT DISTINCT u.telegram_id, u.name, u.language, u.id
-            FROM users u
-            JOIN orders o ON u.id = o.user_id
-            WHERE u.is_admin = 0 AND o.created_at >= datetime('now', '-30 days')
-        ''')
+        """Еженедельные персональные рекомендации из хранилища рекомендаций.
         
-        for user in active_users:
-            # Получаем рекомендации на основе истории покупок
-            recommendations = self.db.execute_query('''
-                SELECT DISTINCT p.id, p.name, p.price, p.image_url
-                FROM products p
-                JOIN categories c ON p.category_id = c.id
-                WHERE p.is_active = 1 
-                AND p.id NOT IN (
-                    SELECT DISTINCT oi.product_id
-                    FROM order_items oi
-                    JOIN orders o ON oi.order_id = o.id
-                    WHERE o.user_id = ?
-                )
-                AND c.id IN (
-                    SELECT DISTINCT p2.category_id
-                    FROM products p2
-                    JOIN order_items oi2 ON p2.id = oi2.product_id
-                    JOIN orders o2 ON oi2.order_id = o2.id
-                    WHERE o2.user_id = ?
-                )
-                ORDER BY p.views DESC, p.sales_count DESC
-                LIMIT 3
-            ''', (user[3], user[3]))
+        Только чтение хранилища: списки заполняет фоновое задание
+        start_recommendation_store, пользователи без действующего списка
+        пропускаются.
+        """
+        store = RecommendationStore(self.db)
+        entries = store.active_entries(days=30)
+        
+        shown = {product_id for entry in entries for product_id in entry[4][:10]}
+        products = store.load_products(shown, columns='p.id, p.name, p.price, p.image_url')
+        
+        for _, telegram_id, name, language, product_ids in entries:
+            recommendations = [products[product_id] for product_id in product_ids if product_id in products][:3]
             
             if recommendations:
                 from localization import t
-                language = user[2]
                 
                 rec_text = f"💡 <b>{t('weekly_recommendations', language=language)}</b>\n\n"
-                rec_text += f"👋 {user[1]}, {t('recommendations_intro', language=language)}\n\n"
+                rec_text += f"👋 {name}, {t('recommendations_intro', language=language)}\n\n"
                 
                 for product in recommendations:
                     rec_text += f"🛍 <b>{product[1]}</b>\n"
@@ -501,9 +479,9 @@ class NotificationManager:
                 rec_text += f"🎯 {t('check_catalog', language=language)}"
                 
                 try:
-                    self.bot.send_message(user[0], rec_text)
+                    self.bot.send_message(telegram_id, rec_text)
                 except Exception as e:
-                    print(f"Ошибка отправки рекомендаций {user[0]}: {e}")
+                    print(f"Ошибка отправки рекомендаций {telegram_id}: {e}")
     
     def send_promotional_campaign(self, campaign_data):
         """Отправка промо-кампании"""
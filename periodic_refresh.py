@@ -0,0 +1,69 @@
+"""
+Периодический пересчет таблиц в фоне: время последнего пересчета и цикл обработчика
+"""
+
+import threading
+import time
+from datetime import datetime, timedelta
+from logger import logger
+
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+class PeriodicRefresh:
+    """Основа заданий, которые целиком пересчитывают свою таблицу.
+    
+    Время пересчета хранится в refresh_runs под именем JOB, а не
+    выводится из строк таблицы, поэтому пустой результат (например, пока
+    нет ни одного клиента) тоже считается пересчетом и не запускает его
+    снова. Наследник задает JOB и INTERVAL_KEY (ключ интервала в
+    self.config), реализует refresh() и вызывает mark_refreshed() в его
+    транзакции.
+    """
+    
+    JOB = None
+    INTERVAL_KEY = None
+    
+    def mark_refreshed(self):
+        """Запись времени пересчета"""
+        return self.db.execute_query(
+            'INSERT OR REPLACE INTO refresh_runs (job, refreshed_at) VALUES (?, ?)',
+            (self.JOB, datetime.now().strftime(TIME_FORMAT))
+        )
+    
+    def computed_at(self):
+        """Время последнего пересчета или None"""
+        row = self.db.execute_query('SELECT refreshed_at FROM refresh_runs WHERE job = ?', (self.JOB,))
+        if not row or not row[0][0]:
+            return None
+        return datetime.strptime(row[0][0], TIME_FORMAT)
+    
+    def seconds_until_due(self, max_age=None):
+        """Секунд до следующего планового пересчета (0 - пора)"""
+        max_age = max_age or self.config[self.INTERVAL_KEY]
+        computed_at = self.computed_at()
+        if computed_at is None:
+            return 0
+        return max(0, (computed_at + timedelta(seconds=max_age) - datetime.now()).total_seconds())
+    
+    def ensure_fresh(self, max_age=None):
+        """Пересчет, если его не было или он старше max_age секунд"""
+        if self.seconds_until_due(max_age) > 0:
+            return None
+        return self.refresh()
+
+def start_refresh_worker(job, is_running, description, interval=None):
+    """Фоновый поток: пересчет по сроку и сон до следующего срока"""
+    interval = interval or job.config[job.INTERVAL_KEY]
+    
+    def refresh_worker():
+        while is_running():
+            try:
+                job.ensure_fresh(interval)
+                time.sleep(max(job.seconds_until_due(interval), 1))
+            except Exception as e:
+                logger.error(f"Ошибка пересчета {description}: {e}")
+                time.sleep(600)
+    
+    thread = threading.Thread(target=refresh_worker, name=f'refresh-{job.JOB}', daemon=True)
+    thread.start()
+    return thread
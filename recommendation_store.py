@@ -0,0 +1,108 @@
+"""
+Хранилище готовых рекомендаций пользователей со сроком жизни
+"""
+
+import json
+from datetime import datetime, timedelta
+from config import RECOMMENDATION_CONFIG
+
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# Товаров в одном запросе IN (...) - ниже лимита параметров SQLite
+PRODUCTS_CHUNK = 500
+
+class RecommendationStore:
+    """Ранжированные списки товаров по пользователям в recommendation_store.
+    
+    Списки считает фоновое задание пачками (AIRecommendationEngine.
+    refresh_recommendation_store), чтение - одна строка по первичному
+    ключу. Запись устаревает через store_ttl и удаляется, когда
+    пользователь оформляет заказ.
+    """
+    
+    def __init__(self, db, config=None):
+        self.db = db
+        self.config = config or RECOMMENDATION_CONFIG
+    
+    def get(self, user_id):
+        """Действующий список id товаров или None"""
+        row = self.db.execute_query(
+            'SELECT product_ids FROM recommendation_store WHERE user_id = ? AND expires_at > ?',
+            (user_id, datetime.now().strftime(TIME_FORMAT))
+        )
+        return json.loads(row[0][0]) if row else None
+    
+    def get_products(self, user_id, limit=5):
+        """Активные товары из списка пользователя в порядке ранга; None - записи нет"""
+        product_ids = self.get(user_id)
+        if product_ids is None:
+            return None
+        products = self.load_products(product_ids)
+        return [products[product_id] for product_id in product_ids if product_id in products][:limit]
+    
+    def load_products(self, product_ids, columns='p.*, c.name as category_name'):
+        """Активные товары по id: {id: строка}; первый столбец - p.id"""
+        product_ids = list(product_ids)
+        products = {}
+        for start in range(0, len(product_ids), PRODUCTS_CHUNK):
+            chunk = product_ids[start:start + PRODUCTS_CHUNK]
+            placeholders = ','.join('?' * len(chunk))
+            rows = self.db.execute_query(f'''
+                SELECT {columns}
+                FROM products p
+                JOIN categories c ON p.category_id = c.id
+                WHERE p.id IN ({placeholders}) AND p.is_active = 1
+            ''', chunk) or []
+            products.update((row[0], row) for row in rows)
+        return products
+    
+    def put_many(self, entries):
+        """Запись списков [(user_id, [product_id, ...])]"""
+        now = datetime.now()
+        computed_at = now.strftime(TIME_FORMAT)
+        expires_at = (now + timedelta(seconds=self.config['store_ttl'])).strftime(TIME_FORMAT)
+        return self.db.execute_many('''
+            INSERT OR REPLACE INTO recommendation_store (user_id, product_ids, computed_at, expires_at)
+            VALUES (?, ?, ?, ?)
+        ''', [
+            (user_id, json.dumps(product_ids), computed_at, expires_at)
+            for user_id, product_ids in entries
+        ])
+    
+    def invalidate(self, user_id):
+        """Удаление списка пользователя"""
+        return self.db.execute_query('DELETE FROM recommendation_store WHERE user_id = ?', (user_id,))
+    
+    def handle_order_event(self, event_type, payload):
+        """Заказ меняет историю покупок - список пользователя устарел"""
+        if payload.get('user_id') is not None:
+            self.invalidate(payload['user_id'])
+    
+    def stale_users(self, after_id=0, limit=None):
+        """Покупатели без действующего списка, по возрастанию id (пачка после after_id)"""
+        return [row[0] for row in self.db.execute_query('''
+            SELECT u.id
+            FROM users u
+            LEFT JOIN recommendation_store rs ON rs.user_id = u.id
+            WHERE u.id > ? AND u.is_admin = 0
+            AND (rs.user_id IS NULL OR rs.expires_at <= ?)
+            AND EXISTS (SELECT 1 FROM orders o WHERE o.user_id = u.id)
+            ORDER BY u.id
+            LIMIT ?
+        ''', (after_id, datetime.now().strftime(TIME_FORMAT), limit or self.config['store_batch'])) or []]
+    
+    def active_entries(self, days=30):
+        """Действующие списки пользователей с заказами за days дней:
+        (user_id, telegram_id, name, language, [product_id, ...])
+        """
+        rows = self.db.execute_query('''
+            SELECT rs.user_id, u.telegram_id, u.name, u.language, rs.product_ids
+            FROM recommendation_store rs
+            JOIN users u ON u.id = rs.user_id
+            WHERE rs.expires_at > ? AND u.is_admin = 0
+            AND EXISTS (
+                SELECT 1 FROM orders o
+                WHERE o.user_id = rs.user_id AND o.created_at >= datetime('now', ?)
+            )
+        ''', (datetime.now().strftime(TIME_FORMAT), f'-{days} days')) or []
+        return [(*row[:4], json.loads(row[4])) for row in rows]
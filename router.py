@@ -0,0 +1,160 @@
+"""
+Таблица маршрутов для сообщений, callback-запросов и состояний
+"""
+
+import time
+from metrics import registry
+
+ROUTE_DURATION = registry.histogram(
+    'bot_route_duration_seconds',
+    'Время обработки обновления по маршруту',
+    ['router', 'route']
+)
+ROUTE_ERRORS = registry.counter(
+    'bot_route_errors_total',
+    'Исключения, вышедшие из обработчиков маршрутов',
+    ['router', 'route']
+)
+
+class Route:
+    """Маршрут: вызов обработчика с замером времени"""
+    
+    __slots__ = ('router', 'kind', 'key', 'handler')
+    
+    def __init__(self, router, kind, key, handler):
+        self.router = router
+        self.kind = kind
+        self.key = key
+        self.handler = handler
+    
+    def __call__(self, *args):
+        started = time.perf_counter()
+        try:
+            return self.handler(*args)
+        except Exception:
+            ROUTE_ERRORS.inc(router=self.router, route=self.key)
+            raise
+        finally:
+            ROUTE_DURATION.observe(time.perf_counter() - started, router=self.router, route=self.key)
+
+_VALUE = object()
+
+class PrefixTrie:
+    """Префиксное дерево по символам: поиск самого длинного префикса строки"""
+    
+    def __init__(self):
+        self._root = {}
+        self._size = 0
+    
+    def insert(self, prefix, value):
+        node = self._root
+        for char in prefix:
+            node = node.setdefault(char, {})
+        if _VALUE not in node:
+            self._size += 1
+        node[_VALUE] = value
+    
+    def longest_match(self, text):
+        """Значение самого длинного префикса text или None"""
+        node = self._root
+        found = node.get(_VALUE)
+        for char in text:
+            node = node.get(char)
+            if node is None:
+                break
+            found = node.get(_VALUE, found)
+        return found
+    
+    def values(self):
+        stack = [self._root]
+        while stack:
+            node = stack.pop()
+            for key, child in node.items():
+                if key is _VALUE:
+                    yield child
+                else:
+                    stack.append(child)
+    
+    def __len__(self):
+        return self._size
+
+class Router:
+    """Маршруты одного уровня: точные совпадения и префиксы.
+    
+    Точное совпадение проверяется словарем, префикс - деревом, поэтому
+    поиск не зависит от числа маршрутов. Из нескольких подходящих
+    префиксов выбирается самый длинный.
+    """
+    
+    def __init__(self, name):
+        self.name = name
+        self._exact = {}
+        self._prefixes = PrefixTrie()
+    
+    def add(self, keys, handler):
+        """Маршрут для точного значения (или нескольких)"""
+        for key in ([keys] if isinstance(keys, str) else keys):
+            self._exact[key] = Route(self.name, 'exact', key, handler)
+        return handler
+    
+    def add_prefix(self, prefixes, handler):
+        """Маршрут для значений, начинающихся с префикса (или нескольких)"""
+        for prefix in ([prefixes] if isinstance(prefixes, str) else prefixes):
+            self._prefixes.insert(prefix, Route(self.name, 'prefix', prefix, handler))
+        return handler
+    
+    def resolve(self, key):
+        """Маршрут для значения или None"""
+        if key is None:
+            return None
+        route = self._exact.get(key)
+        if route is None:
+            route = self._prefixes.longest_match(key)
+        return route
+    
+    def routes(self):
+        """Все маршруты уровня"""
+        return list(self._exact.values()) + sorted(self._prefixes.values(), key=lambda route: route.key)
+    
+    def __len__(self):
+        return len(self._exact) + len(self._prefixes)
+
+def handler_name(handler):
+    """Читаемое имя обработчика для таблицы маршрутов"""
+    return getattr(handler, '__qualname__', None) or repr(handler)
+
+class RouteTable:
+    """Именованные уровни маршрутизации бота.
+    
+    Модули (админка, AI, CRM) добавляют свои маршруты через router(name),
+    а describe() показывает всю таблицу целиком.
+    """
+    
+    def __init__(self):
+        self._routers = {}
+    
+    def router(self, name):
+        """Уровень маршрутов по имени, создается при первом обращении"""
+        router = self._routers.get(name)
+        if router is None:
+            router = Router(name)
+            self._routers[name] = router
+        return router
+    
+    def attach(self, router):
+        """Подключение уровня, созданного другим модулем"""
+        self._routers[router.name] = router
+        return router
+    
+    def describe(self):
+        """Таблица маршрутов для просмотра и отладки"""
+        return [
+            {
+                'router': name,
+                'kind': route.kind,
+                'key': route.key,
+                'handler': handler_name(route.handler)
+            }
+            for name, router in self._routers.items()
+            for route in router.routes()
+        ]
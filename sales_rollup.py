@@ -0,0 +1,125 @@
+"""
+Дневные итоги продаж по заказам, товарам и категориям
+"""
+
+import threading
+from logger import logger
+
+# Позиции заказов одного дня; сумма позиций заказа нужна для
+# распределения скидки промокода по товарам пропорционально выручке
+DAY_ITEMS = '''
+WITH items AS (
+    SELECT o.id AS order_id, o.created_day AS day, o.status, o.user_id,
+           COALESCE(o.promo_discount, 0) AS promo_discount,
+           oi.product_id, p.category_id, oi.quantity, oi.price, p.cost_price,
+           SUM(oi.quantity * oi.price) OVER (PARTITION BY o.id) AS order_items_total
+    FROM orders o
+    JOIN order_items oi ON oi.order_id = o.id
+    LEFT JOIN products p ON p.id = oi.product_id
+    WHERE o.created_day = ?
+)
+'''
+
+ITEM_TOTALS = '''
+    COUNT(DISTINCT order_id), COUNT(DISTINCT user_id),
+    COALESCE(SUM(quantity), 0), COALESCE(SUM(quantity * price), 0),
+    COALESCE(SUM(quantity * cost_price), 0),
+    COALESCE(SUM(promo_discount * quantity * price / NULLIF(order_items_total, 0)), 0)
+'''
+
+class SalesRollup:
+    """Дневные итоги продаж, пересчитываемые по измененным дням.
+    
+    Триггеры на orders и order_items записывают день заказа в
+    sales_rollup_dirty. refresh() пересчитывает только эти дни, поэтому
+    отчет за любой период - сумма по нескольким сотням строк итогов,
+    а обновление после смены статуса заказа стоит одного дня.
+    Себестоимость фиксируется по cost_price товара на момент пересчета дня.
+    """
+    
+    def __init__(self, db):
+        self.db = db
+        self._lock = threading.Lock()
+    
+    def refresh(self):
+        """Пересчет отмеченных дней; возвращает число пересчитанных дней"""
+        if not self.db.execute_query('SELECT 1 FROM sales_rollup_dirty LIMIT 1'):
+            return 0
+        
+        with self._lock:
+            try:
+                with self.db.transaction():
+                    days = [row[0] for row in self.db.execute_query('SELECT day FROM sales_rollup_dirty ORDER BY day') or []]
+                    for day in days:
+                        self._rebuild_day(day)
+                    self.db.execute_query('DELETE FROM sales_rollup_dirty')
+            except Exception as e:
+                logger.error(f"Ошибка пересчета итогов продаж: {e}")
+                return 0
+        
+        if days:
+            logger.info(f"Итоги продаж пересчитаны: {len(days)} дн. ({days[0]} - {days[-1]})")
+        return len(days)
+    
+    def _rebuild_day(self, day):
+        """Итоги одного дня; вызывается в транзакции"""
+        for table in ('sales_daily', 'sales_daily_products', 'sales_daily_categories'):
+            self.db.execute_query(f'DELETE FROM {table} WHERE day = ?', (day,))
+        
+        self.db.execute_query('''
+            INSERT INTO sales_daily (
+                day, status, payment_status, orders, customers,
+                units, revenue, cogs, discounts, delivery
+            )
+            SELECT o.created_day, o.status, o.payment_status, COUNT(*), COUNT(DISTINCT o.user_id),
+                   COALESCE(SUM(i.units), 0), COALESCE(SUM(o.total_amount), 0),
+                   COALESCE(SUM(i.cogs), 0), COALESCE(SUM(o.promo_discount), 0),
+                   COALESCE(SUM(o.delivery_cost), 0)
+            FROM orders o
+            LEFT JOIN (
+                SELECT oi.order_id, SUM(oi.quantity) AS units, SUM(oi.quantity * p.cost_price) AS cogs
+                FROM orders d
+                JOIN order_items oi ON oi.order_id = d.id
+                LEFT JOIN products p ON p.id = oi.product_id
+                WHERE d.created_day = ?
+                GROUP BY oi.order_id
+            ) i ON i.order_id = o.id
+            WHERE o.created_day = ?
+            GROUP BY o.status, o.payment_status
+        ''', (day, day))
+        
+        self.db.execute_query(f'''
+            {DAY_ITEMS}
+            INSERT INTO sales_daily_products (
+                day, product_id, status, orders, customers, units, revenue, cogs, discounts
+            )
+            SELECT day, product_id, status, {ITEM_TOTALS}
+            FROM items
+            GROUP BY product_id, status
+        ''', (day,))
+        
+        self.db.execute_query(f'''
+            {DAY_ITEMS}
+            INSERT INTO sales_daily_categories (
+                day, category_id, status, orders, customers, units, revenue, cogs, discounts
+            )
+            SELECT day, category_id, status, {ITEM_TOTALS}
+            FROM items
+            GROUP BY category_id, status
+        ''', (day,))
+    
+    def rebuild(self, start_date=None, end_date=None):
+        """Полный пересчет итогов за период (или за всю историю)"""
+        start_date = start_date or '0000-01-01'
+        end_date = end_date or '9999-12-31'
+        
+        with self.db.transaction():
+            # Дни с заказами и дни, по которым итоги уже есть (заказы могли удалить)
+            self.db.execute_query('''
+                INSERT OR IGNORE INTO sales_rollup_dirty (day)
+                SELECT DISTINCT created_day FROM orders WHERE created_day BETWEEN ? AND ?
+                UNION
+                SELECT DISTINCT day FROM sales_daily WHERE day BETWEEN ? AND ?
+            ''', (start_date, end_date, start_date, end_date))
+        
+        return self.refresh()
@@ -5,6 +5,7 @@
 import threading
 import time
 from logger import logger
+from metrics import track_job
 
 # Простой планировщик без внешних зависимостей
 class SimpleScheduler:
@@ -23,7 +24,8 @@ class SimpleScheduler:
         for job in self.jobs:
             if job.should_run(current_time, current_date):
                 try:
-                    job.run()
+                    with track_job(f"scheduled_{getattr(job.job_func, '__name__', 'job')}"):
+                        job.run()
                 except Exception as e:
                     print(f"Ошибка выполнения задачи: {e}")
     
@@ -0,0 +1,242 @@
+"""
+Исправление опечаток в поиске: словарь удалений (SymSpell) по каталогу и запросам
+"""
+
+import re
+import threading
+import time
+from config import SPELLING_CONFIG, DATABASE_CONFIG
+from logger import logger
+
+WORD = re.compile(r'\w+')
+
+# Слова короче не исправляются
+MIN_WORD = 3
+
+def normalize(text):
+    """Нижний регистр, ё сводится к е"""
+    return text.lower().replace('ё', 'е')
+
+def words(text):
+    """Слова текста без чисел и артикулов"""
+    return [word for word in WORD.findall(normalize(text)) if not any(char.isdigit() for char in word)]
+
+def edit_distance(source, target, limit):
+    """Расстояние Дамерау-Левенштейна (с перестановкой соседних букв);
+    больше limit - возвращается limit + 1
+    """
+    if abs(len(source) - len(target)) > limit:
+        return limit + 1
+    
+    previous = None
+    row = list(range(len(target) + 1))
+    for i in range(1, len(source) + 1):
+        current = [i] + [0] * len(target)
+        best = i
+        for j in range(1, len(target) + 1):
+            cost = 0 if source[i - 1] == target[j - 1] else 1
+            value = min(row[j] + 1, current[j - 1] + 1, row[j - 1] + cost)
+            if (previous is not None and j > 1 and source[i - 1] == target[j - 2]
+                    and source[i - 2] == target[j - 1]):
+                value = min(value, previous[j - 2] + 1)
+            current[j] = value
+            best = min(best, value)
+        if best > limit:
+            return limit + 1
+        previous, row = row, current
+    return row[-1] if row[-1] <= limit else limit + 1
+
+class SpellIndex:
+    """Словарь удалений: каждое слово и все его варианты без 1..max_distance
+    букв (по первым prefix_length буквам) указывают на само слово.
+    
+    Кандидаты для слова с опечаткой - слова, чьи удаления совпадают с
+    удалениями запроса; проверяется только их расстояние, поэтому поиск
+    не зависит от размера словаря.
+    """
+    
+    def __init__(self, frequencies, max_distance=2, prefix_length=7):
+        self.frequencies = dict(frequencies)
+        self.max_distance = max_distance
+        self.prefix_length = prefix_length
+        self.deletes = {}
+        for word in self.frequencies:
+            for variant in self._deletes(word, max_distance):
+                self.deletes.setdefault(variant, []).append(word)
+    
+    def _deletes(self, word, distance):
+        """Слово (его префикс) и варианты без 1..distance букв"""
+        prefix = word[:self.prefix_length]
+        variants = {prefix}
+        edge = [prefix]
+        for _ in range(distance):
+            following = []
+            for variant in edge:
+                if len(variant) <= 1:
+                    continue
+                for index in range(len(variant)):
+                    shorter = variant[:index] + variant[index + 1:]
+                    if shorter not in variants:
+                        variants.add(shorter)
+                        following.append(shorter)
+            edge = following
+        return variants
+    
+    def allowed_distance(self, word):
+        """Допустимое число правок для слова"""
+        if len(word) < MIN_WORD:
+            return 0
+        if len(word) <= 5:
+            return min(1, self.max_distance)
+        return self.max_distance
+    
+    def lookup(self, word, limit=3):
+        """Варианты слова [(слово, расстояние, частота)]: ближе и чаще - первыми.
+        Известное слово возвращается само с расстоянием 0.
+        """
+        word = normalize(word)
+        if word in self.frequencies:
+            return [(word, 0, self.frequencies[word])]
+        
+        distance = self.allowed_distance(word)
+        if not distance:
+            return []
+        
+        found = {}
+        for variant in self._deletes(word, distance):
+            for candidate in self.deletes.get(variant, ()):
+                if candidate not in found:
+                    found[candidate] = edit_distance(word, candidate, distance)
+        
+        ranked = sorted(
+            (candidate_distance, -self.frequencies[candidate], candidate)
+            for candidate, candidate_distance in found.items()
+            if candidate_distance <= distance
+        )
+        return [(candidate, candidate_distance, -frequency) for candidate_distance, frequency, candidate in ranked[:limit]]
+    
+    def correct(self, text):
+        """Текст с лучшей заменой каждого неизвестного слова"""
+        def replace(match):
+            candidates = self.lookup(match.group(0), limit=1)
+            return candidates[0][0] if candidates else match.group(0)
+        return WORD.sub(replace, normalize(text))
+    
+    def suggest(self, text, limit=3):
+        """Исправленные варианты запроса для "возможно, вы имели в виду".
+        
+        Первый - лучшая замена каждого слова; следующие меняют одно слово
+        на его следующий вариант. Порядок - по сумме правок, затем по
+        частоте заменяющего слова. Пусто, если исправлять нечего.
+        """
+        text = normalize(text)
+        matches = list(WORD.finditer(text))
+        options = []
+        for match in matches:
+            candidates = self.lookup(match.group(0), limit=limit)
+            options.append(candidates if candidates else [(match.group(0), 0, 0)])
+        
+        if all(candidates[0][1] == 0 for candidates in options):
+            return []
+        
+        def build(choice):
+            parts, end = [], 0
+            for match, word in zip(matches, choice):
+                parts.append(text[end:match.start()])
+                parts.append(word)
+                end = match.end()
+            parts.append(text[end:])
+            return ''.join(parts)
+        
+        best = [candidates[0] for candidates in options]
+        variants = [(sum(item[1] for item in best), 0, build([item[0] for item in best]))]
+        for position, candidates in enumerate(options):
+            for candidate in candidates[1:]:
+                choice = [item[0] for item in best]
+                choice[position] = candidate[0]
+                total = sum(item[1] for item in best) - best[position][1] + candidate[1]
+                variants.append((total, -candidate[2], build(choice)))
+        
+        suggestions = []
+        for _, _, variant in sorted(variants, key=lambda item: (item[0], item[1])):
+            if variant != text and variant not in suggestions:
+                suggestions.append(variant)
+        return suggestions[:limit]
+
+class SpellChecker:
+    """Словарь опечаток магазина, перестраиваемый при смене версии каталога.
+    
+    Частоты слов - число упоминаний в названиях и брендах активных товаров
+    и в названиях категорий и подкатегорий плюс число поисковых запросов
+    из user_activity_logs, повторенных не меньше min_query_count раз
+    (единичные запросы сами бывают с опечатками). Версия каталога
+    проверяется не чаще catalog_check_interval, как в CatalogCache.
+    """
+    
+    def __init__(self, db, config=None):
+        self.db = db
+        self.config = config or SPELLING_CONFIG
+        self.check_interval = DATABASE_CONFIG['catalog_check_interval']
+        self._index = None
+        self._version = None
+        self._checked_at = 0
+        self._lock = threading.Lock()
+    
+    def index(self):
+        """Актуальный словарь"""
+        index = self._index
+        if index is not None and time.monotonic() - self._checked_at < self.check_interval:
+            return index
+        
+        with self._lock:
+            if self._index is not None and time.monotonic() - self._checked_at < self.check_interval:
+                return self._index
+            
+            version = self.db.get_catalog_version()
+            if self._index is None or self._version != version:
+                self._index = self._build()
+                self._version = version
+            self._checked_at = time.monotonic()
+            return self._index
+    
+    def _build(self):
+        """Сбор частот слов и построение словаря удалений"""
+        started = time.perf_counter()
+        frequencies = {}
+        
+        def add(text, count=1):
+            for word in words(text or ''):
+                frequencies[word] = frequencies.get(word, 0) + count
+        
+        for name, brand in self.db.execute_query(
+            'SELECT name, brand FROM products WHERE is_active = 1'
+        ) or []:
+            add(name)
+            add(brand)
+        for table in ('categories', 'subcategories'):
+            for (name,) in self.db.execute_query(f'SELECT name FROM {table} WHERE is_active = 1') or []:
+                add(name)
+        for search_query, count in self.db.execute_query('''
+            SELECT search_query, COUNT(*)
+            FROM user_activity_logs
+            WHERE action = 'search' AND created_at >= datetime('now', ?) AND search_query IS NOT NULL
+            GROUP BY search_query
+            HAVING COUNT(*) >= ?
+        ''', (f"-{self.config['query_log_days']} days", self.config['min_query_count'])) or []:
+            add(search_query, count)
+        
+        index = SpellIndex(frequencies, self.config['max_edit_distance'], self.config['prefix_length'])
+        logger.performance('spell_index_build', time.perf_counter() - started, f"{len(frequencies)} слов")
+        return index
+    
+    def lookup(self, word, limit=3):
+        """Ранжированные варианты слова"""
+        return self.index().lookup(word, limit)
+    
+    def correct(self, text):
+        """Запрос с исправленными словами"""
+        return self.index().correct(text)
+    
+    def suggest(self, text, limit=3):
+        """Варианты "возможно, вы имели в виду" для запроса"""
+        return self.index().suggest(text, limit)
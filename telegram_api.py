@@ -0,0 +1,403 @@
+"""
+HTTP-клиент Telegram Bot API с постоянными соединениями
+"""
+
+import heapq
+import http.client
+import itertools
+import json
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import deque
+from config import BOT_CONFIG
+from logger import logger
+from metrics import registry
+
+API_HOST = 'api.telegram.org'
+
+API_DURATION = registry.histogram(
+    'bot_telegram_api_duration_seconds',
+    'Время вызова Bot API по методу и статусу',
+    ['method', 'status']
+)
+RATE_LIMIT_WAIT = registry.histogram(
+    'bot_telegram_rate_limit_wait_seconds',
+    'Ожидание ограничителя скорости перед отправкой'
+)
+
+# Таймаут загрузки файлов, сек
+UPLOAD_TIMEOUT = 300
+
+# Методы, которые отправляют сообщения в чат и попадают под лимиты Telegram
+RATE_LIMITED_PREFIXES = ('send', 'forward', 'copy')
+
+class MultipartFile:
+    """Тело multipart/form-data с файлом, читаемым блоками.
+    
+    Объект можно перебирать повторно (файл открывается заново), поэтому
+    запрос повторяется на новом соединении так же, как JSON тело.
+    """
+    
+    BLOCK_SIZE = 64 * 1024
+    
+    def __init__(self, fields, file_field, file_path, filename=None):
+        self.file_path = file_path
+        self.boundary = uuid.uuid4().hex
+        self.content_type = f'multipart/form-data; boundary={self.boundary}'
+        
+        head = []
+        for name, value in fields.items():
+            head.append(
+                f'--{self.boundary}\r\n'
+                f'Content-Disposition: form-data; name="{name}"\r\n\r\n'
+                f'{value}\r\n'
+            )
+        filename = (filename or os.path.basename(file_path)).replace('"', '')
+        head.append(
+            f'--{self.boundary}\r\n'
+            f'Content-Disposition: form-data; name="{file_field}"; filename="{filename}"\r\n'
+            f'Content-Type: application/octet-stream\r\n\r\n'
+        )
+        self.head = ''.join(head).encode('utf-8')
+        self.tail = f'\r\n--{self.boundary}--\r\n'.encode('utf-8')
+    
+    def __len__(self):
+        return len(self.head) + os.path.getsize(self.file_path) + len(self.tail)
+    
+    def __iter__(self):
+        yield self.head
+        with open(self.file_path, 'rb') as file:
+            while True:
+                block = file.read(self.BLOCK_SIZE)
+                if not block:
+                    break
+                yield block
+        yield self.tail
+
+class TokenBucket:
+    """Ведро токенов: rate токенов в секунду, не больше capacity подряд"""
+    
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+    
+    def _refill(self, now):
+        elapsed = now - self.updated
+        if elapsed > 0:
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+            self.updated = now
+    
+    def wait_time(self, now):
+        """Сколько секунд ждать до следующего токена"""
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
+    
+    def consume(self):
+        self.tokens -= 1
+    
+    def drain(self):
+        self.tokens = 0
+    
+    def is_idle(self, now):
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+class SendRateLimiter:
+    """Ограничитель исходящих сообщений Bot API.
+    
+    Общее ведро держит лимит бота (30 сообщений в секунду), ведра
+    отдельных чатов - лимиты личного чата и группы. Ответ 429 блокирует
+    чат на retry_after секунд; общий поток тормозит, только если лимит
+    общий: 429 без чата или сразу в нескольких чатах за GLOBAL_WINDOW.
+    """
+    
+    MAX_CHAT_BUCKETS = 10000
+    
+    # Ответы 429 из стольких разных чатов за окно (сек) - общий лимит бота
+    GLOBAL_PENALTY_CHATS = 3
+    GLOBAL_WINDOW = 1.0
+    
+    def __init__(self, global_per_second=30, chat_per_second=1,
+                 group_per_minute=20, burst=3):
+        self.global_bucket = TokenBucket(global_per_second, global_per_second)
+        self.chat_per_second = chat_per_second
+        self.group_per_second = group_per_minute / 60
+        self.burst = burst
+        self.chat_buckets = {}
+        self.blocked_until = {}
+        self.recent_penalties = deque()
+        self.lock = threading.Lock()
+    
+    @staticmethod
+    def is_group_chat(chat_id):
+        """Группы и каналы имеют отрицательный id или @username"""
+        if isinstance(chat_id, str):
+            return chat_id.startswith(('@', '-'))
+        return chat_id < 0
+    
+    def _chat_bucket(self, chat_id, now):
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self.chat_buckets) >= self.MAX_CHAT_BUCKETS:
+                self._prune(now)
+            rate = self.group_per_second if self.is_group_chat(chat_id) else self.chat_per_second
+            bucket = TokenBucket(rate, self.burst)
+            self.chat_buckets[chat_id] = bucket
+        return bucket
+    
+    def _prune(self, now):
+        """Удаление ведер чатов, которые давно ничего не отправляли"""
+        for chat_id, bucket in list(self.chat_buckets.items()):
+            if bucket.is_idle(now) and self.blocked_until.get(chat_id, 0) <= now:
+                del self.chat_buckets[chat_id]
+                self.blocked_until.pop(chat_id, None)
+    
+    def acquire(self, chat_id):
+        """Ожидание разрешения на отправку в чат"""
+        with RATE_LIMIT_WAIT.time():
+            self._acquire(chat_id)
+    
+    def _acquire(self, chat_id):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                bucket = self._chat_bucket(chat_id, now)
+                wait = max(
+                    self.global_bucket.wait_time(now),
+                    bucket.wait_time(now),
+                    self.blocked_until.get(chat_id, 0) - now
+                )
+                if wait <= 0:
+                    self.global_bucket.consume()
+                    bucket.consume()
+                    return
+            time.sleep(wait)
+    
+    def penalize(self, chat_id, retry_after):
+        """Учет ответа 429: чат ждет retry_after; общий поток - только при общем лимите"""
+        with self.lock:
+            now = time.monotonic()
+            if chat_id is None or self._is_global_limit(chat_id, now):
+                self.global_bucket.drain()
+            if chat_id is not None:
+                self.blocked_until[chat_id] = max(self.blocked_until.get(chat_id, 0), now + retry_after)
+                self._chat_bucket(chat_id, now).drain()
+    
+    def _is_global_limit(self, chat_id, now):
+        """429 сразу в нескольких чатах - лимит рассылки, а не одного чата"""
+        self.recent_penalties.append((now, chat_id))
+        while self.recent_penalties[0][0] < now - self.GLOBAL_WINDOW:
+            self.recent_penalties.popleft()
+        chats = {penalized for _, penalized in self.recent_penalties}
+        return len(chats) >= self.GLOBAL_PENALTY_CHATS
+
+class DeferredSends:
+    """Отправки, отложенные после ответа 429.
+    
+    Запрос лежит в куче до not_before = время ответа + retry_after и
+    уходит из отдельного потока, поэтому поток обработчика или цикл
+    рассылки не ждет, пока Telegram снимет ограничение с одного чата.
+    """
+    
+    def __init__(self, client):
+        self.client = client
+        self._heap = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._thread = None
+    
+    def put(self, not_before, method, chat_id, body, headers, timeout, attempt):
+        """Постановка запроса на повтор не раньше not_before (time.monotonic)"""
+        with self._condition:
+            heapq.heappush(self._heap, (
+                not_before, next(self._sequence), (method, chat_id, body, headers, timeout, attempt)
+            ))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._worker, name='telegram-deferred', daemon=True)
+                self._thread.start()
+            self._condition.notify()
+    
+    def size(self):
+        with self._condition:
+            return len(self._heap)
+    
+    def _take(self):
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                if self._heap and self._heap[0][0] <= now:
+                    return heapq.heappop(self._heap)[2]
+                self._condition.wait(self._heap[0][0] - now if self._heap else None)
+    
+    def _worker(self):
+        while True:
+            method, chat_id, body, headers, timeout, attempt = self._take()
+            try:
+                result = self.client._call(method, chat_id, body, headers, timeout, requeue=True, attempt=attempt)
+                if not result.get('ok'):
+                    logger.error(f"Отложенная отправка в чат {chat_id} не удалась: {result}")
+            except Exception as e:
+                logger.error(f"Ошибка отложенной отправки в чат {chat_id}: {e}")
+
+class TelegramAPIClient:
+    """Клиент Bot API с пулом keep-alive соединений.
+    
+    Каждое соединение переживает много запросов, поэтому TCP и TLS
+    рукопожатие выполняется один раз, а не на каждое сообщение.
+    """
+    
+    def __init__(self, token, pool_size=8, timeout=30, rate_limiter=None, max_retries=3):
+        self.token = token
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.rate_limiter = rate_limiter
+        self.max_retries = max_retries
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(pool_size)
+        self.deferred = DeferredSends(self)
+    
+    def _connect(self):
+        """Новое HTTPS соединение с API"""
+        return http.client.HTTPSConnection(API_HOST, timeout=self.timeout)
+    
+    def _acquire(self):
+        """Соединение из пула"""
+        self._slots.acquire()
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return self._connect()
+    
+    def _release(self, conn, broken=False):
+        """Возврат соединения в пул"""
+        if broken:
+            conn.close()
+        else:
+            self._idle.put(conn)
+        self._slots.release()
+    
+    def call(self, method, payload=None, timeout=None, requeue=False):
+        """Вызов метода Bot API с JSON телом запроса.
+        
+        Отправка сообщений проходит через ограничитель скорости. После
+        ответа 429 запрос с requeue=True откладывается в DeferredSends и
+        сразу возвращается {'ok': True, 'result': None, 'deferred': True} -
+        для отправок, которым не нужен ответ; без requeue повтор ждет
+        retry_after в текущем потоке.
+        Возвращает разобранный ответ Telegram (в том числе с ok=False
+        для ошибок API) или выбрасывает исключение при сетевой ошибке.
+        """
+        body = json.dumps(payload or {}, ensure_ascii=False).encode('utf-8')
+        headers = {'Content-Type': 'application/json'}
+        return self._call(method, (payload or {}).get('chat_id'), body, headers, timeout, requeue)
+    
+    def send_document(self, chat_id, file_path, filename=None, caption=None, timeout=None):
+        """Загрузка файла методом sendDocument.
+        
+        Файл читается с диска блоками во время отправки, поэтому
+        размер выгрузки не влияет на расход памяти.
+        """
+        fields = {'chat_id': chat_id}
+        if caption:
+            fields['caption'] = caption
+            fields['parse_mode'] = 'HTML'
+        body = MultipartFile(fields, 'document', file_path, filename)
+        headers = {
+            'Content-Type': body.content_type,
+            'Content-Length': str(len(body))
+        }
+        return self._call('sendDocument', chat_id, body, headers, timeout or UPLOAD_TIMEOUT)
+    
+    def _call(self, method, chat_id, body, headers, timeout=None, requeue=False, attempt=0):
+        """Запрос с ограничением скорости и повтором после 429"""
+        if self.rate_limiter is None or chat_id is None or not method.startswith(RATE_LIMITED_PREFIXES):
+            return self._request(method, body, headers, timeout)
+        
+        while True:
+            self.rate_limiter.acquire(chat_id)
+            result = self._request(method, body, headers, timeout)
+            if result.get('error_code') != 429 or attempt >= self.max_retries:
+                return result
+            retry_after = (result.get('parameters') or {}).get('retry_after', 1)
+            logger.warning(f"Bot API 429 для чата {chat_id}: повтор через {retry_after}с")
+            self.rate_limiter.penalize(chat_id, retry_after)
+            attempt += 1
+            
+            if requeue:
+                self.deferred.put(time.monotonic() + retry_after, method, chat_id, body, headers, timeout, attempt)
+                return {'ok': True, 'result': None, 'deferred': True}
+    
+    def _request(self, method, body, headers, timeout=None):
+        """Один HTTP запрос к Bot API с замером времени"""
+        started = time.perf_counter()
+        status = 'network_error'
+        try:
+            result = self._send(method, body, headers, timeout)
+            status = 'ok' if result.get('ok') else str(result.get('error_code', 'error'))
+            return result
+        finally:
+            API_DURATION.observe(time.perf_counter() - started, method=method, status=status)
+    
+    def _send(self, method, body, headers, timeout=None):
+        """Отправка запроса по соединению из пула"""
+        headers = dict(headers, Connection='keep-alive')
+        path = f"/bot{self.token}/{method}"
+        
+        # Сервер мог закрыть простаивающее соединение - повторяем один раз на свежем
+        for attempt in range(2):
+            conn = self._acquire()
+            broken = True
+            try:
+                conn.timeout = timeout or self.timeout
+                if conn.sock is not None:
+                    conn.sock.settimeout(conn.timeout)
+                conn.request('POST', path, body=body, headers=headers)
+                response = conn.getresponse()
+                data = response.read()
+                broken = response.will_close
+                return json.loads(data.decode('utf-8'))
+            except (http.client.RemoteDisconnected, http.client.CannotSendRequest,
+                    ConnectionResetError, BrokenPipeError):
+                if attempt == 1:
+                    raise
+            finally:
+                self._release(conn, broken=broken)
+    
+    def close(self):
+        """Закрытие всех соединений"""
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+def get_api_client(token):
+    """Общий клиент Bot API для токена"""
+    with _clients_lock:
+        client = _clients.get(token)
+        if client is None:
+            limits = BOT_CONFIG['rate_limits']
+            client = TelegramAPIClient(
+                token,
+                pool_size=BOT_CONFIG['api_pool_size'],
+                timeout=BOT_CONFIG['request_timeout'],
+                rate_limiter=SendRateLimiter(
+                    global_per_second=limits['global_per_second'],
+                    chat_per_second=limits['chat_per_second'],
+                    group_per_minute=limits['group_per_minute'],
+                    burst=limits['burst']
+                ),
+                max_retries=limits['max_retries']
+            )
+            _clients[token] = client
+        return client
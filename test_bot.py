@@ -86,6 +86,75 @@ def test_admin_config():
         print(f"❌ Неверный формат ADMIN_TELEGRAM_ID: {admin_id}")
         return False
 
+def test_item_similarity_incremental():
+    """Инкрементальное обновление похожих товаров совпадает с полным построением"""
+    print("\n🔁 Проверка модели похожих товаров...")
+    
+    import random
+    import tempfile
+    from database import DatabaseManager
+    
+    db = DatabaseManager(os.path.join(tempfile.mkdtemp(), 'similarity.db'))
+    similarity = db.item_similarity
+    similarity.config = dict(similarity.config, neighbours=3)
+    
+    category_id = db.execute_query("INSERT INTO categories (name) VALUES ('Тест')")
+    products = [
+        db.execute_query(
+            'INSERT INTO products (name, category_id, price, stock) VALUES (?, ?, 10, 1000)',
+            (f'Товар {index}', category_id)
+        )
+        for index in range(12)
+    ]
+    users = [
+        db.execute_query(
+            'INSERT INTO users (telegram_id, name, is_admin) VALUES (?, ?, 0)',
+            (900000 + index, f'Покупатель {index}')
+        )
+        for index in range(10)
+    ]
+    
+    # Заказы, отмены и повторные заказы, после каждого шага - обновление
+    random.seed(21)
+    orders = []
+    for step in range(60):
+        action = random.random()
+        if orders and action < 0.25:
+            db.execute_query("UPDATE orders SET status = 'cancelled' WHERE id = ?", (random.choice(orders),))
+        elif orders and action < 0.4:
+            db.execute_query("UPDATE orders SET status = 'pending' WHERE id = ?", (random.choice(orders),))
+        else:
+            order_id = db.execute_query(
+                "INSERT INTO orders (user_id, total_amount, status) VALUES (?, 10, 'pending')",
+                (random.choice(users),)
+            )
+            for product_id in random.sample(products, random.randint(1, 4)):
+                db.execute_query(
+                    'INSERT INTO order_items (order_id, product_id, quantity, price) VALUES (?, ?, 1, 10)',
+                    (order_id, product_id)
+                )
+            orders.append(order_id)
+        similarity.refresh()
+    
+    tables = {
+        'product_buyers': 'product_id, buyers',
+        'product_pairs': 'product_id, other_id, users',
+        'product_similarity': 'product_id, similar_id, ROUND(score, 9), co_purchases'
+    }
+    
+    def snapshot():
+        return {table: sorted(db.execute_query(f'SELECT {columns} FROM {table}') or [])
+                for table, columns in tables.items()}
+    
+    incremental = snapshot()
+    similarity.rebuild()
+    rebuilt = snapshot()
+    
+    for table in tables:
+        assert incremental[table] == rebuilt[table], f"{table} расходится с полным построением"
+        print(f"✅ {table}: {len(rebuilt[table])} строк совпадают")
+    return True
+
 def fix_common_issues():
     """Исправление частых проблем"""
     print("\n🔧 Исправление частых проблем...")
@@ -0,0 +1,176 @@
+"""
+Конвейер обработки обновлений Telegram
+"""
+
+import hmac
+import json
+import queue
+import secrets
+import ssl
+import threading
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+from logger import logger
+
+def get_update_chat_id(update):
+    """Определение чата, к которому относится обновление"""
+    if 'message' in update:
+        return update['message']['chat']['id']
+    if 'edited_message' in update:
+        return update['edited_message']['chat']['id']
+    if 'callback_query' in update:
+        callback_query = update['callback_query']
+        if callback_query.get('message'):
+            return callback_query['message']['chat']['id']
+        return callback_query['from']['id']
+    return update.get('update_id', 0)
+
+class UpdateDispatcher:
+    """Пул обработчиков обновлений, разделенный по chat_id.
+    
+    Обновления одного чата всегда попадают в одну и ту же очередь, поэтому
+    для каждого пользователя порядок сохраняется, а разные пользователи
+    обрабатываются параллельно и не ждут самый медленный обработчик.
+    """
+    
+    def __init__(self, handler, workers=4, queue_size=1000):
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.queues = [queue.Queue(maxsize=queue_size) for _ in range(self.workers)]
+        self.threads = []
+        self.running = False
+    
+    def start(self):
+        """Запуск обработчиков"""
+        self.running = True
+        for index, update_queue in enumerate(self.queues):
+            thread = threading.Thread(
+                target=self._worker,
+                args=(update_queue,),
+                name=f'update-worker-{index}',
+                daemon=True
+            )
+            thread.start()
+            self.threads.append(thread)
+        logger.info(f"Запущено обработчиков обновлений: {self.workers}")
+    
+    def _partition(self, chat_id):
+        """Номер очереди для чата"""
+        return zlib.crc32(str(chat_id).encode()) % self.workers
+    
+    def submit(self, update):
+        """Постановка обновления в очередь его чата.
+        
+        Если очередь заполнена, вызов блокируется - так поллер
+        притормаживает, а не копит обновления в памяти.
+        """
+        chat_id = get_update_chat_id(update)
+        self.queues[self._partition(chat_id)].put(update)
+    
+    def _worker(self, update_queue):
+        """Цикл обработчика одной очереди"""
+        while True:
+            update = update_queue.get()
+            try:
+                if update is None:
+                    return
+                self.handler(update)
+            except Exception as e:
+                logger.error(f"Ошибка обработки обновления: {e}", exc_info=True)
+            finally:
+                update_queue.task_done()
+    
+    def get_queue_sizes(self):
+        """Размеры очередей обработчиков"""
+        return [update_queue.qsize() for update_queue in self.queues]
+    
+    def stop(self, timeout=10):
+        """Остановка после обработки уже принятых обновлений"""
+        if not self.running:
+            return
+        self.running = False
+        for update_queue in self.queues:
+            update_queue.put(None)
+        for thread in self.threads:
+            thread.join(timeout)
+        self.threads = []
+
+class WebhookReceiver:
+    """HTTP сервер для приема обновлений через webhook.
+    
+    Запрос проверяется по заголовку X-Telegram-Bot-Api-Secret-Token,
+    Telegram сразу получает 200, а обновление уходит в тот же
+    UpdateDispatcher, что и при long polling. Без заданного секрета
+    генерируется случайный - его нужно передать в setWebhook.
+    """
+    
+    def __init__(self, dispatcher, webhook_url, secret=None, host='0.0.0.0', port=8443,
+                 certfile=None, keyfile=None):
+        self.dispatcher = dispatcher
+        self.path = urlparse(webhook_url).path or '/'
+        self.secret = secret or secrets.token_urlsafe(32)
+        self.host = host
+        self.port = port
+        self.certfile = certfile
+        self.keyfile = keyfile
+        self.server = None
+        self.thread = None
+    
+    def _make_handler(self):
+        receiver = self
+        
+        class TelegramWebhookHandler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                if self.path != receiver.path:
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+                
+                token = self.headers.get('X-Telegram-Bot-Api-Secret-Token', '')
+                if not hmac.compare_digest(token.encode(), receiver.secret.encode()):
+                    logger.warning(f"Webhook: неверный секрет от {self.client_address[0]}")
+                    self.send_response(403)
+                    self.end_headers()
+                    return
+                
+                try:
+                    length = int(self.headers.get('Content-Length', 0))
+                    update = json.loads(self.rfile.read(length).decode('utf-8'))
+                except (ValueError, UnicodeDecodeError):
+                    self.send_response(400)
+                    self.end_headers()
+                    return
+                
+                # Отвечаем до обработки, чтобы Telegram не ждал и не повторял запрос
+                self.send_response(200)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                self.wfile.flush()
+                
+                receiver.dispatcher.submit(update)
+            
+            def log_message(self, format, *args):
+                pass  # Отключаем логи HTTP сервера
+        
+        return TelegramWebhookHandler
+    
+    def start(self):
+        """Запуск сервера в фоновом потоке"""
+        self.server = ThreadingHTTPServer((self.host, self.port), self._make_handler())
+        self.server.daemon_threads = True
+        if self.certfile:
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            context.load_cert_chain(self.certfile, self.keyfile)
+            self.server.socket = context.wrap_socket(self.server.socket, server_side=True)
+        
+        self.thread = threading.Thread(target=self.server.serve_forever, name='webhook-receiver', daemon=True)
+        self.thread.start()
+        logger.info(f"Webhook сервер запущен на {self.host}:{self.port}{self.path}")
+    
+    def stop(self):
+        """Остановка сервера"""
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
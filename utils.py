@@ -166,11 +166,8 @@ def create_stars_display(rating):
 
 def send_telegram_message(bot_token, chat_id, text, reply_markup=None):
     """Универсальная функция отправки сообщений"""
-    import json
-    import urllib.request
-    import urllib.parse
+    from telegram_api import get_api_client
     
-    url = f"https://api.telegram.org/bot{bot_token}/sendMessage"
     data = {
         'chat_id': chat_id,
         'text': text,
@@ -178,14 +175,11 @@ def send_telegram_message(bot_token, chat_id, text, reply_markup=None):
     }
     
     if reply_markup:
-        data['reply_markup'] = json.dumps(reply_markup)
+        data['reply_markup'] = reply_markup
     
     try:
-        data_encoded = urllib.parse.urlencode(data).encode('utf-8')
-        req = urllib.request.Request(url, data=data_encoded, method='POST')
-        with urllib.request.urlopen(req) as response:
-            result = json.loads(response.read().decode('utf-8'))
-            return result.get('ok', False)
+        result = get_api_client(bot_token).call('sendMessage', data, requeue=True)
+        return result.get('ok', False)
     except Exception as e:
         print(f"Ошибка отправки сообщения: {e}")
         return False
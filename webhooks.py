@@ -4,6 +4,7 @@
 
 import json
 from datetime import datetime
+from events import ORDER_STATUS_CHANGED
 
 class WebhookManager:
     def __init__(self, bot, db, security_manager):
@@ -82,6 +83,7 @@ class WebhookManager:
                 'UPDATE orders SET payment_status = "paid", status = "confirmed" WHERE id = ?',
                 (order_id,)
             )
+            self.db.publish_event(ORDER_STATUS_CHANGED, order_id=order_id, status='confirmed')
             
             # Получаем данные заказа
             order = self.db.execute_query(